@@ -1,661 +1,411 @@
 # main.py ds v17-2
+# Staged boot: motors are stopped and the control loop is ticking before the
+# access point, the web server and the web assets come up, all timed by
+# picobot_boot (GET /boot).
+from picobot_boot import BootTimer
+boot = BootTimer()
+
 import network
-import socket
 import json
-from time import sleep, ticks_ms, ticks_diff
-from machine import Pin, Timer
+from machine import Pin
 import picobot_motors
+import picobot_i2c
+import picobot_sensors
+from picobot_line import LineFollower, PARAMS
+from picobot_control import ControlLoop, asyncio
+from picobot_http import HttpServer, Router, send_response, send_file
+from picobot_telemetry import TelemetryHub, StatusRecord, StatusExchange
+from picobot_assets import AssetCache, load_source
+from picobot_profile import Profiler
+import picobot_log
+from picobot_log import logger
+from picobot_recorder import FlightRecorder
+from picobot_presets import PresetStore
+from picobot_safety import EmergencyStop, DeadMan
+boot.mark("imports")
+
+# Control loop: 'schedule' (Timer IRQ + micropython.schedule), 'asyncio' or
+# 'thread' (on core 1, away from Wi-Fi and the web server; falls back to
+# 'schedule' where it cannot start, see GET /loop)
+CONTROL_MODE = 'schedule'
+CONTROL_PERIOD_MS = 50
+# Telemetry stream (GET /events): how often a new frame may be pushed
+TELEMETRY_RATE_MS = 100
+# Hot-path profiler (GET /metrics); switch at run time with /metrics?enable=1
+PROFILE = False
+# Logging: records below LOG_LEVEL are dropped; with LOG_CONSOLE a low-priority
+# task prints the ring to USB serial, GET /log reads it either way
+LOG_LEVEL = picobot_log.INFO
+LOG_CONSOLE = True
+# Flight recorder: every tick of a run to flash, GET /flight.bin. Each flash
+# write also stops core 1, so in 'thread' mode ticks due then start late
+RECORD_RUNS = True
+# Named parameter presets on flash, GET /presets; the active one is applied
+# at boot
+LOAD_PRESET = True
+# Dead man: a running robot stops itself when the page that started it has
+# not sent GET /heartbeat?session=<n> for this long (0 = off); change at run
+# time with /safety?timeout=<ms>
+HEARTBEAT_TIMEOUT_MS = 1000
+# GPIO of a stop button to ground (None = none); its IRQ schedules the stop
+ESTOP_PIN = None
 
 # ------------------------
-# AP Setup
-# ------------------------
-ssid = 'picobot-ln'
-password = '12345678'
-led = Pin("LED", Pin.OUT)
-
-ap = network.WLAN(network.AP_IF)
-ap.config(essid=ssid, password=password)
-ap.active(True)
-
-while ap.active() == False:
-    pass
-
-print('Connection successful')
-print(ap.ifconfig())
-led.on()
-
-# ------------------------
-# Motor driver
+# Motor driver: first, so a soft reset never leaves the wheels turning
 # ------------------------
 motor_driver = picobot_motors.MotorDriver(debug=False)
+# Motor writes are staged in the driver's shadow registers and sent with one
+# flush() per control tick; unchanged channels never reach the bus
+motor_driver.autoflush = False
+motor_driver.StopAllMotors()
+motor_driver.flush()
+# One-transaction stop of every output, for the STOP button, the dead man
+# and ESTOP_PIN; see picobot_safety
+estop = EmergencyStop(motor_driver)
+boot.mark("motors_stopped")
 
 # ------------------------
 # Sensors: right → left
 # ------------------------
-sensors = [
-    Pin(8, Pin.IN, Pin.PULL_UP),   # Right
-    Pin(9, Pin.IN, Pin.PULL_UP),   # Right-middle
-    Pin(13, Pin.IN, Pin.PULL_UP),  # Center
-    Pin(14, Pin.IN, Pin.PULL_UP),  # Left-middle
-    Pin(15, Pin.IN, Pin.PULL_UP)   # Left
-]
+# GPIO 8 (Right), 9 (Right-middle), 13 (Center), 14 (Left-middle), 15 (Left),
+# sampled together in one read of the SIO GPIO_IN register
+sensors = picobot_sensors.make_reader(picobot_sensors.SENSOR_PINS)
 
 # ------------------------
-# Global variables
+# Robot state (owned by the control loop)
 # ------------------------
-robot_running = False
-mission_done = False
-line_lost = False
-line_lost_time = 0
-last_direction = "FORWARD"
-search_intensity = 1.0  # Start with normal intensity
-
-# Default parameters
-base_speed = 30
-slight_ratio = 0.9
-mild_ratio = 0.75
-hard_ratio = 0.6
-grace_period = 800  # Increased grace period for sharp turns
-search_ratio = 0.4  # Ratio for aggressive searching
+follower = LineFollower(motor_driver, sensors)
+follower.estop = estop
+# The web side reads the last tick from here, whole, whichever core ticks
+status_exchange = StatusExchange()
+follower.exchange = status_exchange
+follower.deadman = DeadMan(estop, HEARTBEAT_TIMEOUT_MS, CONTROL_PERIOD_MS)
+if ESTOP_PIN is not None:
+    estop_pin = Pin(ESTOP_PIN, Pin.IN, Pin.PULL_UP)
+    estop_pin.irq(trigger=Pin.IRQ_FALLING, handler=estop.trigger_irq)
+
+logger.level = LOG_LEVEL
+
+# Control loop; its first tick is timed, then it runs follower.tick directly
+def first_tick():
+    follower.tick()
+    boot.mark("first_tick")
+    control_loop.tick = follower.tick
+
+control_loop = ControlLoop(first_tick, period_ms=CONTROL_PERIOD_MS, mode=CONTROL_MODE)
+
+# Flight recorder, fed by the control tick and written out by its own task
+recorder = FlightRecorder(period_ms=CONTROL_PERIOD_MS)
+recorder.enabled = RECORD_RUNS
+follower.recorder = recorder
+
+# Presets: read from flash once the server is up, see bring_up()
+presets = PresetStore()
+
+# Profiler: the loop, the motor flush and the web server record into it
+profiler = Profiler(enabled=PROFILE)
+control_loop.profiler = profiler
+motor_driver.profiler = profiler
+boot.mark("control_ready")
 
 # ------------------------
-# HTML and JS content
+# AP Setup: started from main(), after the control loop
 # ------------------------
-html_content = """<!DOCTYPE html>
-<html lang="en">
-<head>
-<meta charset="UTF-8">
-<meta name="viewport" content="width=device-width, initial-scale=1.0">
-<title>PicoBot Line Follower</title>
-<link rel="stylesheet" href="/style.css">
-</head>
-<body>
-<h1>PicoBot Line Follower</h1>
-
-<div class="status-panel">
-    <div class="section-title">Robot Status</div>
-    <div class="sensor-container">
-        <div class="sensor-box" id="left">L</div>
-        <div class="sensor-box" id="lmid">LM</div>
-        <div class="sensor-box" id="center">C</div>
-        <div class="sensor-box" id="rmid">RM</div>
-        <div class="sensor-box" id="right">R</div>
-    </div>
-    <div class="status-container">
-        <div id="action">Action: -</div>
-        <div id="status">Status: -</div>
-    </div>
-</div>
-
-<div class="control-panel">
-    <div class="section-title">Robot Control</div>
-    <div>
-        <button class="start-btn" id="startBtn">START</button>
-        <button class="stop-btn" id="stopBtn">STOP</button>
-    </div>
-    <div class="section-title">Adjustments</div>
-    <div class="param-group">
-        <div class="param"><div class="label">Speed</div><input type="number" id="speed" value="30" min="0" max="100"></div>
-        <div class="param"><div class="label">Slight</div><input type="number" id="slight" value="0.9" step="0.05" min="0" max="1"></div>
-        <div class="param"><div class="label">Mild</div><input type="number" id="mild" value="0.75" step="0.05" min="0" max="1"></div>
-        <div class="param"><div class="label">Hard</div><input type="number" id="hard" value="0.6" step="0.05" min="0" max="1"></div>
-        <div class="param"><div class="label">Grace (ms)</div><input type="number" id="grace" value="800" min="0" max="5000"></div>
-        <div class="param"><div class="label">Search</div><input type="number" id="search" value="0.4" step="0.05" min="0" max="1"></div>
-    </div>
-    <button class="update-btn" id="updateBtn">Update Parameters</button>
-</div>
-
-<script src="/script.js"></script>
-</body>
-</html>"""
-
-css_content = """body { 
-    font-family: Arial, sans-serif; 
-    text-align: center; 
-    margin: 0;
-    padding: 10px;
-    background-color: #f0f0f0;
-}
-.status-panel {
-    background-color: white;
-    padding: 15px;
-    border-radius: 10px;
-    box-shadow: 0 2px 5px rgba(0,0,0,0.1);
-    margin-bottom: 15px;
-}
-.control-panel {
-    background-color: white;
-    padding: 15px;
-    border-radius: 10px;
-    box-shadow: 0 2px 5px rgba(0,0,0,0.1);
-    margin-bottom: 15px;
-}
-.param-group {
-    display: flex;
-    flex-wrap: wrap;
-    justify-content: center;
-    gap: 10px;
-    margin: 10px 0;
-}
-.param {
-    display: flex;
-    flex-direction: column;
-    align-items: center;
-    min-width: 80px;
-}
-button { 
-    font-size: 1.5em; 
-    padding: 15px 30px; 
-    margin: 10px;
-    min-width: 120px;
-    border: none;
-    border-radius: 8px;
-    cursor: pointer;
-}
-.start-btn {
-    background-color: #4CAF50;
-    color: white;
-}
-.stop-btn {
-    background-color: #f44336;
-    color: white;
-}
-.update-btn {
-    background-color: #2196F3;
-    color: white;
-    font-size: 1.2em;
-    padding: 10px 20px;
-}
-input[type=number] { 
-    font-size: 1.2em; 
-    width: 80px; 
-    text-align: center;
-    padding: 5px;
-    border: 1px solid #ccc;
-    border-radius: 4px;
-}
-.sensor-container {
-    display: flex;
-    justify-content: center;
-    flex-wrap: wrap;
-    margin: 15px 0;
-}
-.sensor-box { 
-    width: 50px; 
-    height: 50px; 
-    line-height: 50px; 
-    margin: 5px; 
-    border: 2px solid #000; 
-    font-weight: bold; 
-    font-size: 1.2em;
-    border-radius: 8px;
-}
-.status-container {
-    margin: 15px 0;
-    font-size: 1.2em;
-}
-#action, #status {
-    margin: 8px 0;
-    font-weight: bold;
-    padding: 8px;
-    border-radius: 5px;
-    background-color: #f8f8f8;
-}
-.label {
-    font-weight: bold;
-    margin-bottom: 5px;
-    font-size: 0.9em;
-}
-.section-title {
-    font-size: 1.3em;
-    font-weight: bold;
-    margin: 10px 0;
-    color: #333;
-}"""
-
-js_content = """// Initialize with current parameters
-function loadParams() {
-    fetch("/sensors")
-    .then(response => response.json())
-    .then(data => {
-        if (data.params) {
-            document.getElementById("speed").value = data.params.speed || 30;
-            document.getElementById("slight").value = data.params.slight || 0.9;
-            document.getElementById("mild").value = data.params.mild || 0.75;
-            document.getElementById("hard").value = data.params.hard || 0.6;
-            document.getElementById("grace").value = data.params.grace || 800;
-            document.getElementById("search").value = data.params.search || 0.4;
-        }
-    })
-    .catch(err => console.log("Error loading params:", err));
-}
-
-function startRobot() {
-    const speed = document.getElementById("speed").value;
-    const slight = document.getElementById("slight").value;
-    const mild = document.getElementById("mild").value;
-    const hard = document.getElementById("hard").value;
-    const grace = document.getElementById("grace").value;
-    const search = document.getElementById("search").value;
-    
-    fetch("/?action=start&speed=" + speed + "&slight=" + slight + "&mild=" + mild + "&hard=" + hard + "&grace=" + grace + "&search=" + search);
-}
-
-function stopRobot() {
-    fetch("/?action=stop");
-}
-
-function updateParams() {
-    const speed = document.getElementById("speed").value;
-    const slight = document.getElementById("slight").value;
-    const mild = document.getElementById("mild").value;
-    const hard = document.getElementById("hard").value;
-    const grace = document.getElementById("grace").value;
-    const search = document.getElementById("search").value;
-    
-    fetch("/?action=update&speed=" + speed + "&slight=" + slight + "&mild=" + mild + "&hard=" + hard + "&grace=" + grace + "&search=" + search);
-}
-
-function updateSensors() {
-    fetch("/sensors")
-    .then(response => response.json())
-    .then(data => {
-        let vals = data.sensors;
-        document.getElementById("left").style.backgroundColor = vals[4]==1?"green":"white";
-        document.getElementById("lmid").style.backgroundColor = vals[3]==1?"green":"white";
-        document.getElementById("center").style.backgroundColor = vals[2]==1?"green":"white";
-        document.getElementById("rmid").style.backgroundColor = vals[1]==1?"green":"white";
-        document.getElementById("right").style.backgroundColor = vals[0]==1?"green":"white";
-
-        document.getElementById("action").innerText = "Action: "+data.action;
-        document.getElementById("status").innerText = "Status: "+data.status;
-        
-        // Color code the status based on state
-        const statusElem = document.getElementById("status");
-        if (data.status.includes("Running")) {
-            statusElem.style.color = "green";
-        } else if (data.status.includes("Stopped") || data.status.includes("Mission accomplished")) {
-            statusElem.style.color = "blue";
-        } else if (data.status.includes("lost")) {
-            statusElem.style.color = "orange";
-        } else {
-            statusElem.style.color = "black";
-        }
-    })
-    .catch(err => console.log("Sensor update error:", err));
-}
-
-// Set up event listeners
-document.getElementById("startBtn").addEventListener("click", startRobot);
-document.getElementById("stopBtn").addEventListener("click", stopRobot);
-document.getElementById("updateBtn").addEventListener("click", updateParams);
-
-// Load parameters on page load and poll sensors every 200ms
-window.addEventListener("load", function() {
-    loadParams();
-    setInterval(updateSensors, 200);
-});"""
+ssid = 'picobot-ln'
+password = '12345678'
+led = Pin("LED", Pin.OUT)
+ap = network.WLAN(network.AP_IF)
 
 # ------------------------
-# Decide action
+# Web assets: built on first request or by bring_up(), from www/<file> when
+# present, else from the constants in picobot_web. Style and script are
+# cached for a day; the page (revalidated via ETag) links them with their
+# ETag as a version, so a firmware update still reaches the browser
 # ------------------------
-def decide_action(sensor_values):
-    if all(v == 1 for v in sensor_values):
-        return "ON JUNCTION"
-    if all(v == 0 for v in sensor_values):
-        return "LINE LOST"
-    
-    positions = [2, 1, 0, -1, -2]
-    weighted_sum = 0
-    active_sensors = 0
-    
-    for i in range(5):
-        if sensor_values[i] == 1:
-            weighted_sum += positions[i]
-            active_sensors += 1
-    
-    if active_sensors > 0:
-        weighted_sum = weighted_sum / active_sensors
-    
-    if weighted_sum > 1.2:
-        return "HARD RIGHT"
-    elif weighted_sum > 0.6:
-        return "MILD RIGHT"
-    elif weighted_sum > 0.2:
-        return "SLIGHT RIGHT"
-    elif weighted_sum < -1.2:
-        return "HARD LEFT"
-    elif weighted_sum < -0.6:
-        return "MILD LEFT"
-    elif weighted_sum < -0.2:
-        return "SLIGHT LEFT"
-    elif weighted_sum == 0 and any(v == 1 for v in sensor_values):
-        return "FORWARD"
-    else:
-        return "SEARCHING"
+assets = AssetCache()
+assets.add_lazy("/style.css", "text/css",
+                lambda: load_source("www/style.css", "picobot_web", "STYLE_CSS"), "max-age=86400")
+assets.add_lazy("/script.js", "application/javascript",
+                lambda: load_source("www/script.js", "picobot_web", "SCRIPT_JS"), "max-age=86400")
+
+def load_page():
+    html = load_source("www/index.html", "picobot_web", "INDEX_HTML")
+    for path in ("/style.css", "/script.js"):
+        link = b'"' + path.encode()
+        html = html.replace(link + b'"', link + b'?v=' + assets.get(path).etag[1:-1].encode() + b'"')
+    return html
+
+assets.add_lazy("/", "text/html", load_page, "no-cache")
 
 # ------------------------
-# Map action to motor speeds with aggressive line loss recovery
+# Routes
 # ------------------------
-def set_motor_action(action):
-    global last_direction, search_intensity
-    
-    if action == "FORWARD":
-        motor_driver.TurnMotor('LeftFront', 'forward', base_speed)
-        motor_driver.TurnMotor('LeftBack', 'forward', base_speed)
-        motor_driver.TurnMotor('RightFront', 'forward', base_speed)
-        motor_driver.TurnMotor('RightBack', 'forward', base_speed)
-        search_intensity = 1.0  # Reset search intensity
-        
-    elif action == "SLIGHT RIGHT":
-        motor_driver.TurnMotor('LeftFront', 'forward', base_speed)
-        motor_driver.TurnMotor('LeftBack', 'forward', base_speed)
-        motor_driver.TurnMotor('RightFront', 'forward', int(base_speed * slight_ratio))
-        motor_driver.TurnMotor('RightBack', 'forward', int(base_speed * slight_ratio))
-        search_intensity = 1.0  # Reset search intensity
-        
-    elif action == "MILD RIGHT":
-        motor_driver.TurnMotor('LeftFront', 'forward', base_speed)
-        motor_driver.TurnMotor('LeftBack', 'forward', base_speed)
-        motor_driver.TurnMotor('RightFront', 'forward', int(base_speed * mild_ratio))
-        motor_driver.TurnMotor('RightBack', 'forward', int(base_speed * mild_ratio))
-        search_intensity = 1.0  # Reset search intensity
-        
-    elif action == "HARD RIGHT":
-        motor_driver.TurnMotor('LeftFront', 'forward', base_speed)
-        motor_driver.TurnMotor('LeftBack', 'forward', base_speed)
-        motor_driver.TurnMotor('RightFront', 'forward', int(base_speed * hard_ratio))
-        motor_driver.TurnMotor('RightBack', 'forward', int(base_speed * hard_ratio))
-        search_intensity = 1.0  # Reset search intensity
-        
-    elif action == "SLIGHT LEFT":
-        motor_driver.TurnMotor('LeftFront', 'forward', int(base_speed * slight_ratio))
-        motor_driver.TurnMotor('LeftBack', 'forward', int(base_speed * slight_ratio))
-        motor_driver.TurnMotor('RightFront', 'forward', base_speed)
-        motor_driver.TurnMotor('RightBack', 'forward', base_speed)
-        search_intensity = 1.0  # Reset search intensity
-        
-    elif action == "MILD LEFT":
-        motor_driver.TurnMotor('LeftFront', 'forward', int(base_speed * mild_ratio))
-        motor_driver.TurnMotor('LeftBack', 'forward', int(base_speed * mild_ratio))
-        motor_driver.TurnMotor('RightFront', 'forward', base_speed)
-        motor_driver.TurnMotor('RightBack', 'forward', base_speed)
-        search_intensity = 1.0  # Reset search intensity
-        
-    elif action == "HARD LEFT":
-        motor_driver.TurnMotor('LeftFront', 'forward', int(base_speed * hard_ratio))
-        motor_driver.TurnMotor('LeftBack', 'forward', int(base_speed * hard_ratio))
-        motor_driver.TurnMotor('RightFront', 'forward', base_speed)
-        motor_driver.TurnMotor('RightBack', 'forward', base_speed)
-        search_intensity = 1.0  # Reset search intensity
-        
-    elif action == "ON JUNCTION":
-        motor_driver.StopAllMotors()
-        search_intensity = 1.0  # Reset search intensity
-        
-    elif action == "LINE LOST":
-        # Increase search intensity each time we lose the line for sharper turns
-        search_intensity *= 1.5
-        
-        # Aggressive turning when line is lost - much sharper turns
-        if ticks_diff(ticks_ms(), line_lost_time) < grace_period:
-            if "RIGHT" in last_direction:
-                # Very sharp right turn search
-                turn_speed = int(base_speed * search_ratio * search_intensity)
-                motor_driver.TurnMotor('LeftFront', 'forward', turn_speed)
-                motor_driver.TurnMotor('LeftBack', 'forward', turn_speed)
-                motor_driver.TurnMotor('RightFront', 'backward', turn_speed)
-                motor_driver.TurnMotor('RightBack', 'backward', turn_speed)
-            elif "LEFT" in last_direction:
-                # Very sharp left turn search
-                turn_speed = int(base_speed * search_ratio * search_intensity)
-                motor_driver.TurnMotor('LeftFront', 'backward', turn_speed)
-                motor_driver.TurnMotor('LeftBack', 'backward', turn_speed)
-                motor_driver.TurnMotor('RightFront', 'forward', turn_speed)
-                motor_driver.TurnMotor('RightBack', 'forward', turn_speed)
-            else:
-                # Forward was last direction, do gentle search
-                set_motor_action(last_direction)
-        else:
-            motor_driver.StopAllMotors()
-            search_intensity = 1.0  # Reset search intensity
-            
-    elif action == "SEARCHING":
-        # Use the same aggressive search pattern as LINE LOST
-        if ticks_diff(ticks_ms(), line_lost_time) < grace_period:
-            if "RIGHT" in last_direction:
-                turn_speed = int(base_speed * search_ratio * search_intensity)
-                motor_driver.TurnMotor('LeftFront', 'forward', turn_speed)
-                motor_driver.TurnMotor('LeftBack', 'forward', turn_speed)
-                motor_driver.TurnMotor('RightFront', 'backward', turn_speed)
-                motor_driver.TurnMotor('RightBack', 'backward', turn_speed)
-            elif "LEFT" in last_direction:
-                turn_speed = int(base_speed * search_ratio * search_intensity)
-                motor_driver.TurnMotor('LeftFront', 'backward', turn_speed)
-                motor_driver.TurnMotor('LeftBack', 'backward', turn_speed)
-                motor_driver.TurnMotor('RightFront', 'forward', turn_speed)
-                motor_driver.TurnMotor('RightBack', 'forward', turn_speed)
-            else:
-                set_motor_action(last_direction)
+router = Router()
+# (query key, name, type) for start/update
+PARAM_KEYS = tuple((name.encode(), name, kind) for name, attr, kind, default in PARAMS)
+
+def parse_params(request):
+    params = {}
+    query = request.query
+    for key, name, kind in PARAM_KEYS:
+        if key in query:
+            params[name] = kind(query[key].decode())
+    return params
+
+# Live telemetry stream; the hub keeps the connection
+@router.route("/events")
+async def serve_events(request, writer):
+    try:
+        rate = request.arg(b"rate", int)
+    except ValueError:
+        await send_response(writer, "text/plain", "Bad rate", 400)
+        return
+    if rate is not None:
+        telemetry.rate_ms = max(rate, CONTROL_PERIOD_MS)
+    if await telemetry.subscribe(writer):
+        return True
+    await send_response(writer, "text/plain", "Busy", 503)
+
+# Fixed 16-byte binary status record, see picobot_telemetry
+@router.route("/status.bin")
+async def serve_status(request, writer):
+    await status_record.send(writer)
+
+# Handle sensor requests: the control loop's last tick
+@router.route("/sensors")
+async def serve_sensors(request, writer):
+    # Proper HTTP response with CORS headers
+    await send_response(writer, "application/json", json.dumps(status_exchange.snapshot()))
+
+# Hot-path histograms; ?enable=1 / ?enable=0 switch recording, ?reset=1 clears
+@router.route("/metrics")
+async def serve_metrics(request, writer):
+    enable = request.arg(b"enable")
+    if enable is not None:
+        profiler.enable(enable == "1")
+    if request.arg(b"reset") == "1":
+        profiler.reset()
+    await send_response(writer, "application/json", json.dumps(profiler.report()))
+
+# Log ring as text; ?since=<next> returns only newer records, ?level=debug
+# changes what gets recorded
+@router.route("/log")
+async def serve_log(request, writer):
+    level = request.arg(b"level")
+    if level is not None:
+        try:
+            logger.level = picobot_log.level_from_name(level)
+        except ValueError:
+            await send_response(writer, "text/plain", "Unknown level", 400)
+            return
+    try:
+        since = request.arg(b"since", int, 0)
+    except ValueError:
+        await send_response(writer, "text/plain", "Bad since", 400)
+        return
+    next_seq, lines = logger.lines(since)
+    body = "\n".join(lines) + "\n" if lines else ""
+    await send_response(writer, "text/plain", body, headers="X-Log-Next: %d\r\n" % next_seq)
+
+# Flight recorder file of the last run; ?prev=1 for the run before
+@router.route("/flight.bin")
+async def serve_flight(request, writer):
+    if not status_exchange.running():
+        recorder.flush()
+    await send_file(writer, recorder.prev_path if request.arg(b"prev") == "1" else recorder.path)
+
+# Control loop and server counters; ?reset=1 restarts the loop's timing
+@router.route("/loop")
+async def serve_loop(request, writer):
+    if request.arg(b"reset") == "1":
+        control_loop.stats.reset()
+    data = control_loop.stats.report()
+    data['mode'] = control_loop.mode
+    data['fallback'] = control_loop.fallback
+    data['exchange'] = status_exchange.stats()
+    data['period_ms'] = control_loop.period_ms
+    data['http'] = http_server.stats()
+    data['telemetry'] = telemetry.stats()
+    data['assets'] = assets.stats()
+    data['log'] = logger.stats()
+    data['recorder'] = recorder.stats()
+    data['presets'] = presets.stats()
+    data['i2c'] = [bus.stats() for bus in picobot_i2c.buses()]
+    await send_response(writer, "application/json", json.dumps(data))
+
+# Presets: GET /presets lists them; ?action=load&name=... returns one,
+# activate applies it (and makes it the boot preset), save stores the given
+# parameters (the last posted ones for those left out) and delete removes one.
+# Only activate, save and delete write to flash
+@router.route("/presets")
+async def serve_presets(request, writer):
+    action = request.arg(b"action")
+    if action is None:
+        await send_response(writer, "application/json", json.dumps(presets.report()))
+        return
+    name = request.arg(b"name", str, "")
+    try:
+        if action == "load":
+            body = presets.get(name)
+        elif action == "activate":
+            follower.post("update", presets.activate(name))
+            presets.save()
+            body = presets.report()
+        elif action == "save":
+            params = follower.posted_params()
+            params.update(parse_params(request))
+            presets.put(name, params)
+            presets.save()
+            body = presets.report()
+        elif action == "delete":
+            presets.remove(name)
+            presets.save()
+            body = presets.report()
         else:
-            motor_driver.StopAllMotors()
-            search_intensity = 1.0  # Reset search intensity
-    
-    # Update last direction if not line lost or searching
-    if action not in ["LINE LOST", "SEARCHING"]:
-        last_direction = action
+            await send_response(writer, "text/plain", "Unknown action", 400)
+            return
+    except KeyError:
+        await send_response(writer, "text/plain", "No such preset", 404)
+        return
+    except ValueError as e:
+        await send_response(writer, "text/plain", str(e), 400)
+        return
+    except OSError:
+        await send_response(writer, "text/plain", "Flash write failed", 500)
+        return
+    await send_response(writer, "application/json", json.dumps(body))
 
-# ------------------------
-# Open socket
-# ------------------------
-def open_socket(ip):
-    addr = socket.getaddrinfo(ip, 80)[0][-1]
-    s = socket.socket()
-    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    s.bind(addr)
-    s.listen(1)
-    return s
+# Dead-man heartbeat from the page driving the robot, with the session number
+# its start got back; the reply is the timeout, so the page can pace its
+# beats. 409 once another start has taken over
+@router.route("/heartbeat")
+async def serve_heartbeat(request, writer):
+    try:
+        session = request.arg(b"session", int)
+    except ValueError:
+        await send_response(writer, "text/plain", "Bad session", 400)
+        return
+    if not follower.deadman.beat(session):
+        await send_response(writer, "text/plain", "Not the controlling session", 409)
+        return
+    await send_response(writer, "text/plain", str(follower.deadman.timeout_ms))
+
+# Emergency stop counters and timings; ?timeout=<ms> sets the dead-man
+# timeout, ?stop=1 stops at once
+@router.route("/safety")
+async def serve_safety(request, writer):
+    if request.arg(b"stop") == "1":
+        estop.trigger()
+    try:
+        timeout = request.arg(b"timeout", int)
+    except ValueError:
+        await send_response(writer, "text/plain", "Bad timeout", 400)
+        return
+    if timeout is not None:
+        follower.deadman.timeout_ms = max(timeout, 0)
+    data = estop.report()
+    data['deadman'] = follower.deadman.report(control_loop.stats)
+    await send_response(writer, "application/json", json.dumps(data))
+
+# Serve CSS and JavaScript files
+@router.route("/style.css")
+@router.route("/script.js")
+async def serve_asset(request, writer):
+    await assets.send(writer, assets.get(request.path.decode()), request.headers)
+
+# Serve the HTML page, or handle control actions; they are applied by the
+# control loop's next tick
+@router.route("/")
+async def serve_index(request, writer):
+    action = request.query.get(b"action")
+    if action is None:
+        await assets.send(writer, assets.get("/"), request.headers)
+        return
+    if action == b"stop":
+        # Outputs off now, in one transaction; the next tick ends the run
+        follower.post("stop")
+        estop.trigger(request.received)
+    elif action == b"start" or action == b"update":
+        try:
+            params = parse_params(request)
+        except ValueError:
+            await send_response(writer, "text/plain", "Bad parameter", 400)
+            return
+        if not follower.post(action.decode(), params):
+            await send_response(writer, "text/plain", "Busy", 503)
+            return
+        if action == b"start":
+            # The session number the page beats with, see /heartbeat
+            await send_response(writer, "text/plain", str(follower.deadman.begin()))
+            return
+    else:
+        await send_response(writer, "text/plain", "Unknown action", 400)
+        return
+    await send_response(writer, "text/plain", "OK")
+
+# Anything else gets the page, as before
+async def serve_page(request, writer):
+    await assets.send(writer, assets.get("/"), request.headers)
+
+router.default = serve_page
+
+# Boot phase times, see picobot_boot
+@router.route("/boot")
+async def serve_boot(request, writer):
+    await send_response(writer, "application/json", json.dumps(boot.report()))
+
+# The first request is timed, then the server calls the router directly
+async def first_request(request, writer):
+    keep = await router.dispatch(request, writer)
+    boot.mark("first_response")
+    http_server.handler = router.dispatch
+    return keep
+
+http_server = HttpServer(first_request, port=80)
+http_server.keep_headers = AssetCache.HEADERS
+http_server.profiler = profiler
+telemetry = TelemetryHub(follower, rate_ms=TELEMETRY_RATE_MS, exchange=status_exchange)
+status_record = StatusRecord(follower, status_exchange)
 
 # ------------------------
 # Main
 # ------------------------
-ap_ip = ap.ifconfig()[0]
-sock = open_socket(ap_ip)
-print("Server running on:", ap_ip)
-
-# Timer for line following
-line_follow_timer = Timer()
-
-def line_follow_callback(timer):
-    global robot_running, mission_done, line_lost, line_lost_time
-    
-    if not robot_running:
-        return
-        
-    vals = [s.value() for s in sensors]
-    act = decide_action(vals)
-    
-    if act == "ON JUNCTION":
-        motor_driver.StopAllMotors()
-        mission_done = True
-        robot_running = False
-        print("Mission accomplished - at junction")
-        
-    elif act == "LINE LOST":
-        if not line_lost:
-            line_lost = True
-            line_lost_time = ticks_ms()
-            print("Line lost - starting aggressive search")
-        elif ticks_diff(ticks_ms(), line_lost_time) >= grace_period:
-            motor_driver.StopAllMotors()
-            print("Line lost - stopped after grace period")
-        else:
-            # Continue with aggressive search during grace period
-            set_motor_action(act)
-            
+async def bring_up():
+    "AP, web server, presets and assets, without holding up the control loop"
+    ap.config(essid=ssid, password=password)
+    ap.active(True)
+    while not ap.active():
+        await asyncio.sleep_ms(10)
+    boot.mark("ap_up")
+    print('Connection successful')
+    print(ap.ifconfig())
+    led.on()
+    ap_ip = ap.ifconfig()[0]
+    await http_server.start(ap_ip)
+    boot.mark("http_listening")
+    print("Server running on:", ap_ip)
+    # A missing or damaged store just leaves the defaults
+    if LOAD_PRESET and presets.load() and presets.active is not None:
+        follower.post("update", presets.get(presets.active))
+        print("Preset:", presets.active)
+    boot.mark("preset_loaded")
+    await assets.warm()
+    boot.mark("assets_ready")
+    print(boot.summary())
+
+async def main():
+    if CONTROL_MODE == 'asyncio':
+        asyncio.create_task(control_loop.run())
     else:
-        if line_lost:
-            line_lost = False
-            print("Line found - resuming normal operation")
-        
-        # Set motors based on action
-        set_motor_action(act)
-    
-    print("Sensors:", vals, "Action:", act, "Search intensity:", search_intensity)
-
-line_follow_timer.init(period=50, mode=Timer.PERIODIC, callback=line_follow_callback)
-
-while True:
-    try:
-        client, addr = sock.accept()
-        request = client.recv(1024)
-        request_str = request.decode()
-        print("Request:", request_str)
-
-        # Handle sensor requests
-        if "GET /sensors" in request_str:
-            vals = [s.value() for s in sensors]
-            act = decide_action(vals)
-            
-            if mission_done:
-                status = "Mission accomplished"
-            elif line_lost and ticks_diff(ticks_ms(), line_lost_time) >= grace_period:
-                status = "Line lost - stopped"
-            elif line_lost:
-                status = "Line lost - searching"
-            elif robot_running:
-                status = "Running"
-            else:
-                status = "Stopped"
-
-            data = {
-                'sensors': vals, 
-                'action': act, 
-                'status': status,
-                'params': {
-                    'speed': base_speed,
-                    'slight': slight_ratio,
-                    'mild': mild_ratio,
-                    'hard': hard_ratio,
-                    'grace': grace_period,
-                    'search': search_ratio
-                }
-            }
-            
-            # Proper HTTP response with CORS headers
-            response = "HTTP/1.1 200 OK\r\n"
-            response += "Content-Type: application/json\r\n"
-            response += "Access-Control-Allow-Origin: *\r\n"
-            response += "Connection: close\r\n\r\n"
-            response += json.dumps(data)
-            
-            client.send(response.encode())
-            
-        # Handle control actions
-        elif "GET /?action=start" in request_str:
-            robot_running = True
-            mission_done = False
-            line_lost = False
-            search_intensity = 1.0  # Reset search intensity
-            
-            # Extract parameters
-            if "speed=" in request_str:
-                base_speed = int(request_str.split("speed=")[1].split("&")[0])
-            if "slight=" in request_str:
-                slight_ratio = float(request_str.split("slight=")[1].split("&")[0])
-            if "mild=" in request_str:
-                mild_ratio = float(request_str.split("mild=")[1].split("&")[0])
-            if "hard=" in request_str:
-                hard_ratio = float(request_str.split("hard=")[1].split("&")[0])
-            if "grace=" in request_str:
-                grace_period = int(request_str.split("grace=")[1].split("&")[0])
-            if "search=" in request_str:
-                search_ratio = float(request_str.split("search=")[1].split("&")[0])
-            
-            print(f"Starting with speed={base_speed}, ratios: slight={slight_ratio}, mild={mild_ratio}, hard={hard_ratio}, grace={grace_period}, search={search_ratio}")
-            
-            response = "HTTP/1.1 200 OK\r\n"
-            response += "Content-Type: text/plain\r\n"
-            response += "Access-Control-Allow-Origin: *\r\n"
-            response += "Connection: close\r\n\r\n"
-            response += "OK"
-            
-            client.send(response.encode())
-            
-        elif "GET /?action=stop" in request_str:
-            robot_running = False
-            motor_driver.StopAllMotors()
-            search_intensity = 1.0  # Reset search intensity
-            print("Stopped by user")
-            
-            response = "HTTP/1.1 200 OK\r\n"
-            response += "Content-Type: text/plain\r\n"
-            response += "Access-Control-Allow-Origin: *\r\n"
-            response += "Connection: close\r\n\r\n"
-            response += "OK"
-            
-            client.send(response.encode())
-            
-        elif "GET /?action=update" in request_str:
-            # Update parameters without starting the robot
-            if "speed=" in request_str:
-                base_speed = int(request_str.split("speed=")[1].split("&")[0])
-            if "slight=" in request_str:
-                slight_ratio = float(request_str.split("slight=")[1].split("&")[0])
-            if "mild=" in request_str:
-                mild_ratio = float(request_str.split("mild=")[1].split("&")[0])
-            if "hard=" in request_str:
-                hard_ratio = float(request_str.split("hard=")[1].split("&")[0])
-            if "grace=" in request_str:
-                grace_period = int(request_str.split("grace=")[1].split("&")[0])
-            if "search=" in request_str:
-                search_ratio = float(request_str.split("search=")[1].split("&")[0])
-            
-            print(f"Updated parameters: speed={base_speed}, ratios: slight={slight_ratio}, mild={mild_ratio}, hard={hard_ratio}, grace={grace_period}, search={search_ratio}")
-            
-            response = "HTTP/1.1 200 OK\r\n"
-            response += "Content-Type: text/plain\r\n"
-            response += "Access-Control-Allow-Origin: *\r\n"
-            response += "Connection: close\r\n\r\n"
-            response += "OK"
-            
-            client.send(response.encode())
-            
-        # Serve CSS file
-        elif "GET /style.css" in request_str:
-            response = "HTTP/1.1 200 OK\r\n"
-            response += "Content-Type: text/css\r\n"
-            response += "Access-Control-Allow-Origin: *\r\n"
-            response += "Connection: close\r\n\r\n"
-            response += css_content
-            
-            client.send(response.encode())
-            
-        # Serve JavaScript file
-        elif "GET /script.js" in request_str:
-            response = "HTTP/1.1 200 OK\r\n"
-            response += "Content-Type: application/javascript\r\n"
-            response += "Access-Control-Allow-Origin: *\r\n"
-            response += "Connection: close\r\n\r\n"
-            response += js_content
-            
-            client.send(response.encode())
-            
-        else:
-            # Serve HTML page
-            response = "HTTP/1.1 200 OK\r\n"
-            response += "Content-Type: text/html\r\n"
-            response += "Access-Control-Allow-Origin: *\r\n"
-            response += "Connection: close\r\n\r\n"
-            response += html_content
-            
-            client.send(response.encode())
-
-        client.close()
-
-    except Exception as e:
-        print("Error:", e)
-        try:
-            client.close()
-        except:
-            pass
\ No newline at end of file
+        control_loop.start()
+        if control_loop.fallback:
+            print("Control loop on core 0:", control_loop.fallback)
+    asyncio.create_task(bring_up())
+    asyncio.create_task(telemetry.run())
+    if LOG_CONSOLE:
+        asyncio.create_task(logger.run())
+    asyncio.create_task(recorder.run())
+    while True:
+        await asyncio.sleep_ms(1000)
+
+asyncio.run(main())
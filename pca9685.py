@@ -4,9 +4,29 @@
 '''
 @author Kevin McAleer
 '''
+# The one PCA9685 driver for the robot: the motors (picobot_motors) and the
+# arm (picobot_arm) both use it, each on a picobot_i2c.I2CBus, which
+# serialises access, retries failed transfers and counts them. With register
+# auto-increment on (the default), a channel or a run of channels is a single
+# write; the camelCase methods are the interface picobot_motors had.
 
+import math
 import ustruct
 import time
+import picobot_i2c
+
+MODE1 = 0x00
+PRESCALE = 0xFE
+LED0_ON_L = 0x06
+MODE1_RESTART = 0x80
+MODE1_AI = 0x20
+MODE1_SLEEP = 0x10
+# Writes to the ALL_LED registers go to every channel at once; bit 4 of an
+# OFF_H register is the channel's full-OFF bit, which overrides its counts
+ALL_LED_ON_L = 0xFA
+ALL_LED_OFF_H = 0xFD
+LED_FULL = 0x10
+_FULL_OFF = bytes([LED_FULL])
 
 
 class PCA9685:
@@ -14,46 +34,94 @@ class PCA9685:
     This class models the PCA9685 board, used to control up to 16
     servos, using just 2 wires for control over the I2C interface
     """
-    def __init__(self, i2c, address=0x40):
+    def __init__(self, i2c, address=0x40, auto_increment=True, debug=False):
         """
         class constructor
 
         Args:
-            i2c ([I2C Class, from the build in machine library]): This is used to 
-            bring in the i2c object, which can be created by 
-            > i2c = I2C(id=0, sda=Pin(0), scl=Pin(1))
+            i2c: a picobot_i2c.I2CBus, e.g. picobot_i2c.get(0, scl=21, sda=20);
+            a plain I2C object is wrapped in an I2CBus of its own
             address (hexadecimal, optional): [description]. Defaults to 0x40.
+            auto_increment: multi-byte writes to consecutive registers;
+            without it every register byte is a transaction of its own
         """
-        self.i2c = i2c
+        if not isinstance(i2c, picobot_i2c.I2CBus):
+            i2c = picobot_i2c.I2CBus(i2c=i2c)
+        self.bus = i2c
         self.address = address
+        self.auto_increment = auto_increment
+        self.debug = debug
+        self._buf = bytearray(4)
         self.reset()
 
+    @property
+    def i2c(self):
+        "The bus's I2C object, e.g. for its counters in the simulator"
+        return self.bus.i2c
+
     def _write(self, address, value):
-        self.i2c.writeto_mem(self.address, address, bytearray([value]))
+        self.bus.writeto_mem(self.address, address, bytes([value]))
+        if self.debug:
+            print("I2C: Write 0x%02X to register 0x%02X" % (value, address))
 
     def _read(self, address):
-        return self.i2c.readfrom_mem(self.address, address, 1)[0]
+        return self.bus.readfrom_mem(self.address, address, 1)[0]
 
     def reset(self):
-        self._write(0x00, 0x00) # Mode1
+        if self.debug:
+            print("Reseting PCA9685")
+        self._write(MODE1, MODE1_AI if self.auto_increment else 0x00) # Mode1
 
     def freq(self, freq=None):
         if freq is None:
-            return int(25000000.0 / 4096 / (self._read(0xfe) - 0.5))
-        prescale = int(25000000.0 / 4096.0 / freq + 0.5)
-        old_mode = self._read(0x00) # Mode 1
-        self._write(0x00, (old_mode & 0x7F) | 0x10) # Mode 1, sleep
-        self._write(0xfe, prescale) # Prescale
-        self._write(0x00, old_mode) # Mode 1
-        time.sleep_us(5)
-        self._write(0x00, old_mode | 0xa1) # Mode 1, autoincrement on
+            return int(25000000.0 / 4096 / (self._read(PRESCALE) + 1) + 0.5)
+        prescale = math.floor(25000000.0 / 4096.0 / freq - 1.0 + 0.5)
+        if self.debug:
+            print("Setting PWM frequency to %d Hz, pre-scale %d" % (freq, prescale))
+        old_mode = self._read(MODE1) # Mode 1
+        if not old_mode & MODE1_SLEEP and self._read(PRESCALE) == prescale:
+            return  # already running at this rate, e.g. after a soft reset
+        awake = old_mode & ~(MODE1_SLEEP | MODE1_RESTART)
+        self._write(MODE1, awake | MODE1_SLEEP) # Mode 1, sleep
+        self._write(PRESCALE, prescale) # Prescale
+        self._write(MODE1, awake) # Mode 1
+        time.sleep_us(500) # oscillator start-up, at most 500 us
+        self._write(MODE1, awake | MODE1_RESTART) # Mode 1, restart
 
     def pwm(self, index, on=None, off=None):
         if on is None or off is None:
-            data = self.i2c.readfrom_mem(self.address, 0x06 + 4 * index, 4)
+            data = self.bus.readfrom_mem(self.address, LED0_ON_L + 4 * index, 4)
             return ustruct.unpack('<HH', data)
-        data = ustruct.pack('<HH', on, off)
-        self.i2c.writeto_mem(self.address, 0x06 + 4 * index,  data)
+        if self.auto_increment:
+            ustruct.pack_into('<HH', self._buf, 0, on, off)
+            self.bus.writeto_mem(self.address, LED0_ON_L + 4 * index, self._buf)
+        else:
+            reg = LED0_ON_L + 4 * index
+            self._write(reg, on & 0xFF)
+            self._write(reg + 1, on >> 8)
+            self._write(reg + 2, off & 0xFF)
+            self._write(reg + 3, off >> 8)
+        if self.debug:
+            print("channel: %d  LED_ON: %d LED_OFF: %d" % (index, on, off))
+
+    def pwm_block(self, index, data):
+        # ON/OFF counts for consecutive channels from index, 4 bytes ('<HH')
+        # each, in one auto-increment write
+        if not self.auto_increment:
+            raise OSError("pwm_block needs MODE1 auto-increment")
+        self.bus.writeto_mem(self.address, LED0_ON_L + 4 * index, data)
+        if self.debug:
+            print("channels: %d..%d block write" % (index, index + len(data) // 4 - 1))
+
+    def all_off(self):
+        """
+        Every output to full OFF in one single-byte transaction, with or
+        without auto-increment. Writing a channel's registers afterwards
+        clears its full-OFF bit again.
+        """
+        self.bus.writeto_mem(self.address, ALL_LED_OFF_H, _FULL_OFF)
+        if self.debug:
+            print("all channels full OFF")
 
     def duty(self, index, value=None, invert=False):
         if value is None:
@@ -76,3 +144,22 @@ class PCA9685:
             self.pwm(index, 4096, 0)
         else:
             self.pwm(index, 0, value)
+
+    # ------------------------
+    # picobot_motors interface
+    # ------------------------
+    write = _write
+    read = _read
+    setPWMFreq = freq
+    setPWM = pwm
+    setPWMBlock = pwm_block
+
+    def setServoPulse(self, channel, pulse):
+        pulse = pulse * (4095 / 100)
+        self.setPWM(channel, 0, int(pulse))
+
+    def setLevel(self, channel, value):
+        if (value == 1):
+              self.setPWM(channel, 0, 4095)
+        else:
+              self.setPWM(channel, 0, 0)
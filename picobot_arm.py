@@ -1,18 +1,34 @@
 from pca9685 import PCA9685
-from machine import I2C, Pin
+from machine import Pin
+import picobot_i2c
+from picobot_motion import MotionEngine, PulseTable, TrajectoryLibrary, MIN_PULSE, MAX_PULSE
 import time
 
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
 class PicoBotArm:
-    def __init__(self, sda_pin=2, scl_pin=3, i2c_id=1, init_servos=True):
+    def __init__(self, sda_pin=2, scl_pin=3, i2c_id=1, init_servos=True, calibration=None,
+                 freq=400000):
         """
         Инициализира PicoBotArm с I2C и PCA9685.
+        :param calibration: (импулс при 0°, импулс при 180°) за всеки от
+                            каналите 0-2; по подразбиране 102-512 за всички.
+        :param freq: Най-високата честота на I2C шината; пада по-ниско, ако
+                     връзката не я позволява.
         """
         self.sda = Pin(sda_pin)
         self.scl = Pin(scl_pin)
         self.i2c_id = i2c_id
-        self.i2c = I2C(id=self.i2c_id, sda=self.sda, scl=self.scl)
-        self.pca = PCA9685(i2c=self.i2c)
+        # Общата шина от picobot_i2c: заключване, повторни опити и броячи
+        self.bus = picobot_i2c.get(i2c_id, scl=scl_pin, sda=sda_pin, freq=freq)
+        self.bus.probe(0x40)
+        self.pca = PCA9685(self.bus)
         self.pca.freq(50)
+        # Таблица ъгъл → импулс за каналите 0-2, изчислена веднъж
+        self.table = PulseTable(calibration or ((MIN_PULSE, MAX_PULSE),) * 3)
         
         # Запазване на текущите ъгли
         self.current_angles = {0: 0, 1: 0, 2: 0}  # Начални стойности
@@ -20,6 +36,18 @@ class PicoBotArm:
         if init_servos:
             self.init_servos()  # Автоматична инициализация при създаване на обект
 
+        # Двигател за едновременно, неблокиращо движение на трите стави;
+        # споделя current_angles с методите по-долу
+        self.motion = MotionEngine(self.pca, channels=(0, 1, 2), angles=self.current_angles,
+                                   pulse=self.table)
+        # Траектории от arm/<име>.json, компилирани в кадри при първа употреба
+        self.library = TrajectoryLibrary(self.table)
+
+    @property
+    def i2c(self):
+        "Текущият I2C обект на шината; recover() го създава наново"
+        return self.bus.i2c
+
     def control_servo(self, channel, angle):
         """
         Задава ъгъл на серво мотор за конкретен канал.
@@ -30,9 +58,10 @@ class PicoBotArm:
             raise ValueError("Невалиден ъгъл. Задайте стойност между 0 и 180 градуса.")
         
         # Преобразуване на ъгъла в PWM duty cycle
-        min_pulse = 102  # Минимална стойност на импулса (1 ms)
-        max_pulse = 512  # Максимална стойност на импулса (2 ms)
-        pulse = int(min_pulse + (angle / 180.0) * (max_pulse - min_pulse))
+        if channel < len(self.table.tables):
+            pulse = self.table(channel, angle)
+        else:
+            pulse = int(MIN_PULSE + (angle / 180.0) * (MAX_PULSE - MIN_PULSE))
         self.pca.pwm(channel, 0, pulse)
 
     def smooth_move_servo(self, channel, target_angle, step=1, delay=0.02):
@@ -74,3 +103,49 @@ class PicoBotArm:
             self.control_servo(channel, angle)
             self.current_angles[channel] = angle  # Установява текущите стойности
 
+    # ------------------------
+    # Неблокиращо движение (picobot_motion)
+    # ------------------------
+    def move(self, angles, velocity=None, accel=None, profile=None, duration_ms=None):
+        """
+        Започва едновременно движение на ставите и връща веднага.
+        :param angles: {канал: ъгъл} или ъгли за канали 0, 1, 2.
+        :param velocity: Максимална скорост (градуси/s).
+        :param accel: Максимално ускорение (градуси/s^2).
+        :param profile: "linear", "trapezoid" или "smooth".
+        :param duration_ms: Минимална продължителност на движението.
+        :return: Планираната продължителност в ms.
+        Движението се изпълнява от задачата start_motion().
+        """
+        return self.motion.move(angles, velocity, accel, profile, duration_ms)
+
+    async def move_to(self, angles, velocity=None, accel=None, profile=None, duration_ms=None):
+        """
+        Като move(), но изчаква края на движението, без да блокира другите задачи.
+        """
+        self.motion.move(angles, velocity, accel, profile, duration_ms)
+        await self.motion.wait()
+
+    def start_motion(self):
+        """
+        Стартира задачата на двигателя (uasyncio) и я връща.
+        """
+        return asyncio.create_task(self.motion.run())
+
+    def stop_motion(self):
+        """
+        Спира текущото движение там, където е стигнало.
+        """
+        self.motion.moving = False
+
+    async def play(self, name, velocity=None):
+        """
+        Изпълнява траектория: първо отива до началната ѝ поза, после
+        изпраща готовите кадри.
+        :param name: Име на траектория в self.library (arm/<име>.json).
+        :param velocity: Скорост на отиване до началната поза (градуси/s).
+        """
+        track = self.library.load(name)
+        await self.move_to(track.start_angles(), velocity)
+        self.motion.play(track)
+        await self.motion.wait()
@@ -0,0 +1,139 @@
+# picobot_assets.py
+# Static files served from complete, prebuilt responses.
+#
+# Each asset is turned into immutable bytes once (status line, headers and
+# body), so serving it allocates nothing new. When the body compresses, a
+# gzip variant is kept too and sent to clients whose Accept-Encoding allows
+# it. Every asset carries an ETag; If-None-Match gets a prebuilt 304.
+#
+# Assets added with add_lazy() are built on first use (or by warm(), once the
+# robot is up), so none of that work sits on the boot path.
+import binascii
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+try:
+    import deflate
+    import io
+except ImportError:
+    deflate = None
+    try:
+        import gzip
+    except ImportError:
+        gzip = None
+
+CHUNK = 1024  # bytes handed to the socket per write
+
+
+def gzip_bytes(data):
+    "gzip-compresses data, or returns None when this build cannot compress"
+    try:
+        if deflate is not None:
+            buf = io.BytesIO()
+            with deflate.DeflateIO(buf, deflate.GZIP) as f:
+                f.write(data)
+            return buf.getvalue()
+        if gzip is not None:
+            return gzip.compress(data, mtime=0)
+    except (AttributeError, OSError, ValueError):
+        pass  # firmware built without compression support
+    return None
+
+
+def load_source(path, module, name):
+    """
+    Asset body: the file at `path` if there is one, else the bytes constant
+    `name` of `module`, which is imported here on first use
+    """
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        pass
+    return getattr(__import__(module), name)
+
+
+class StaticAsset:
+    def __init__(self, content_type, body, cache_control, gz=None):
+        if isinstance(body, str):
+            body = body.encode()
+        self.etag = '"%08x"' % (binascii.crc32(body) & 0xFFFFFFFF)
+        head = ("HTTP/1.1 200 OK\r\n"
+                "Content-Type: %s\r\n"
+                "Cache-Control: %s\r\n"
+                "ETag: %s\r\n"
+                "Access-Control-Allow-Origin: *\r\n"
+                "Connection: close\r\n") % (content_type, cache_control, self.etag)
+        self.plain = (head + "Content-Length: %d\r\n\r\n" % len(body)).encode() + body
+        if gz is None:
+            gz = gzip_bytes(body)
+        if gz is not None and len(gz) < len(body):
+            self.gzip = (head + "Content-Encoding: gzip\r\n"
+                         "Vary: Accept-Encoding\r\n"
+                         "Content-Length: %d\r\n\r\n" % len(gz)).encode() + gz
+        else:
+            self.gzip = None
+        self.not_modified = ("HTTP/1.1 304 Not Modified\r\n"
+                             "Cache-Control: %s\r\n"
+                             "ETag: %s\r\n"
+                             "Connection: close\r\n\r\n" % (cache_control, self.etag)).encode()
+
+    def response(self, headers):
+        "Picks the prebuilt response for a request's headers"
+        if headers.get('if-none-match') == self.etag:
+            return self.not_modified
+        if self.gzip is not None and 'gzip' in headers.get('accept-encoding', ''):
+            return self.gzip
+        return self.plain
+
+
+class AssetCache:
+    # Request headers the cache looks at; add them to HttpServer.keep_headers
+    HEADERS = ('accept-encoding', 'if-none-match')
+
+    def __init__(self):
+        self.assets = {}
+        self.lazy = {}  # path -> (content_type, load(), cache_control), until built
+        self.served = 0
+        self.not_modified = 0
+
+    def add(self, path, content_type, body, cache_control="max-age=3600", gz=None):
+        self.assets[path] = StaticAsset(content_type, body, cache_control, gz)
+
+    def add_lazy(self, path, content_type, load, cache_control="max-age=3600"):
+        "Like add(), with the body from load() when the asset is first needed"
+        self.lazy[path] = (content_type, load, cache_control)
+
+    def get(self, path):
+        asset = self.assets.get(path)
+        if asset is None and path in self.lazy:
+            content_type, load, cache_control = self.lazy.pop(path)
+            self.add(path, content_type, load(), cache_control)
+            asset = self.assets[path]
+        return asset
+
+    async def warm(self):
+        "Builds the lazy assets one at a time, yielding in between"
+        for path in list(self.lazy):
+            self.get(path)
+            await asyncio.sleep_ms(0)
+
+    async def send(self, writer, asset, headers):
+        data = asset.response(headers)
+        if data is asset.not_modified:
+            self.not_modified += 1
+        self.served += 1
+        mv = memoryview(data)
+        for i in range(0, len(data), CHUNK):
+            writer.write(mv[i:i + CHUNK])
+            await writer.drain()
+
+    def stats(self):
+        sizes = {}
+        for path, asset in self.assets.items():
+            sizes[path] = [len(asset.plain), len(asset.gzip) if asset.gzip else 0]
+        return {'served': self.served, 'not_modified': self.not_modified, 'sizes': sizes,
+                'pending': list(self.lazy)}
@@ -0,0 +1,348 @@
+# picobot_bench.py
+# Micro-benchmarks of the control and web hot paths. The same code runs on
+# the robot and on a PC:
+#   device - import picobot_bench; picobot_bench.main()
+#            ticks_us timing and gc.mem_alloc deltas. Lift the wheels first:
+#            the motor benchmarks drive the real PCA9685 at BENCH_SPEED.
+#   host   - python -m picobot_sim.bench, which adds I2C transaction and
+#            byte counts and allocation figures from the fakes
+# The report is one JSON document, {"version", "platform", "rounds",
+# "results": {name: {...}}}, so runs can be compared across versions.
+#
+# jitter() is separate and device only: control-tick start latency per
+# ControlLoop mode, with core 0 idle and then busy the way page loads keep it
+# (allocation, garbage collection, JSON responses; no flash writes).
+import gc
+import json
+import sys
+from time import ticks_us, ticks_ms, ticks_add, ticks_diff, sleep_ms
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+import picobot_motors
+import picobot_sensors
+from picobot_line import LineFollower, ACTIONS, decide_action
+from picobot_http import HttpServer, send_response
+from picobot_control import ControlLoop
+
+FORMAT_VERSION = 1
+BENCH_SPEED = 20  # % duty for benchmarks that drive the motors
+HTTP_PORT = 8080
+
+# Off by default on the robot: needs a loopback-capable network stack
+DEVICE_SKIP = ("http",)
+
+
+class Probe:
+    """
+    Counters around a measured block. This one reports bytes allocated per
+    operation from gc.mem_alloc() where the port has it; the host harness
+    subclasses it with bus and tracemalloc counters.
+    """
+    def begin(self):
+        gc.collect()
+        gc.disable()  # no collection inside the block, so the delta is what was allocated
+        self._alloc = gc.mem_alloc() if hasattr(gc, 'mem_alloc') else None
+
+    def end(self, n):
+        gc.enable()
+        if self._alloc is None:
+            return {}
+        return {'alloc_bytes_per_op': (gc.mem_alloc() - self._alloc) // n}
+
+
+class _Writer:
+    "Stream writer that only counts, for building responses off the network"
+    def __init__(self):
+        self.bytes = 0
+
+    def write(self, data):
+        self.bytes += len(data)
+
+    async def drain(self):
+        pass
+
+
+def _run_sync(coro):
+    "Runs a coroutine that never really suspends, without an event loop"
+    try:
+        while True:
+            coro.send(None)
+    except StopIteration:
+        pass
+
+
+class Benchmarks:
+    """
+    Each bench_<name> method sets up and returns a function doing one
+    operation; run() times `rounds` calls of it.
+    """
+    def __init__(self, i2c=None, sensors=None):
+        self.driver = picobot_motors.MotorDriver(i2c=i2c)
+        self.sensors = sensors if sensors is not None else picobot_sensors.make_reader()
+        self.follower = LineFollower(self.driver, self.sensors)
+        self.follower.post("update", {'speed': BENCH_SPEED})
+        self.follower.tick()
+
+    def names(self):
+        return [n[6:] for n in dir(self) if n.startswith("bench_")] + ["http"]
+
+    # ------------------------
+    # Line logic
+    # ------------------------
+    def bench_decide_action(self):
+        states = [[(bits >> i) & 1 for i in range(5)] for bits in range(32)]
+        state = [0]
+
+        def op():
+            i = state[0]
+            decide_action(states[i])
+            state[0] = (i + 1) & 31
+        return op
+
+    def bench_decide_table(self):
+        table = self.follower.decide_table
+        state = [0]
+
+        def op():
+            i = state[0]
+            table[i]
+            state[0] = (i + 1) & 31
+        return op
+
+    def bench_set_motor_action(self):
+        "Alternates two actions so every call reaches the bus"
+        f = self.follower
+        driver = self.driver
+        driver.autoflush = False
+        acts = (ACTIONS[0], ACTIONS[1])
+        state = [0]
+
+        def op():
+            i = state[0]
+            f.set_motor_action(acts[i])
+            driver.flush()
+            state[0] = i ^ 1
+        return op
+
+    def bench_tick_idle(self):
+        f = self.follower
+        f.post("stop")
+        f.tick()
+        return f.tick
+
+    def bench_tick_running(self):
+        "A full control tick while following; the result depends on what the sensors see"
+        f = self.follower
+        self.driver.autoflush = False
+        f.post("start", {'speed': BENCH_SPEED})
+        f.tick()
+        return f.tick
+
+    # ------------------------
+    # Motor driver
+    # ------------------------
+    def bench_setPWM(self):
+        pwm = self.driver.pwm
+        state = [0]
+
+        def op():
+            i = state[0]
+            pwm.setPWM(0, 0, 1000 + i)
+            state[0] = i ^ 1
+        return op
+
+    def bench_TurnMotor(self):
+        driver = self.driver
+        driver.autoflush = True
+        speeds = (BENCH_SPEED, BENCH_SPEED // 2)
+        state = [0]
+
+        def op():
+            i = state[0]
+            driver.TurnMotor('LeftFront', 'forward', speeds[i])
+            state[0] = i ^ 1
+        return op
+
+    def bench_StopAllMotors(self):
+        "Cold stop: the chip state is unknown, so every channel in use is rewritten"
+        driver = self.driver
+        driver.autoflush = True
+        driver.DriveSides(BENCH_SPEED, BENCH_SPEED)
+
+        def op():
+            driver.invalidate()
+            driver.StopAllMotors()
+        return op
+
+    def bench_EmergencyStop(self):
+        "Every output off in one single-byte write (ALL_LED_OFF_H), whatever the shadow holds"
+        driver = self.driver
+        driver.autoflush = True
+        driver.DriveSides(BENCH_SPEED, BENCH_SPEED)
+        return driver.EmergencyStop
+
+    def bench_StopAllMotors_repeat(self):
+        "Already stopped: the shadow registers make it free"
+        driver = self.driver
+        driver.autoflush = True
+        driver.StopAllMotors()
+        return driver.StopAllMotors
+
+    # ------------------------
+    # Web
+    # ------------------------
+    def bench_sensors_json(self):
+        f = self.follower
+        return lambda: json.dumps(f.snapshot())
+
+    def bench_sensors_response(self):
+        "The whole /sensors answer: snapshot, JSON and HTTP head into a counting writer"
+        f = self.follower
+
+        def op():
+            _run_sync(send_response(_Writer(), "application/json", json.dumps(f.snapshot())))
+        return op
+
+    async def http_latency(self, rounds):
+        "Round trips of GET /sensors through HttpServer on the loopback interface"
+        f = self.follower
+
+        async def handler(request, writer):
+            await send_response(writer, "application/json", json.dumps(f.snapshot()))
+
+        server = HttpServer(handler, port=HTTP_PORT)
+        srv = await server.start('127.0.0.1')
+        times = []
+        try:
+            for _ in range(rounds):
+                start = ticks_us()
+                reader, writer = await asyncio.open_connection('127.0.0.1', HTTP_PORT)
+                writer.write(b"GET /sensors HTTP/1.1\r\nHost: picobot\r\n\r\n")
+                await writer.drain()
+                while await reader.read(512):
+                    pass
+                writer.close()
+                times.append(ticks_diff(ticks_us(), start))
+        finally:
+            srv.close()
+            await srv.wait_closed()
+        times.sort()
+        n = len(times)
+        return {
+            'rounds': n,
+            'latency_us_mean': sum(times) // n,
+            'latency_us_p50': times[n // 2],
+            'latency_us_p95': times[n * 95 // 100],
+            'latency_us_max': times[-1],
+        }
+
+    def close(self):
+        self.driver.autoflush = True
+        self.driver.StopAllMotors()
+
+
+def measure(op, rounds, probe):
+    op()  # warm up: first-call allocations and bus writes are not steady state
+    probe.begin()
+    start = ticks_us()
+    for _ in range(rounds):
+        op()
+    elapsed = ticks_diff(ticks_us(), start)
+    extra = probe.end(rounds)
+    result = {'rounds': rounds, 'us_per_op': elapsed / rounds}
+    result.update(extra)
+    return result
+
+
+def run(benchmarks, names=None, rounds=200, probe=None):
+    "Report dict for the named benchmarks (default: all that suit this platform)"
+    if probe is None:
+        probe = Probe()
+    if names is None:
+        names = [n for n in benchmarks.names() if sys.platform != 'rp2' or n not in DEVICE_SKIP]
+    results = {}
+    try:
+        for name in names:
+            try:
+                if name == "http":
+                    results[name] = asyncio.run(benchmarks.http_latency(rounds))
+                else:
+                    results[name] = measure(getattr(benchmarks, "bench_" + name)(), rounds, probe)
+            except OSError as e:
+                results[name] = {'error': str(e)}
+    finally:
+        benchmarks.close()
+    return {
+        'version': FORMAT_VERSION,
+        'platform': sys.platform,
+        'rounds': rounds,
+        'results': results,
+    }
+
+
+def main(names=None, rounds=200, path=None):
+    "On the robot: prints the report as JSON and, with `path`, saves it to flash"
+    report = run(Benchmarks(), names, rounds)
+    text = json.dumps(report)
+    print(text)
+    if path:
+        with open(path, "w") as f:
+            f.write(text)
+    return report
+
+
+def _load(f, ms):
+    "Core 0 work like serving pages: JSON responses, buffers, collections"
+    end = ticks_add(ticks_ms(), ms)
+    n = 0
+    while ticks_diff(end, ticks_ms()) > 0:
+        json.dumps(f.snapshot())
+        bufs = [bytearray(512) for _ in range(8)]
+        n += 1
+        if n % 20 == 0:
+            gc.collect()
+    return n
+
+
+def jitter(modes=('schedule', 'thread'), seconds=5, period_ms=20):
+    """
+    {mode: {'idle': ..., 'loaded': ...}} with LoopStats reports of a control
+    loop running the line follower's tick, first with core 0 sleeping, then
+    with it busy in _load(). In 'thread' mode the loaded latencies should
+    match the idle ones; 'schedule' ticks wait for each collection.
+    _load() writes nothing to flash, so the figures leave out the stalls
+    flash writes cause in every mode (on rp2 they stop core 1 too); each
+    mode's report says so under 'excludes'.
+    Lift the wheels: the follower drives the motors at BENCH_SPEED.
+    """
+    b = Benchmarks()
+    f = b.follower
+    b.driver.autoflush = False
+    f.post("start", {'speed': BENCH_SPEED})
+    report = {}
+    try:
+        for mode in modes:
+            loop = ControlLoop(f.tick, period_ms=period_ms, mode=mode)
+            loop.start()
+            r = {'mode': loop.mode, 'fallback': loop.fallback,
+                 'excludes': "flash writes (flight recorder, presets)"}
+            for phase in ('idle', 'loaded'):
+                sleep_ms(2 * period_ms)
+                loop.stats.reset()
+                if phase == 'idle':
+                    sleep_ms(seconds * 1000)
+                else:
+                    r['load_rounds'] = _load(f, seconds * 1000)
+                r[phase] = loop.stats.report()
+            loop.stop()
+            sleep_ms(2 * period_ms)  # lets a thread finish its last tick
+            report[mode] = r
+    finally:
+        f.post("stop")
+        f.tick()
+        b.close()
+    return report
@@ -0,0 +1,47 @@
+# picobot_boot.py
+# Boot phase timing. main.py marks each phase as it completes; the marks are
+# milliseconds since main.py started, and `before_main_ms` is ticks_ms() at
+# that point (time spent in the firmware and boot.py since reset; it keeps
+# counting across a soft reset, so it is only meaningful after power-up or a
+# hard reset).
+#
+# Phases marked by main.py, in the order they normally complete:
+#   motors_stopped  - PCA9685 set up and every channel off
+#   control_ready   - robot state and control loop built
+#   first_tick      - the control loop has run once
+#   ap_up           - the access point is active
+#   http_listening  - the web server accepts connections
+#   preset_loaded   - presets read from flash (and the active one posted)
+#   assets_ready    - every web asset built
+#   first_response  - the first HTTP response has been written
+from time import ticks_ms, ticks_us, ticks_diff
+
+
+class BootTimer:
+    def __init__(self):
+        self.before_main_ms = ticks_ms()
+        self._start = ticks_us()
+        self.marks = []  # (phase, ms since start), in the order marked
+        self._names = set()
+
+    def mark(self, phase):
+        "Records the first time a phase completes; later calls are ignored"
+        if phase in self._names:
+            return
+        self._names.add(phase)
+        self.marks.append((phase, ticks_diff(ticks_us(), self._start) / 1000))
+
+    def done(self, phase):
+        return phase in self._names
+
+    def report(self):
+        "The GET /boot response body"
+        return {
+            'before_main_ms': self.before_main_ms,
+            'phases': {phase: round(ms, 1) for phase, ms in self.marks},
+            'order': [phase for phase, ms in self.marks],
+        }
+
+    def summary(self):
+        "One line for the console"
+        return "Boot: " + ", ".join("%s %.0f ms" % (phase, ms) for phase, ms in self.marks)
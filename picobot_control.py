@@ -0,0 +1,228 @@
+# picobot_control.py
+# Periodic control-loop engine. The tick never runs in hard-IRQ context:
+#   'schedule' - a machine.Timer IRQ only queues the tick with
+#                micropython.schedule(), it then runs between bytecodes
+#   'asyncio'  - a uasyncio task that sleeps until each deadline
+#   'thread'   - a _thread on the RP2040's second core that waits for each
+#                deadline by polling ticks_us(); Wi-Fi, the web server and
+#                their garbage collections stay on core 0. The tick must not
+#                allocate (a collection on core 0 would hold it up) and may
+#                only exchange data with core 0 through picobot_exchange.
+#                Without _thread, or with core 1 taken, start() falls back
+#                to 'schedule' and says why in `fallback`. LoopStats is the
+#                jitter measure there: the Profiler's gc counters take the
+#                heap lock, so leave it off when timing this mode. Core 1 is
+#                not isolated from flash writes: on rp2 every write (the
+#                flight recorder with main.RECORD_RUNS, saving presets)
+#                stops core 1 until it is done, so ticks due then start late.
+from time import ticks_us, ticks_diff, ticks_add
+from machine import Timer
+import micropython
+from picobot_profile import Histogram
+
+try:
+    import _thread
+except ImportError:
+    _thread = None
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+
+class LoopStats:
+    """
+    Tick timing, all integers in microseconds.
+    latency  - from the moment the tick was due to the moment it started
+    duration - time spent inside the tick function
+    overruns - ticks dropped because the previous one had not finished
+    errors   - ticks that raised ('thread' mode only; in the other modes the
+               exception propagates)
+    latency is also kept as a histogram, for its percentiles.
+    """
+    def __init__(self):
+        self.latency = Histogram()
+        self.reset()
+
+    def reset(self):
+        self.latency.reset()
+        self.ticks = 0
+        self.overruns = 0
+        self.errors = 0
+        self.latency_max = 0
+        self.latency_sum = 0
+        self.duration_max = 0
+        self.duration_sum = 0
+
+    def record(self, latency, duration):
+        self.ticks += 1
+        self.latency.record(latency)
+        self.latency_sum += latency
+        if latency > self.latency_max:
+            self.latency_max = latency
+        self.duration_sum += duration
+        if duration > self.duration_max:
+            self.duration_max = duration
+
+    def report(self):
+        n = self.ticks or 1
+        return {
+            'ticks': self.ticks,
+            'overruns': self.overruns,
+            'errors': self.errors,
+            'latency_max_us': self.latency_max,
+            'latency_mean_us': self.latency_sum // n,
+            'duration_max_us': self.duration_max,
+            'duration_mean_us': self.duration_sum // n,
+            'latency': self.latency.report(),
+        }
+
+
+class ControlLoop:
+    def __init__(self, tick, period_ms=50, mode='schedule'):
+        if mode not in ('schedule', 'asyncio', 'thread'):
+            raise ValueError("mode must be 'schedule', 'asyncio' or 'thread'")
+        self.tick = tick
+        self.period_ms = period_ms
+        self.mode = mode
+        self.stats = LoopStats()
+        self.profiler = None  # picobot_profile.Profiler, optional
+        self.running = False
+        self.fallback = None  # why 'thread' mode runs as 'schedule', if it does
+        self.core = None  # 'thread' mode: _thread ident of the loop, once running
+        self._timer = None
+        self._pending = False
+        self._due = 0
+        # Bound methods allocate when taken; take them once, outside the IRQ
+        self._run_ref = self._run
+        self._irq_ref = self._irq
+
+    # ------------------------
+    # 'schedule' mode
+    # ------------------------
+    def start(self):
+        """
+        Starts the Timer in 'schedule' mode or the second core in 'thread'
+        mode; in 'asyncio' mode create_task(run()) instead
+        """
+        if self.mode == 'thread':
+            if self._start_thread():
+                return
+            self.mode = 'schedule'
+        if self.mode != 'schedule':
+            raise ValueError("start() is for 'schedule' and 'thread' mode")
+        self.running = True
+        self._timer = Timer()
+        self._timer.init(period=self.period_ms, mode=Timer.PERIODIC, callback=self._irq_ref)
+
+    def stop(self):
+        "Stops the loop; in 'thread' mode the thread ends after its current tick"
+        self.running = False
+        if self._timer is not None:
+            self._timer.deinit()
+            self._timer = None
+
+    def _irq(self, timer):
+        # IRQ context: no allocation, no I/O
+        if self._pending:
+            self.stats.overruns += 1
+            return
+        self._pending = True
+        self._due = ticks_us()
+        try:
+            micropython.schedule(self._run_ref, None)
+        except RuntimeError:
+            # schedule queue full
+            self._pending = False
+            self.stats.overruns += 1
+
+    def _run(self, _):
+        start = ticks_us()
+        p = self.profiler
+        if p is not None and p.enabled:
+            p.tick_start(start, self.period_ms * 1000)
+        try:
+            self.tick()
+        finally:
+            self._pending = False
+            duration = ticks_diff(ticks_us(), start)
+            self.stats.record(ticks_diff(start, self._due), duration)
+            if p is not None and p.enabled:
+                p.tick_end(duration)
+
+    # ------------------------
+    # 'asyncio' mode
+    # ------------------------
+    async def run(self):
+        period_us = self.period_ms * 1000
+        self.running = True
+        due = ticks_add(ticks_us(), period_us)
+        while self.running:
+            wait = ticks_diff(due, ticks_us())
+            if wait > 0:
+                await asyncio.sleep_ms(wait // 1000)
+                # sleep_ms is only as fine as the scheduler; spin off the rest
+                while ticks_diff(due, ticks_us()) > 0:
+                    await asyncio.sleep_ms(0)
+            start = ticks_us()
+            p = self.profiler
+            if p is not None and p.enabled:
+                p.tick_start(start, period_us)
+            self.tick()
+            end = ticks_us()
+            self.stats.record(ticks_diff(start, due), ticks_diff(end, start))
+            if p is not None and p.enabled:
+                p.tick_end(ticks_diff(end, start))
+            due = ticks_add(due, period_us)
+            # Fell more than a whole period behind: drop the missed ticks
+            # rather than running them back to back
+            while ticks_diff(end, due) > 0:
+                due = ticks_add(due, period_us)
+                self.stats.overruns += 1
+
+    # ------------------------
+    # 'thread' mode
+    # ------------------------
+    def _start_thread(self):
+        if _thread is None:
+            self.fallback = "no _thread"
+            return False
+        self.running = True
+        try:
+            _thread.start_new_thread(self._thread_run, ())
+        except (OSError, RuntimeError) as e:
+            # On the RP2040 only one other thread can run: core 1 is taken
+            self.running = False
+            self.fallback = "core 1 busy: %s" % e
+            return False
+        return True
+
+    def _thread_run(self):
+        self.core = _thread.get_ident()
+        period_us = self.period_ms * 1000
+        due = ticks_add(ticks_us(), period_us)
+        while self.running:
+            # Nothing else runs on this core: poll the clock rather than
+            # sleep, sleeping would only add wake-up latency
+            while ticks_diff(due, ticks_us()) > 0:
+                pass
+            start = ticks_us()
+            p = self.profiler
+            if p is not None and p.enabled:
+                p.tick_start(start, period_us)
+            try:
+                self.tick()
+            except Exception as e:
+                # Nobody would see it end the thread; count it and go on
+                self.stats.errors += 1
+                print("control tick:", repr(e))
+            end = ticks_us()
+            self.stats.record(ticks_diff(start, due), ticks_diff(end, start))
+            if p is not None and p.enabled:
+                p.tick_end(ticks_diff(end, start))
+            due = ticks_add(due, period_us)
+            while ticks_diff(end, due) > 0:
+                due = ticks_add(due, period_us)
+                self.stats.overruns += 1
+        self.core = None
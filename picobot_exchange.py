@@ -0,0 +1,83 @@
+# picobot_exchange.py
+# Lock-free exchange between the two RP2040 cores (ControlLoop 'thread'
+# mode), one writer and one reader each way:
+#   Mailbox      - network core -> control core: commands, in order
+#   DoubleBuffer - control core -> network core: the latest state record
+#
+# Neither side ever waits for the other. Publishing is a single store of a
+# small int or an object reference, which the other core sees whole; the
+# Cortex-M0+ does not reorder memory accesses, so what was written before
+# the store is visible once the store is. Sequence numbers wrap at 2**30 so
+# they stay small ints and updating them never allocates.
+SEQ_MASK = 0x3FFFFFFF
+
+
+class Mailbox:
+    """
+    Fixed ring of object slots. put() only on the producing core, get()
+    only on the consuming one; each moves only its own index.
+    """
+    def __init__(self, slots=8):
+        self.slots = [None] * slots
+        self.head = 0  # next slot to read, moved by get()
+        self.tail = 0  # next slot to write, moved by put()
+        self.dropped = 0
+
+    def put(self, item):
+        "False (and the item dropped) when the ring is full"
+        tail = self.tail
+        nxt = tail + 1 if tail + 1 < len(self.slots) else 0
+        if nxt == self.head:
+            self.dropped += 1
+            return False
+        self.slots[tail] = item
+        self.tail = nxt  # publishes the slot
+        return True
+
+    def get(self):
+        "The oldest item, None when empty"
+        head = self.head
+        if head == self.tail:
+            return None
+        item = self.slots[head]
+        self.slots[head] = None
+        self.head = head + 1 if head + 1 < len(self.slots) else 0
+        return item
+
+    def __len__(self):
+        return (self.tail - self.head) % len(self.slots)
+
+
+class DoubleBuffer:
+    """
+    Two buffers of `size` bytes. The writer fills back() and publish()es
+    it, which makes it the front; the old front becomes the next back. A
+    reader copies the front, and copies again (counted in `retries`) if a
+    publish happened meanwhile, as the writer may have started on the
+    buffer being copied. The writer fills and publishes in one go once per
+    tick, so the reader nearly always gets through first time.
+    """
+    def __init__(self, size):
+        self.buffers = (bytearray(size), bytearray(size))
+        self.seq = 0  # publishes so far; buffers[seq & 1] is the front
+        self.retries = 0
+
+    def back(self):
+        "Writer: the buffer to fill; nobody reads it until publish()"
+        return self.buffers[(self.seq + 1) & 1]
+
+    def publish(self):
+        self.seq = (self.seq + 1) & SEQ_MASK
+
+    def read_into(self, out, offset=0):
+        """
+        Reader: copies the front buffer to out[offset:] and returns its
+        sequence number. Retries while the writer overtook the copy.
+        """
+        while True:
+            seq = self.seq
+            front = self.buffers[seq & 1]
+            out[offset:offset + len(front)] = front
+            if self.seq == seq:
+                return seq
+            self.retries += 1
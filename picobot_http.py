@@ -0,0 +1,331 @@
+# picobot_http.py
+# Small uasyncio HTTP/1.1 server: several clients at once, the request head is
+# read line by line with a per-connection timeout, one response per connection.
+# The request line and query string are parsed once, from bytes, and Router
+# dispatches on the path through a table. Each connection slot has its own
+# Request, refilled for every request, so the object and its query and
+# header dicts are allocated once rather than per request.
+from time import ticks_us, ticks_diff
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    408: "Request Timeout",
+    409: "Conflict",
+    431: "Request Header Fields Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class Request:
+    """
+    One parsed request head, straight from the received bytes.
+    method  - b"GET", ...
+    target  - b"/?action=stop"
+    path    - b"/"
+    query   - {b"action": b"stop"}, percent-decoded
+    headers - lower-cased names listed in HttpServer.keep_headers only, as str
+    received - ticks_us() when the request line was parsed
+    HttpServer reuses its Requests: a handler must not keep one, or its
+    dicts, past returning.
+    """
+    def __init__(self, method=b"", target=b"", path=b"", query=None, headers=None):
+        self.method = method
+        self.target = target
+        self.path = path
+        self.query = {} if query is None else query
+        self.headers = {} if headers is None else headers
+        self.received = ticks_us()
+
+    def arg(self, name, kind=None, default=None):
+        """
+        Query value for `name` (bytes), converted with kind (int, float, str,
+        ...) from its text; default when absent. Conversion errors raise
+        ValueError.
+        """
+        v = self.query.get(name)
+        if v is None:
+            return default
+        v = v.decode()
+        return v if kind is None else kind(v)
+
+
+def unquote(b):
+    "%XX and '+' decoding of a query key or value"
+    if b"%" not in b and b"+" not in b:
+        return b
+    b = b.replace(b"+", b" ")
+    parts = b.split(b"%")
+    out = bytearray(parts[0])
+    for part in parts[1:]:
+        try:
+            out.append(int(part[:2], 16))
+            out.extend(part[2:])
+        except ValueError:
+            out.extend(b"%")
+            out.extend(part)
+    return bytes(out)
+
+
+def _empty(d):
+    "Removes every entry but keeps the table, which dict.clear() frees on MicroPython"
+    while d:
+        d.popitem()
+
+
+def parse_query(qs, query=None):
+    """
+    b'a=1&b=2' -> {b'a': b'1', b'b': b'2'}; the last of repeated keys wins.
+    With `query` given, that dict is emptied and filled instead of a new one.
+    """
+    if query is None:
+        query = {}
+    else:
+        _empty(query)
+    if not qs:
+        return query
+    plain = b"%" not in qs and b"+" not in qs  # what the web page sends
+    # split() and partition() run in C; a find() loop in Python is slower
+    for part in qs.split(b"&"):
+        k, _, v = part.partition(b"=")
+        if not plain:
+            k, v = unquote(k), unquote(v)
+        if k:
+            query[k] = v
+    return query
+
+
+def parse_request_line(line, request=None):
+    """
+    Request (without headers) from a raw request line, None if malformed.
+    With `request` given, it is refilled and returned; its headers are
+    emptied.
+    """
+    parts = line.split(None, 2)
+    if len(parts) < 2:
+        return None
+    if request is None:
+        request = Request()
+    else:
+        _empty(request.headers)
+        request.received = ticks_us()
+    target = parts[1]
+    q = target.find(b"?")
+    request.method = parts[0]
+    request.target = target
+    if q < 0:
+        request.path = target
+        _empty(request.query)
+    else:
+        request.path = target[:q]
+        parse_query(target[q + 1:], request.query)
+    return request
+
+
+class Router:
+    """
+    Route table: exact path -> async handler(request, writer), looked up
+    once per request. Requests for unknown paths go to `default` (404
+    without one); other methods than a route's get 405.
+    """
+    def __init__(self):
+        self.routes = {}
+        self.default = None
+
+    def add(self, path, handler, method=b"GET"):
+        if isinstance(path, str):
+            path = path.encode()
+        self.routes[path] = (method, handler)
+
+    def route(self, path, method=b"GET"):
+        "Decorator form of add()"
+        def register(handler):
+            self.add(path, handler, method)
+            return handler
+        return register
+
+    async def dispatch(self, request, writer):
+        "HttpServer handler: runs the route for request.path"
+        entry = self.routes.get(request.path)
+        if entry is None:
+            if self.default is None:
+                await send_response(writer, "text/plain", STATUS_TEXT[404], 404)
+                return
+            return await self.default(request, writer)
+        if request.method != entry[0]:
+            await send_response(writer, "text/plain", STATUS_TEXT[405], 405)
+            return
+        return await entry[1](request, writer)
+
+
+async def send_response(writer, content_type, body, status=200, headers=None):
+    "Writes a complete Connection: close response; body is str or bytes"
+    if isinstance(body, str):
+        body = body.encode()
+    head = "HTTP/1.1 %d %s\r\n" % (status, STATUS_TEXT.get(status, ""))
+    head += "Content-Type: " + content_type + "\r\n"
+    head += "Content-Length: %d\r\n" % len(body)
+    head += "Access-Control-Allow-Origin: *\r\n"
+    if headers:
+        head += headers
+    head += "Connection: close\r\n\r\n"
+    writer.write(head.encode())
+    writer.write(body)
+    await writer.drain()
+
+
+async def send_file(writer, path, content_type="application/octet-stream", chunk=512):
+    "Streams a file from flash in fixed-size chunks; 404 if it does not exist"
+    import os
+    try:
+        size = os.stat(path)[6]
+        f = open(path, "rb")
+    except OSError:
+        await send_response(writer, "text/plain", STATUS_TEXT[404], 404)
+        return
+    try:
+        head = "HTTP/1.1 200 OK\r\nContent-Type: %s\r\nContent-Length: %d\r\n" \
+               "Access-Control-Allow-Origin: *\r\nConnection: close\r\n\r\n" % (content_type, size)
+        writer.write(head.encode())
+        buf = bytearray(chunk)
+        mv = memoryview(buf)
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            writer.write(mv[:n])
+            await writer.drain()
+    finally:
+        f.close()
+
+
+class HttpServer:
+    def __init__(self, handler, port=80, max_clients=4, timeout_ms=3000, max_head=2048):
+        """
+        handler - async function(request, writer) that writes the response;
+                  returning True hands the open connection over to the
+                  handler (e.g. an event stream) and the server leaves it be
+        max_clients - connections served at once; more get 503 straight away
+        timeout_ms - limit for receiving the request head and for the handler
+        max_head - limit for the request line plus headers, in bytes
+        """
+        self.handler = handler
+        self.port = port
+        self.max_clients = max_clients
+        self.timeout_ms = timeout_ms
+        self.max_head = max_head
+        self.keep_headers = ()  # header names (lower case) handlers need
+        self._keep_src = None
+        self._keep = ()
+        self.active = 0
+        self.served = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.server = None
+        self.profiler = None  # picobot_profile.Profiler: request service times
+        # One Request per connection slot; _serve takes one while it runs
+        self._requests = [Request() for _ in range(max_clients)]
+
+    async def start(self, host='0.0.0.0'):
+        self.server = await asyncio.start_server(self._serve, host, self.port)
+        return self.server
+
+    async def _read_head(self, reader, request):
+        line = await reader.readline()
+        size = len(line)
+        request = parse_request_line(line, request)
+        if request is None:
+            return None
+        if self._keep_src is not self.keep_headers:
+            self._keep = tuple(k.encode() for k in self.keep_headers)
+            self._keep_src = self.keep_headers
+        keep = self._keep
+        headers = request.headers
+        while True:
+            h = await reader.readline()
+            size += len(h)
+            if size > self.max_head:
+                raise ValueError("head too large")
+            if not h or h == b"\r\n" or h == b"\n":
+                break
+            if keep:
+                # Only the kept headers are ever decoded
+                i = h.find(b":")
+                if i > 0:
+                    name = h[:i].strip().lower()
+                    if name in keep:
+                        headers[name.decode()] = h[i + 1:].strip().decode()
+        return request
+
+    async def _serve(self, reader, writer):
+        if self.active >= self.max_clients:
+            self.rejected += 1
+            await self._close(writer, 503)
+            return
+        self.active += 1
+        requests = self._requests
+        slot = requests.pop() if requests else Request()  # max_clients raised since
+        status = None
+        keep = False
+        try:
+            try:
+                request = await asyncio.wait_for(self._read_head(reader, slot), self.timeout_ms / 1000)
+                if request is None:
+                    status = 400
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                status = 408
+            except UnicodeError:
+                status = 400
+            except ValueError:
+                status = 431
+            if status is None:
+                start = ticks_us()
+                # Past this point part of a response may be out; just close
+                keep = await asyncio.wait_for(self.handler(request, writer), self.timeout_ms / 1000)
+                self.served += 1
+                p = self.profiler
+                if p is not None and p.enabled and not keep:
+                    p.request.record(ticks_diff(ticks_us(), start))
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+        except OSError:
+            pass  # client went away
+        except Exception as e:
+            self.errors += 1
+            print("HTTP error:", e)
+        finally:
+            requests.append(slot)
+            self.active -= 1
+        if not keep:
+            await self._close(writer, status)
+
+    async def _close(self, writer, status=None):
+        try:
+            if status is not None:
+                await send_response(writer, "text/plain", STATUS_TEXT[status], status)
+        except Exception:
+            pass
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+    def stats(self):
+        return {
+            'active': self.active,
+            'served': self.served,
+            'rejected': self.rejected,
+            'timeouts': self.timeouts,
+            'errors': self.errors,
+        }
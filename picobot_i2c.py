@@ -0,0 +1,233 @@
+# picobot_i2c.py
+# One I2CBus per hardware bus, shared by every driver on it (get()).
+#
+# - Clock: probe() tries the fastest rate first (1 MHz, 400 kHz, then the
+#   100 kHz standard mode) and keeps the first one at which the device
+#   answers a burst of reads reliably; long or weakly pulled-up wiring falls
+#   back on its own.
+# - Serialisation: each transaction is one call into the I2C driver and holds
+#   the bus lock, so the control loop and the arm's tasks may share a bus,
+#   also from the other core (_thread). A caller on another thread than the
+#   holder blocks on the lock; it never runs over a transfer. Where locks
+#   take a timeout (CPython) it gets OSError(ETIMEDOUT) after LOCK_WAIT_US;
+#   MicroPython ignores the timeout and waits. A scheduled callback that
+#   interrupts the holder's own thread cannot wait (the holder only runs on
+#   once the callback returns) and must not use the bus either: the holder
+#   may be between retries or bit-banging a recovery. It gets OSError(EBUSY)
+#   at once, counted in `busy`; the control tick's flush treats that like
+#   any bus error and rewrites at the next tick. Taking the lock and
+#   recording the owner thread is one straight run of bytecodes, so no
+#   callback can land between the two.
+# - Errors: a failed transaction is retried; before the last retry the bus is
+#   recovered (nine SCL pulses free a device stuck holding SDA, then the
+#   controller is set up again). The error is raised only if that fails too.
+# - Counters per bus: transactions, bytes, errors, retries, recoveries and
+#   lock contention, see stats().
+from time import sleep_us
+
+try:
+    import _thread
+except ImportError:
+    _thread = None
+
+FREQS = (1000000, 400000, 100000)
+PROBE_READS = 8
+LOCK_WAIT_US = 50000  # longer than a transfer with all its retries and a recovery
+EBUSY = 16
+ETIMEDOUT = 110
+
+_buses = {}
+
+
+def get(id, scl=None, sda=None, freq=400000, **kwargs):
+    "The shared I2CBus for hardware bus `id`, created on first use"
+    bus = _buses.get(id)
+    if bus is None:
+        bus = _buses[id] = I2CBus(id, scl, sda, freq, **kwargs)
+    return bus
+
+
+def buses():
+    return list(_buses.values())
+
+
+class I2CBus:
+    def __init__(self, id=0, scl=None, sda=None, freq=400000, retries=2, i2c=None):
+        """
+        id, scl, sda - hardware bus and pin numbers
+        freq         - the fastest clock to try; probe() may settle lower
+        retries      - extra attempts for a failed transaction
+        i2c          - an I2C object to use as it is (tests, the simulator);
+                       it is then never re-clocked or recovered
+        """
+        self.id = id
+        self.scl = scl
+        self.sda = sda
+        self.freq = freq
+        self.retries = retries
+        self.fixed = i2c is not None
+        self.i2c = i2c if i2c is not None else self._make(freq)
+        self._lock = _thread.allocate_lock() if _thread is not None else None
+        # [scratch, owner]: _acquire stores its thread id at index
+        # lock.acquire(0), so the owner is set without a branch in between
+        self._held = [None, None]
+        self.probed = False
+        self.transactions = 0
+        self.bytes = 0
+        self.errors = 0
+        self.retried = 0
+        self.recoveries = 0
+        self.contended = 0
+        self.lock_timeouts = 0
+        self.busy = 0  # callbacks turned away from their own thread's transaction
+
+    def _make(self, freq):
+        from machine import I2C, Pin
+        return I2C(self.id, scl=Pin(self.scl), sda=Pin(self.sda), freq=freq)
+
+    # ------------------------
+    # Set-up
+    # ------------------------
+    def probe(self, address, register=0x00):
+        """
+        Settles on the fastest clock (up to the requested one) at which
+        `address` answers PROBE_READS reads of `register`; returns it. The
+        first driver on a shared bus probes it, later ones take the result.
+        """
+        if self.fixed or self.probed:
+            return self.freq
+        self.probed = True
+        requested = self.freq
+        for freq in FREQS:
+            if freq > requested:
+                continue
+            self.i2c = self._make(freq)
+            try:
+                first = self.i2c.readfrom_mem(address, register, 1)
+                for _ in range(PROBE_READS - 1):
+                    if self.i2c.readfrom_mem(address, register, 1) != first:
+                        raise OSError(5)
+            except OSError:
+                self.errors += 1
+                continue
+            self.freq = freq
+            return freq
+        # Nothing answered; stay slow and let the caller's first write fail
+        self.freq = min(requested, FREQS[-1])
+        self.i2c = self._make(self.freq)
+        return self.freq
+
+    def recover(self):
+        "Frees a device holding SDA low and sets the controller up again"
+        self.recoveries += 1
+        if self.fixed:
+            return
+        from machine import Pin
+        scl = Pin(self.scl, Pin.OPEN_DRAIN, value=1)
+        sda = Pin(self.sda, Pin.OPEN_DRAIN, value=1)
+        for _ in range(9):
+            scl.value(0)
+            sleep_us(5)
+            scl.value(1)
+            sleep_us(5)
+        # STOP: SDA low to high while SCL is high
+        sda.value(0)
+        sleep_us(5)
+        sda.value(1)
+        sleep_us(5)
+        self.i2c = self._make(self.freq)
+
+    # ------------------------
+    # Transactions
+    # ------------------------
+    def _acquire(self):
+        """
+        True if the lock was taken (and must be released), False without a
+        lock. OSError(EBUSY) for a callback interrupting the holder's own
+        thread, OSError(ETIMEDOUT) where the wait can time out.
+        """
+        lock = self._lock
+        if lock is None:
+            return False
+        held = self._held
+        me = _thread.get_ident()
+        got = lock.acquire(0)
+        held[got] = me
+        if got:
+            return True
+        self.contended += 1
+        if held[1] == me:
+            # Interrupted our own holder, see the header
+            self.busy += 1
+            raise OSError(EBUSY)
+        got = lock.acquire(1, LOCK_WAIT_US / 1000000)
+        held[got] = me
+        if got:
+            return True
+        self.lock_timeouts += 1
+        raise OSError(ETIMEDOUT)
+
+    def _release(self):
+        self._held[1] = None
+        self._lock.release()
+
+    def writeto_mem(self, addr, memaddr, buf):
+        locked = self._acquire()
+        try:
+            attempt = 0
+            while True:
+                try:
+                    self.i2c.writeto_mem(addr, memaddr, buf)
+                    self.transactions += 1
+                    self.bytes += len(buf)
+                    return
+                except OSError:
+                    self.errors += 1
+                    if attempt >= self.retries:
+                        raise
+                    attempt += 1
+                    self.retried += 1
+                    if attempt == self.retries:
+                        self.recover()
+        finally:
+            if locked:
+                self._release()
+
+    def readfrom_mem(self, addr, memaddr, nbytes):
+        locked = self._acquire()
+        try:
+            attempt = 0
+            while True:
+                try:
+                    data = self.i2c.readfrom_mem(addr, memaddr, nbytes)
+                    self.transactions += 1
+                    self.bytes += nbytes
+                    return data
+                except OSError:
+                    self.errors += 1
+                    if attempt >= self.retries:
+                        raise
+                    attempt += 1
+                    self.retried += 1
+                    if attempt == self.retries:
+                        self.recover()
+        finally:
+            if locked:
+                self._release()
+
+    def scan(self):
+        return self.i2c.scan()
+
+    def stats(self):
+        return {
+            'id': self.id,
+            'freq': self.freq,
+            'transactions': self.transactions,
+            'bytes': self.bytes,
+            'errors': self.errors,
+            'retried': self.retried,
+            'recoveries': self.recoveries,
+            'contended': self.contended,
+            'lock_timeouts': self.lock_timeouts,
+            'busy': self.busy,
+        }
@@ -0,0 +1,555 @@
+# picobot_line.py
+# Line-following logic: sensor decision, action frames and the robot state.
+from time import ticks_ms, ticks_diff
+from picobot_log import logger
+from picobot_exchange import Mailbox
+
+# ------------------------
+# Decide action
+# ------------------------
+# Weighted line position beyond which a turn is HARD, MILD, SLIGHT
+THRESHOLDS = (1.2, 0.6, 0.2)
+
+def decide_action(sensor_values, thresholds=THRESHOLDS):
+    hard, mild, slight = thresholds
+
+    if all(v == 1 for v in sensor_values):
+        return "ON JUNCTION"
+    if all(v == 0 for v in sensor_values):
+        return "LINE LOST"
+
+    positions = [2, 1, 0, -1, -2]
+    weighted_sum = 0
+    active_sensors = 0
+
+    for i in range(5):
+        if sensor_values[i] == 1:
+            weighted_sum += positions[i]
+            active_sensors += 1
+
+    if active_sensors > 0:
+        weighted_sum = weighted_sum / active_sensors
+
+    if weighted_sum > hard:
+        return "HARD RIGHT"
+    elif weighted_sum > mild:
+        return "MILD RIGHT"
+    elif weighted_sum > slight:
+        return "SLIGHT RIGHT"
+    elif weighted_sum < -hard:
+        return "HARD LEFT"
+    elif weighted_sum < -mild:
+        return "MILD LEFT"
+    elif weighted_sum < -slight:
+        return "SLIGHT LEFT"
+    elif weighted_sum == 0 and any(v == 1 for v in sensor_values):
+        return "FORWARD"
+    else:
+        return "SEARCHING"
+
+def build_error_table():
+    """
+    Weighted line position (-2 = far left .. 2 = far right) for all 32 sensor
+    bitmasks, as decide_action computes it, in 1/PID_SCALE units; 0 where no
+    position exists (no sensor or all sensors on the line).
+    """
+    table = []
+    for bits in range(32):
+        n = 0
+        total = 0
+        for i in range(5):
+            if (bits >> i) & 1:
+                total += 2 - i
+                n += 1
+        table.append(total * PID_SCALE // n if 0 < n < 5 else 0)
+    return tuple(table)
+
+def build_decide_table(thresholds=THRESHOLDS):
+    """
+    decide_action for all 32 sensor states, indexed by the sensor bitmask
+    (bit i = sensor_values[i]).
+    """
+    return tuple(decide_action([(bits >> i) & 1 for i in range(5)], thresholds)
+                 for bits in range(32))
+
+# ------------------------
+# Parameters
+# ------------------------
+STEER_MODES = ("bucket", "pid")
+
+def steer_mode(value):
+    if value not in STEER_MODES:
+        raise ValueError("mode must be one of %s" % (STEER_MODES,))
+    return value
+
+# (query name, attribute, type, default)
+PARAMS = (
+    ("speed", "base_speed", int, 30),
+    ("slight", "slight_ratio", float, 0.9),
+    ("mild", "mild_ratio", float, 0.75),
+    ("hard", "hard_ratio", float, 0.6),
+    ("grace", "grace_period", int, 800),  # Increased grace period for sharp turns
+    ("search", "search_ratio", float, 0.4),  # Ratio for aggressive searching
+    # Steering: "bucket" maps each action to a fixed speed ratio, "pid" steers
+    # continuously on the weighted line position
+    ("mode", "steer_mode", steer_mode, "bucket"),
+    ("kp", "kp", float, 30.0),  # speed % per unit of line position
+    ("ki", "ki", float, 0.0),   # speed % per unit-second
+    ("kd", "kd", float, 2.0),   # speed % per unit/second, low-pass filtered
+)
+
+PID_D_TAU_MS = 60  # derivative low-pass time constant
+# steer() runs in integers, as floats are allocated on the heap: a line
+# position of 1.0 is PID_SCALE (exact for the 1/3 and 1/4 steps of the
+# weighted position) and a gain of 1.0 is PID_GAIN_SCALE
+PID_SCALE = 48
+PID_GAIN_SCALE = 256
+
+
+def _div0(a, b):
+    "a / b rounded towards 0, as int() would"
+    return a // b if a >= 0 else -(-a // b)
+
+
+def pid_gains(values):
+    "(kp, ki, kd) from parameter values by attribute, in PID_GAIN_SCALE units"
+    return (round(values['kp'] * PID_GAIN_SCALE), round(values['ki'] * PID_GAIN_SCALE),
+            round(values['kd'] * PID_GAIN_SCALE))
+
+# Index = code used by the telemetry stream
+ACTIONS = ("FORWARD", "SLIGHT RIGHT", "MILD RIGHT", "HARD RIGHT",
+           "SLIGHT LEFT", "MILD LEFT", "HARD LEFT",
+           "ON JUNCTION", "LINE LOST", "SEARCHING")
+ACTION_CODES = {action: code for code, action in enumerate(ACTIONS)}
+STATUSES = ("Stopped", "Running", "Line lost - searching",
+            "Line lost - stopped", "Mission accomplished")
+
+# Log messages; the control tick only stores numbers, see picobot_log
+MSG_START = logger.message("Starting with speed=%d, ratios: slight=%g, mild=%g, hard=%g, grace=%d, search=%g")
+MSG_UPDATE = logger.message("Updated parameters: speed=%d, ratios: slight=%g, mild=%g, hard=%g, grace=%d, search=%g")
+MSG_STOP = logger.message("Stopped by user")
+MSG_ESTOP = logger.message("Emergency stop")
+MSG_DEADMAN = logger.message("No heartbeat for %d ms - stopped")
+MSG_I2C_ERROR = logger.message("I2C error: %d")
+MSG_JUNCTION = logger.message("Mission accomplished - at junction")
+MSG_LOST = logger.message("Line lost - starting aggressive search")
+MSG_LOST_STOP = logger.message("Line lost - stopped after grace period")
+MSG_FOUND = logger.message("Line found - resuming normal operation")
+MSG_TICK = logger.message(
+    "Sensors: %d Action: %d Search intensity: %d",
+    lambda bits, code, step: "Sensors: %s Action: %s Search intensity: %s" % (
+        [(bits >> i) & 1 for i in range(5)], ACTIONS[code], 1.5 ** step))
+
+TURN_ACTIONS = ("SLIGHT RIGHT", "MILD RIGHT", "HARD RIGHT",
+                "SLIGHT LEFT", "MILD LEFT", "HARD LEFT")
+SEARCH_STEPS_MAX = 100  # search intensity grows 1.5x per tick, speed caps at 100
+COMMAND_SLOTS = 8  # commands post() can queue ahead of the control tick
+
+
+class LineFollower:
+    """
+    Owns the robot state. Only tick() changes it; other code (the web
+    server) hands requests in through post() and they are applied at the
+    start of the next tick, so the control loop never races the server.
+    post() does the costly part of a parameter change (conversion and the
+    action frames) on the caller's side, so the tick only swaps references
+    and may run on the other core (ControlLoop 'thread' mode). The server
+    then reads the robot through the StatusExchange and posted_params(),
+    not through the attributes here.
+    """
+    def __init__(self, motor_driver, sensors):
+        """
+        motor_driver - picobot_motors.MotorDriver
+        sensors - reader whose read() returns the five sensors as a bitmask,
+                  see picobot_sensors
+        """
+        self.motor_driver = motor_driver
+        self.sensors = sensors
+
+        self.robot_running = False
+        self.mission_done = False
+        self.line_lost = False
+        self.line_lost_time = 0
+        self.lost_stopped = False  # grace period over; stopped until the line is found
+        self.last_direction = "FORWARD"
+        self.search_step = 0  # Consecutive LINE LOST ticks; search intensity is 1.5 ** search_step
+
+        for name, attr, kind, default in PARAMS:
+            setattr(self, attr, default)
+
+        # Snapshot of the last tick, for telemetry
+        self.ticks = 0
+        self.tick_ms = 0  # ticks_ms() at the last tick
+        self.sensor_bits = 0  # bit i = sensors[i], bit 0 is the right sensor
+        self.action = "LINE LOST"
+        self.params_version = 0  # bumped whenever a parameter changes
+
+        self.thresholds = THRESHOLDS
+        self.decide_table = build_decide_table()
+        self.error_table = build_error_table()
+        self.reset_pid()
+
+        self.recorder = None  # picobot_recorder.FlightRecorder, optional
+        self.exchange = None  # picobot_telemetry.StatusExchange, optional
+        self.estop = None  # picobot_safety.EmergencyStop, optional
+        self.deadman = None  # picobot_safety.DeadMan, optional; needs estop
+        self._stops_seen = 0  # estop.count the robot has stopped for (or started after)
+
+        self._commands = Mailbox(COMMAND_SLOTS)
+        # Parameter values as of the last post(), by attribute; post() side only
+        self._posted = {attr: default for name, attr, kind, default in PARAMS}
+        # The values in effect, by attribute; replaced whole, never modified
+        self.applied = self._posted
+        self.pid_gains = pid_gains(self._posted)
+        # action -> frame; last turn action -> frames indexed by search_step
+        self.action_frames, self.search_frames = self.build_action_frames(self._posted)
+
+    # ------------------------
+    # Requests from other contexts
+    # ------------------------
+    def post(self, command, params=None):
+        """
+        Queues 'start', 'stop' or 'update' (with a params dict) for the next
+        tick. Bad parameter values raise ValueError here. Returns False if
+        COMMAND_SLOTS commands are already waiting.
+        """
+        # The stops triggered so far go with the command: a start applied in
+        # the same tick as an earlier stop must not be halted by it
+        stops = self.estop.count if self.estop is not None else 0
+        return self._commands.put((command, self._prepare(params), stops))
+
+    def sensor_values(self):
+        "Last sensor reading as a list, right → left"
+        bits = self.sensor_bits
+        return [(bits >> i) & 1 for i in range(5)]
+
+    def params(self):
+        "Parameters in effect, by query name; control core side"
+        return {name: getattr(self, attr) for name, attr, kind, default in PARAMS}
+
+    def posted_params(self):
+        "Parameters as of the last post(), by query name; post() side"
+        values = self._posted
+        return {name: values[attr] for name, attr, kind, default in PARAMS}
+
+    def status_code(self):
+        "Index into STATUSES"
+        if self.mission_done:
+            return 4
+        elif self.line_lost and ticks_diff(ticks_ms(), self.line_lost_time) >= self.grace_period:
+            return 3
+        elif self.line_lost:
+            return 2
+        elif self.robot_running:
+            return 1
+        else:
+            return 0
+
+    def status(self):
+        return STATUSES[self.status_code()]
+
+    def snapshot(self):
+        "The /sensors response body"
+        return {
+            'sensors': self.sensor_values(),
+            'action': self.action,
+            'status': self.status(),
+            'params': self.params()
+        }
+
+    def set_thresholds(self, thresholds):
+        "(hard, mild, slight) line positions; rebuilds the decide table"
+        if tuple(thresholds) != self.thresholds:
+            self.thresholds = tuple(thresholds)
+            self.decide_table = build_decide_table(self.thresholds)
+
+    def reset_pid(self):
+        # Integers, see PID_SCALE
+        self.pid_integral = 0
+        self.pid_derivative = 0
+        self.pid_error = 0
+        self.pid_ms = None  # tick time of the last PID step, None = restart
+
+    def _prepare(self, params):
+        """
+        (values by attribute, action frames, search frames, PID gains) for
+        a params dict on top of the values posted before; None without params
+        """
+        if not params:
+            return None
+        values = dict(self._posted)
+        for name, attr, kind, default in PARAMS:
+            if name in params:
+                values[attr] = kind(params[name])
+        frames, searches = self.build_action_frames(values)
+        self._posted = values
+        return values, frames, searches, pid_gains(values)
+
+    def _set_params(self, prepared):
+        if prepared is None:
+            return
+        values, frames, searches, gains = prepared
+        for name, attr, kind, default in PARAMS:
+            setattr(self, attr, values[attr])
+        self.action_frames = frames
+        self.search_frames = searches
+        self.pid_gains = gains
+        self.applied = values
+        self.params_version += 1
+
+    def _apply(self, command, params, stops):
+        if command == "start":
+            self._stops_seen = stops
+            self.robot_running = True
+            self.mission_done = False
+            self.line_lost = False
+            self.search_step = 0  # Reset search intensity
+            self.reset_pid()
+            self._set_params(params)
+            if self.deadman is not None:
+                self.deadman.feed()
+            logger.info(MSG_START, self.base_speed, self.slight_ratio, self.mild_ratio,
+                        self.hard_ratio, self.grace_period, self.search_ratio)
+        elif command == "stop":
+            self.robot_running = False
+            self.motor_driver.StopAllMotors()
+            self.search_step = 0  # Reset search intensity
+            logger.info(MSG_STOP)
+        elif command == "update":
+            # Update parameters without starting the robot
+            self._set_params(params)
+            logger.info(MSG_UPDATE, self.base_speed, self.slight_ratio, self.mild_ratio,
+                        self.hard_ratio, self.grace_period, self.search_ratio)
+
+    # ------------------------
+    # Map action to motor speeds with aggressive line loss recovery
+    # ------------------------
+    # Every action resolves to a prebuilt 48-byte register frame for all four
+    # motors, so a control tick is a dict lookup plus (at most) one I2C write.
+    # The tables only change when start/update change the parameters.
+    def drive_frame(self, left_dir, left_speed, right_dir, right_speed):
+        return self.motor_driver.makeFrame({
+            'LeftFront': (left_dir, left_speed),
+            'LeftBack': (left_dir, left_speed),
+            'RightFront': (right_dir, right_speed),
+            'RightBack': (right_dir, right_speed),
+        })
+
+    def build_action_frames(self, values):
+        "(action frames, search frames) for parameter values by attribute"
+        base_speed = values['base_speed']
+        frames = {
+            "FORWARD": self.drive_frame('forward', base_speed, 'forward', base_speed),
+            "ON JUNCTION": self.motor_driver.makeFrame({}),
+        }
+        for side_ratio, name in ((values['slight_ratio'], "SLIGHT"), (values['mild_ratio'], "MILD"),
+                                 (values['hard_ratio'], "HARD")):
+            slow = int(base_speed * side_ratio)
+            frames[name + " RIGHT"] = self.drive_frame('forward', base_speed, 'forward', slow)
+            frames[name + " LEFT"] = self.drive_frame('forward', slow, 'forward', base_speed)
+
+        # Spin in place towards the side the line was last seen on; step k is
+        # the k-th consecutive LINE LOST tick (search intensity 1.5 ** k).
+        # Steps that truncate to the same speed share one frame; with no
+        # search speed at all (search_ratio 0) the ladder is a single step.
+        search = base_speed * values['search_ratio']
+        right_search = []
+        left_search = []
+        last_speed = None
+        for k in range(SEARCH_STEPS_MAX + 1):
+            turn_speed = int(search * (1.5 ** k))
+            if turn_speed == last_speed:
+                right_search.append(right_search[-1])
+                left_search.append(left_search[-1])
+            else:
+                right_search.append(self.drive_frame('forward', turn_speed, 'backward', turn_speed))
+                left_search.append(self.drive_frame('backward', turn_speed, 'forward', turn_speed))
+                last_speed = turn_speed
+            if turn_speed >= 100 or search <= 0:
+                break
+        searches = {}
+        for action in TURN_ACTIONS:
+            searches[action] = right_search if "RIGHT" in action else left_search
+        return frames, searches
+
+    def set_motor_action(self, action):
+        frame = self.action_frames.get(action)
+        if frame is not None:
+            self.motor_driver.setFrame(frame)
+            self.search_step = 0  # Reset search intensity
+            self.last_direction = action
+            return
+
+        if action == "LINE LOST":
+            # Increase search intensity each time we lose the line for sharper turns
+            self.search_step += 1
+
+        # Aggressive turning when line is lost - much sharper turns
+        if ticks_diff(ticks_ms(), self.line_lost_time) < self.grace_period:
+            frames = self.search_frames.get(self.last_direction)
+            if frames is not None:
+                self.motor_driver.setFrame(frames[min(self.search_step, len(frames) - 1)])
+            else:
+                # Forward was last direction, do gentle search
+                self.set_motor_action(self.last_direction)
+        else:
+            self.motor_driver.StopAllMotors()
+            self.search_step = 0  # Reset search intensity
+
+    # ------------------------
+    # Continuous steering (mode=pid)
+    # ------------------------
+    def steer(self, bits, act):
+        """
+        PID on the weighted line position. The output is a differential
+        speed: the outer side runs at base_speed + u, the inner side at
+        base_speed - u, down to full reverse of the inner wheels. The
+        derivative is low-pass filtered (PID_D_TAU_MS). The integral only
+        accumulates while the output is not saturated or is coming back
+        out of saturation (anti-windup). All in small ints, so a tick
+        allocates nothing: the error in 1/PID_SCALE, the derivative in
+        1/PID_SCALE per second, the integral and the output in
+        1/(PID_SCALE * PID_GAIN_SCALE) speed %.
+        """
+        now = self.tick_ms
+        error = self.error_table[bits]
+        if self.pid_ms is None:
+            dt = 50
+            self.pid_error = error
+        else:
+            dt = ticks_diff(now, self.pid_ms)
+            if dt <= 0:
+                return
+            if dt > 200:
+                dt = 200
+        self.pid_ms = now
+
+        # Rounded, as flooring would drag the derivative down every tick
+        raw_d = ((error - self.pid_error) * 1000 + dt // 2) // dt
+        self.pid_error = error
+        span = PID_D_TAU_MS + dt
+        self.pid_derivative += (dt * (raw_d - self.pid_derivative) + span // 2) // span
+
+        kp, ki, kd = self.pid_gains
+        unit = PID_SCALE * PID_GAIN_SCALE
+        limit = 2 * self.base_speed * unit
+        integral = self.pid_integral + (ki * error * dt + 500) // 1000
+        u = kp * error + integral + kd * self.pid_derivative
+        if u > limit:
+            u = limit
+            if error < 0:
+                self.pid_integral = integral
+        elif u < -limit:
+            u = -limit
+            if error > 0:
+                self.pid_integral = integral
+        else:
+            self.pid_integral = integral
+
+        base = self.base_speed * unit
+        self.motor_driver.DriveSides(_div0(base + u, unit), _div0(base - u, unit))
+        self.search_step = 0
+        self.last_direction = act
+
+    # ------------------------
+    # Control tick
+    # ------------------------
+    def tick(self):
+        commands = self._commands
+        while commands.head != commands.tail:
+            command, params, stops = commands.get()
+            self._apply(command, params, stops)
+
+        bits = self.sensor_bits = self.sensors.read()
+        act = self.action = self.decide_table[bits]
+        self.ticks += 1
+        self.tick_ms = ticks_ms()
+
+        stops = None
+        if self.estop is not None:
+            stops = self._check_stop()
+
+        if self.robot_running:
+            self._follow(bits, act)
+
+        try:
+            self.motor_driver.flush()
+        except OSError as e:
+            # Shadow is invalidated by flush(); the next tick rewrites everything
+            logger.error(MSG_I2C_ERROR, e.args[0] if e.args and isinstance(e.args[0], int) else -1)
+            stops = None  # not on the board; the next tick stages them again
+        if stops is not None:
+            self.estop.acknowledge(stops)
+
+        if self.recorder is not None:
+            self.recorder.record(self)
+        if self.exchange is not None:
+            self.exchange.record(self)
+
+    def _check_stop(self):
+        """
+        Halts after an emergency stop triggered elsewhere (its outputs are
+        already off), or when the controlling client has gone silent.
+        Returns estop.count when stops are waiting for the flush to be
+        acknowledged, else None. The shadow is only ever changed here, on
+        the control core, never by the stop itself.
+        """
+        estop = self.estop
+        count = estop.count
+        if count != estop.acked:
+            if count != self._stops_seen:
+                self._stops_seen = count
+                if self.robot_running:
+                    logger.warn(MSG_ESTOP)
+                self._halt()
+            # else a start posted after these stops supersedes them
+            return count
+        if (self.robot_running and self.deadman is not None
+                and self.deadman.check(self.tick_ms)):
+            self._halt()
+            logger.warn(MSG_DEADMAN, self.deadman.timeout_ms)
+        return None
+
+    def _halt(self):
+        self.robot_running = False
+        self.line_lost = False
+        self.motor_driver.StageStop()
+        self.search_step = 0
+
+    def _follow(self, bits, act):
+        if act == "ON JUNCTION":
+            self.motor_driver.StopAllMotors()
+            self.mission_done = True
+            self.robot_running = False
+            logger.info(MSG_JUNCTION)
+
+        elif act == "LINE LOST":
+            if not self.line_lost:
+                self.line_lost = True
+                self.line_lost_time = ticks_ms()
+                self.lost_stopped = False
+                logger.warn(MSG_LOST)
+            elif ticks_diff(ticks_ms(), self.line_lost_time) >= self.grace_period:
+                self.motor_driver.StopAllMotors()
+                if not self.lost_stopped:
+                    # Once, on entering the stopped state: every tick would
+                    # push the events that explain it out of the log ring
+                    self.lost_stopped = True
+                    logger.warn(MSG_LOST_STOP)
+            else:
+                # Continue with aggressive search during grace period
+                self.set_motor_action(act)
+
+        else:
+            if self.line_lost:
+                self.line_lost = False
+                self.reset_pid()
+                logger.info(MSG_FOUND)
+
+            # Set motors based on action
+            if self.steer_mode == "pid":
+                self.steer(bits, act)
+            else:
+                self.set_motor_action(act)
+
+        logger.debug(MSG_TICK, bits, ACTION_CODES[act], self.search_step)
@@ -0,0 +1,146 @@
+# picobot_log.py
+# Levelled logger for code that must not block. log() packs a fixed-size
+# binary record (time, level, message id, up to six numbers) into a
+# preallocated ring and returns; nothing is formatted or printed there.
+# Text is only made when records are read: by the console task (run()) or
+# by GET /log (lines()).
+#
+# Record, little-endian, RECORD_SIZE bytes:
+#   I  ticks_ms
+#   B  level
+#   B  message id, from message()
+#   xx
+#   6f arguments (float32, so ints up to 2**24 are exact)
+import ustruct
+from time import ticks_ms
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+DEBUG = 10
+INFO = 20
+WARN = 30
+ERROR = 40
+LEVELS = {DEBUG: "DEBUG", INFO: "INFO", WARN: "WARN", ERROR: "ERROR"}
+
+RECORD = '<IBBxx6f'
+RECORD_SIZE = 32
+MAX_ARGS = 6
+
+
+class Logger:
+    def __init__(self, size=128, level=INFO):
+        """
+        size  - records kept in the ring; the oldest are overwritten
+        level - records below this level are not stored
+        """
+        self.size = size
+        self.level = level
+        self.buf = bytearray(size * RECORD_SIZE)
+        self.head = 0     # sequence number of the next record
+        self.console = 0  # sequence number of the next record for run()
+        self.dropped = 0  # records overwritten before run() printed them
+        self.messages = []
+
+    def message(self, fmt, fn=None):
+        """
+        Registers a message and returns its id. fmt is a %-format; its
+        conversions say how the stored numbers come back (%f/%g/%e as
+        floats, anything else as int). With fn, the text is fn(*args) and
+        fmt only documents the message.
+        """
+        kinds = []
+        i = fmt.find("%")
+        while i >= 0:
+            j = i + 1
+            while j < len(fmt) and fmt[j] not in "diouxXeEfFgGcrs%":
+                j += 1
+            if j < len(fmt) and fmt[j] != "%":
+                kinds.append(fmt[j] in "eEfFgG")
+            i = fmt.find("%", j + 1)
+        self.messages.append((fmt, tuple(kinds), fn))
+        return len(self.messages) - 1
+
+    # ------------------------
+    # Recording: no formatting, no I/O
+    # ------------------------
+    def log(self, level, msg, a=0, b=0, c=0, d=0, e=0, f=0):
+        if level < self.level:
+            return
+        ustruct.pack_into(RECORD, self.buf, (self.head % self.size) * RECORD_SIZE,
+                          ticks_ms(), level, msg, a, b, c, d, e, f)
+        self.head += 1
+
+    def debug(self, msg, a=0, b=0, c=0, d=0, e=0, f=0):
+        if self.level <= DEBUG:
+            self.log(DEBUG, msg, a, b, c, d, e, f)
+
+    def info(self, msg, a=0, b=0, c=0, d=0, e=0, f=0):
+        self.log(INFO, msg, a, b, c, d, e, f)
+
+    def warn(self, msg, a=0, b=0, c=0, d=0, e=0, f=0):
+        self.log(WARN, msg, a, b, c, d, e, f)
+
+    def error(self, msg, a=0, b=0, c=0, d=0, e=0, f=0):
+        self.log(ERROR, msg, a, b, c, d, e, f)
+
+    # ------------------------
+    # Reading: formats on demand
+    # ------------------------
+    def oldest(self):
+        "Sequence number of the oldest record still in the ring"
+        return self.head - self.size if self.head > self.size else 0
+
+    def format(self, seq):
+        "One record as a line of text"
+        ms, level, msg, *args = ustruct.unpack_from(RECORD, self.buf, (seq % self.size) * RECORD_SIZE)
+        fmt, kinds, fn = self.messages[msg]
+        values = tuple(args[i] if kinds[i] else int(args[i]) for i in range(len(kinds)))
+        text = fn(*values) if fn else fmt % values
+        return "%d.%03d %s %s" % (ms // 1000, ms % 1000, LEVELS.get(level, level), text)
+
+    def lines(self, since=0, limit=None):
+        "(next sequence number, lines) for the records from `since` still in the ring"
+        start = max(since, self.oldest())
+        end = self.head
+        if limit is not None and end - start > limit:
+            start = end - limit
+        return end, [self.format(seq) for seq in range(start, end)]
+
+    async def run(self, period_ms=200, batch=8):
+        """
+        Console drain task: prints new records a few at a time, yielding in
+        between so printing never holds up the event loop for long.
+        """
+        while True:
+            oldest = self.oldest()
+            if self.console < oldest:
+                self.dropped += oldest - self.console
+                self.console = oldest
+            n = 0
+            while self.console < self.head and n < batch:
+                print(self.format(self.console))
+                self.console += 1
+                n += 1
+            await asyncio.sleep_ms(0 if self.console < self.head else period_ms)
+
+    def stats(self):
+        return {
+            'level': LEVELS.get(self.level, self.level),
+            'records': self.head,
+            'kept': self.head - self.oldest(),
+            'dropped': self.dropped,
+        }
+
+
+def level_from_name(name):
+    for level, n in LEVELS.items():
+        if n == name.upper():
+            return level
+    raise ValueError("unknown log level " + name)
+
+
+# Shared by the firmware modules
+logger = Logger()
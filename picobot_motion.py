@@ -0,0 +1,424 @@
+# picobot_motion.py
+# Non-blocking motion engine for a group of servos on adjacent PCA9685
+# channels. A move takes every joint from where it is to its target at the
+# same time: the joint that needs longest under the velocity and
+# acceleration limits sets the duration, the others are stretched to match,
+# so all of them arrive together. Positions are computed from ticks_ms()
+# since the move started, not counted in steps, so a late step never slows
+# the move down.
+#
+# Each step packs all channels into one frame ('<HH' ON/OFF per channel) and
+# sends it with a single auto-increment write; a frame identical to the last
+# one is not sent. step() does a few float operations per joint and no I/O
+# besides that write; run() is the cooperative task that calls it.
+#
+# Profiles (normalised position s over normalised time u, both 0..1):
+#   'linear'    - constant velocity; the velocity limit only
+#   'trapezoid' - constant acceleration up to the velocity limit, cruise,
+#                 constant deceleration
+#   'smooth'    - minimum-jerk 10u^3 - 15u^4 + 6u^5; zero velocity and
+#                 acceleration at both ends
+#
+# Angles become OFF counts through a PulseTable: one array('H') per joint,
+# built once from that servo's calibrated pulse range, so a step only
+# indexes it. Fixed sequences are Trajectory objects: named poses and
+# keyframes, compiled once into the register frames play() sends as they are.
+import math
+import ustruct
+from array import array
+from time import ticks_ms, ticks_diff
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+PROFILES = ("linear", "trapezoid", "smooth")
+
+# OFF counts for 0 and 180 degrees at 50 Hz (1 ms and 2 ms)
+MIN_PULSE = 102
+MAX_PULSE = 512
+
+
+class PulseTable:
+    def __init__(self, calibration=((MIN_PULSE, MAX_PULSE),) * 3, steps_per_degree=2):
+        """
+        calibration      - (pulse at 0 degrees, pulse at 180 degrees) per
+                           joint; a reversed servo has them swapped
+        steps_per_degree - table resolution; 2 gives 0.5 degree steps
+        """
+        self.calibration = tuple(tuple(c) for c in calibration)
+        self.scale = steps_per_degree
+        n = 180 * steps_per_degree + 1
+        self.tables = []
+        for lo, hi in self.calibration:
+            t = array('H', bytes(2 * n))
+            for k in range(n):
+                t[k] = int(lo + (hi - lo) * k / (n - 1) + 0.5)
+            self.tables.append(t)
+
+    def __call__(self, joint, angle):
+        "OFF count for an angle, 0-180 degrees"
+        return self.tables[joint][int(angle * self.scale + 0.5)]
+
+
+def shape(profile, u, f=0.25):
+    """
+    Normalised position at normalised time u for a profile (index into
+    PROFILES); f is the trapezoid's acceleration phase as a fraction of the move
+    """
+    if profile == 0:
+        return u
+    if profile == 1:
+        vp = 1 / (1 - f)
+        if u < f:
+            return vp * u * u / (2 * f)
+        if u <= 1 - f:
+            return vp * (u - f / 2)
+        r = 1 - u
+        return 1 - vp * r * r / (2 * f)
+    return u * u * u * (10 + u * (6 * u - 15))
+
+
+class MotionEngine:
+    def __init__(self, pca, channels=(0, 1, 2), angles=None, pulse=None,
+                 velocity=90.0, accel=360.0, profile="trapezoid", period_ms=20):
+        """
+        pca      - pca9685.PCA9685 (freq() turns register auto-increment on)
+        channels - adjacent channels, lowest first; joint i is channels[i]
+        angles   - dict channel -> angle (degrees) shared with the owner; read
+                   when a move starts, kept up to date while moving
+        pulse    - PulseTable, or any function(joint, angle) -> OFF count;
+                   by default a PulseTable with MIN_PULSE..MAX_PULSE for
+                   every joint
+        velocity - default limit, degrees/second
+        accel    - default limit, degrees/second^2
+        """
+        if list(channels) != list(range(channels[0], channels[0] + len(channels))):
+            raise ValueError("channels must be adjacent")
+        self.pca = pca
+        self.channels = tuple(channels)
+        self.n = len(channels)
+        self.angles = angles if angles is not None else {ch: 90 for ch in channels}
+        self.pulse = pulse if pulse is not None else PulseTable(((MIN_PULSE, MAX_PULSE),) * len(channels))
+        self.velocity = velocity
+        self.accel = accel
+        self.profile = profile
+        self.period_ms = period_ms
+        self.frame = bytearray(4 * self.n)
+        self._sent = bytearray(4 * self.n)
+        self._have_sent = False
+        self.pos = [float(self.angles.get(ch, 90)) for ch in channels]
+        self.start = [0.0] * self.n
+        self.delta = [0.0] * self.n
+        self.moving = False
+        self.track = None     # Trajectory being played
+        self._index = -1      # its frame last sent
+        self._t0 = 0
+        self._duration_ms = 0
+        self._shape = 0       # index into PROFILES of the move in progress
+        self._f = 0.0         # trapezoid: acceleration phase, fraction of the move
+        self.steps = 0
+        self.writes = 0
+
+    # ------------------------
+    # Planning
+    # ------------------------
+    def move(self, targets, velocity=None, accel=None, profile=None, duration_ms=None):
+        """
+        Starts a coordinated move and returns at once; a move in progress is
+        replaced from where the joints are now. targets is {channel: angle}
+        (joints left out stay put) or a sequence with one angle per joint.
+        duration_ms, if given, is used when it is longer than the limits
+        allow. Returns the planned duration in ms.
+        """
+        velocity = velocity or self.velocity
+        accel = accel or self.accel
+        profile = profile or self.profile
+        shape = PROFILES.index(profile)
+        self._resync()
+        self.track = None
+        longest = 0.0
+        d_max = 0.0
+        for i in range(self.n):
+            ch = self.channels[i]
+            if isinstance(targets, dict):
+                target = targets.get(ch, self.pos[i])
+            else:
+                target = targets[i]
+            if not 0 <= target <= 180:
+                raise ValueError("angle out of range 0-180")
+            self.start[i] = self.pos[i]
+            self.delta[i] = target - self.pos[i]
+            d = abs(self.delta[i])
+            t = self._time_for(d, velocity, accel, shape)
+            if t > longest:
+                longest = t
+                d_max = d
+        if duration_ms is not None and duration_ms / 1000 > longest:
+            longest = duration_ms / 1000
+        self._shape = shape
+        if shape == 1:
+            # Acceleration phase of the joint that sets the pace; its
+            # velocity limit is reached only if the move is long enough
+            ta = velocity / accel
+            if d_max < velocity * velocity / accel:
+                ta = math.sqrt(d_max / accel)
+            self._f = min(ta / longest, 0.5) if longest > 0 else 0.5
+        self._duration_ms = int(longest * 1000 + 0.5)
+        self._t0 = ticks_ms()
+        self.moving = True
+        return self._duration_ms
+
+    @staticmethod
+    def _time_for(d, v, a, shape):
+        "Shortest time (s) for distance d under the limits"
+        if d == 0:
+            return 0.0
+        if shape == 0:
+            return d / v
+        if shape == 1:
+            if d >= v * v / a:
+                return d / v + v / a
+            return 2 * math.sqrt(d / a)
+        # minimum jerk: peak velocity 1.875 d/T, peak acceleration 5.774 d/T^2
+        return max(1.875 * d / v, math.sqrt(5.774 * d / a))
+
+    def _resync(self):
+        "Picks up joints moved by someone else through the shared angles dict"
+        for i in range(self.n):
+            a = self.angles.get(self.channels[i])
+            if a is not None and a != int(self.pos[i] + 0.5):
+                self.pos[i] = float(a)
+
+    # ------------------------
+    # Execution
+    # ------------------------
+    def play(self, track):
+        """
+        Starts playing a compiled Trajectory and returns at once. It begins
+        at its first pose wherever the joints are; PicoBotArm.play() moves
+        there first.
+        """
+        if track.frames is None or track.n != self.n:
+            raise ValueError("trajectory not compiled for %d joints" % self.n)
+        self._resync()
+        self.track = track
+        self._index = -1
+        self._t0 = ticks_ms()
+        self.moving = True
+
+    def step(self):
+        "Advances the move to now and writes the frame if it changed; True while moving"
+        if not self.moving:
+            return False
+        if self.track is not None:
+            return self._play_step()
+        elapsed = ticks_diff(ticks_ms(), self._t0)
+        if elapsed >= self._duration_ms:
+            s = 1.0
+            self.moving = False
+        else:
+            s = shape(self._shape, elapsed / self._duration_ms, self._f)
+        frame = self.frame
+        pulse = self.pulse
+        tables = pulse.tables if isinstance(pulse, PulseTable) else None
+        for i in range(self.n):
+            p = self.start[i] + self.delta[i] * s
+            self.pos[i] = p
+            self.angles[self.channels[i]] = int(p + 0.5)
+            if tables is not None:
+                v = tables[i][int(p * pulse.scale + 0.5)]
+            else:
+                v = pulse(i, p)
+            ustruct.pack_into('<HH', frame, 4 * i, 0, v)
+        self.steps += 1
+        self.send()
+        return self.moving
+
+    def _play_step(self):
+        track = self.track
+        k = ticks_diff(ticks_ms(), self._t0) // track.period_ms
+        if k >= track.count - 1:
+            k = track.count - 1
+            self.moving = False
+        self.steps += 1
+        if k != self._index:
+            self._index = k
+            size = 4 * self.n
+            self.frame[:] = track.mv[k * size:(k + 1) * size]
+            self.send()
+            a = track.angles
+            for i in range(self.n):
+                self.angles[self.channels[i]] = a[k * self.n + i]
+            if not self.moving:
+                for i in range(self.n):
+                    self.pos[i] = float(a[k * self.n + i])
+        return self.moving
+
+    def send(self):
+        "Writes the frame, unless the chip already has it"
+        if self._have_sent and self.frame == self._sent:
+            return
+        self.pca.pwm_block(self.channels[0], self.frame)
+        self._sent[:] = self.frame
+        self._have_sent = True
+        self.writes += 1
+
+    async def run(self):
+        "Cooperative task: steps every period_ms while a move is in progress"
+        while True:
+            self.step()
+            await asyncio.sleep_ms(self.period_ms)
+
+    async def wait(self):
+        "Returns when the current move has finished"
+        while self.moving:
+            await asyncio.sleep_ms(self.period_ms)
+
+    def stats(self):
+        return {
+            'moving': self.moving,
+            'angles': [round(p, 1) for p in self.pos],
+            'steps': self.steps,
+            'writes': self.writes,
+        }
+
+
+# ------------------------
+# Keyframe trajectories
+# ------------------------
+class Trajectory:
+    """
+    Named poses and keyframes, kept in arrays:
+      poses     - {name: (angle per joint)}, angles 0-180
+      keyframes - [(pose name, ms)]: reach the pose ms after the previous
+                  keyframe (a repeated pose holds); the first keyframe is
+                  where playback starts and its ms is ignored
+      profile   - interpolation between keyframes, see PROFILES; a
+                  trapezoid accelerates for a quarter of each segment
+    compile() turns it into register frames, one per period_ms.
+    """
+    def __init__(self, poses, keyframes, profile="smooth", period_ms=20):
+        self.pose_names = sorted(poses)
+        self.n = len(poses[self.pose_names[0]])
+        self.pose_angles = array('B')
+        for name in self.pose_names:
+            angles = poses[name]
+            if len(angles) != self.n or not all(0 <= a <= 180 for a in angles):
+                raise ValueError("pose %s: %d angles 0-180 expected" % (name, self.n))
+            self.pose_angles.extend(array('B', [int(a + 0.5) for a in angles]))
+        self.key_pose = array('B', [self.pose_names.index(name) for name, ms in keyframes])
+        self.key_ms = array('H', [0] + [ms for name, ms in keyframes[1:]])
+        self.profile = PROFILES.index(profile)
+        self.period_ms = period_ms
+        self.frames = None   # bytearray, 4 bytes per joint per frame, once compiled
+        self.mv = None
+        self.angles = None   # array('B'), angle per joint per frame
+        self.count = 0
+
+    @classmethod
+    def from_dict(cls, d, period_ms=20):
+        "From {'poses': {...}, 'keyframes': [[pose, ms], ...], 'profile': ...}, e.g. parsed JSON"
+        return cls(d['poses'], [tuple(k) for k in d['keyframes']],
+                   d.get('profile', "smooth"), d.get('period_ms', period_ms))
+
+    def pose(self, index):
+        "Angles of pose number index (into pose_names)"
+        return self.pose_angles[index * self.n:(index + 1) * self.n]
+
+    def duration_ms(self):
+        return sum(self.key_ms)
+
+    def compile(self, pulse):
+        "Precomputes every frame with a PulseTable (or pulse function); returns self"
+        n = self.n
+        count = self.duration_ms() // self.period_ms + 1
+        frames = bytearray(4 * n * count)
+        angles = array('B', bytes(n * count))
+        key_t = 0
+        seg = 0
+        for k in range(count):
+            t = k * self.period_ms
+            while seg < len(self.key_ms) - 1 and t >= key_t + self.key_ms[seg + 1]:
+                key_t += self.key_ms[seg + 1]
+                seg += 1
+            a = self.pose(self.key_pose[seg])
+            if seg < len(self.key_ms) - 1:
+                b = self.pose(self.key_pose[seg + 1])
+                s = shape(self.profile, (t - key_t) / self.key_ms[seg + 1])
+            else:
+                b, s = a, 0.0
+            for i in range(n):
+                angle = a[i] + (b[i] - a[i]) * s
+                angles[k * n + i] = int(angle + 0.5)
+                ustruct.pack_into('<HH', frames, 4 * (k * n + i), 0, pulse(i, angle))
+        self.frames = frames
+        self.mv = memoryview(frames)
+        self.angles = angles
+        self.count = count
+        return self
+
+    def start_angles(self):
+        "Angles of the first keyframe, one per joint"
+        return list(self.pose(self.key_pose[0]))
+
+    def nbytes(self):
+        return len(self.frames) + len(self.angles) if self.frames is not None else 0
+
+
+class TrajectoryLibrary:
+    """
+    Compiled trajectories by name, loaded from <directory>/<name>.json on
+    first use. When the compiled frames exceed max_bytes, the least recently
+    used are dropped and compiled again if needed.
+    """
+    def __init__(self, pulse, directory="arm", period_ms=20, max_bytes=16 * 1024):
+        self.pulse = pulse
+        self.directory = directory
+        self.period_ms = period_ms
+        self.max_bytes = max_bytes
+        self.cache = {}
+        self._order = []   # names, least recently used first
+        self.compiled = 0
+
+    def add(self, name, track):
+        "Compiles and caches a Trajectory (or a dict for Trajectory.from_dict)"
+        if isinstance(track, dict):
+            track = Trajectory.from_dict(track, self.period_ms)
+        track.compile(self.pulse)
+        self.compiled += 1
+        self.cache[name] = track
+        self._touch(name)
+        self._trim(name)
+        return track
+
+    def load(self, name):
+        track = self.cache.get(name)
+        if track is not None:
+            self._touch(name)
+            return track
+        import json
+        with open("%s/%s.json" % (self.directory, name)) as f:
+            return self.add(name, json.load(f))
+
+    def _touch(self, name):
+        if name in self._order:
+            self._order.remove(name)
+        self._order.append(name)
+
+    def _trim(self, keep):
+        total = sum(t.nbytes() for t in self.cache.values())
+        for name in list(self._order):
+            if total <= self.max_bytes:
+                break
+            if name != keep:
+                total -= self.cache.pop(name).nbytes()
+                self._order.remove(name)
+
+    def stats(self):
+        return {
+            'cached': list(self._order),
+            'bytes': sum(t.nbytes() for t in self.cache.values()),
+            'compiled': self.compiled,
+        }
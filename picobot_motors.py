@@ -1,95 +1,167 @@
 import time
-from machine import Pin, I2C
-import math
-
-class PCA9685:
-    # Registers/etc.
-    __SUBADR1            = 0x02
-    __SUBADR2            = 0x03
-    __SUBADR3            = 0x04
-    __MODE1              = 0x00
-    __PRESCALE           = 0xFE
-    __LED0_ON_L          = 0x06
-    __LED0_ON_H          = 0x07
-    __LED0_OFF_L         = 0x08
-    __LED0_OFF_H         = 0x09
-    __ALLLED_ON_L        = 0xFA
-    __ALLLED_ON_H        = 0xFB
-    __ALLLED_OFF_L       = 0xFC
-    __ALLLED_OFF_H       = 0xFD
-
-    def __init__(self, address=0x40, debug=False):
-        self.i2c = I2C(0, scl=Pin(21), sda=Pin(20), freq=100000)
-        self.address = address
-        self.debug = debug
-        if (self.debug):
-            print("Reseting PCA9685") 
-        self.write(self.__MODE1, 0x00)
+from pca9685 import PCA9685
+import picobot_i2c
+import ustruct
 
-    def write(self, cmd, value):
-        "Writes an 8-bit value to the specified register/address"
-        self.i2c.writeto_mem(int(self.address), int(cmd), bytes([int(value)]))
-        if (self.debug):
-            print("I2C: Write 0x%02X to register 0x%02X" % (value, cmd))
-  
-    def read(self, reg):
-        "Read an unsigned byte from the I2C device"
-        rdate = self.i2c.readfrom_mem(int(self.address), int(reg), 1)
-        if (self.debug):
-            print("I2C: Device 0x%02X returned 0x%02X from reg 0x%02X" % (self.address, int(reg), rdate[0]))
-        return rdate[0]
-
-    def setPWMFreq(self, freq):
-        "Sets the PWM frequency"
-        prescaleval = 25000000.0    # 25MHz
-        prescaleval /= 4096.0       # 12-bit
-        prescaleval /= float(freq)
-        prescaleval -= 1.0
-        if (self.debug):
-            print("Setting PWM frequency to %d Hz" % freq)
-            print("Estimated pre-scale: %d" % prescaleval)
-        prescale = math.floor(prescaleval + 0.5)
-        if (self.debug):
-            print("Final pre-scale: %d" % prescale)
-
-        oldmode = self.read(self.__MODE1)
-        #print("oldmode = 0x%02X" %oldmode)
-        newmode = (oldmode & 0x7F) | 0x10        # sleep
-        self.write(self.__MODE1, newmode)        # go to sleep
-        self.write(self.__PRESCALE, int(math.floor(prescale)))
-        self.write(self.__MODE1, oldmode)
-        time.sleep(0.005)
-        self.write(self.__MODE1, oldmode | 0x80)
-
-    def setPWM(self, channel, on, off):
-        "Sets a single PWM channel"
-        self.write(self.__LED0_ON_L+4*channel, on & 0xFF)
-        self.write(self.__LED0_ON_H+4*channel, on >> 8)
-        self.write(self.__LED0_OFF_L+4*channel, off & 0xFF)
-        self.write(self.__LED0_OFF_H+4*channel, off >> 8)
-        if (self.debug):
-            print("channel: %d  LED_ON: %d LED_OFF: %d" % (channel,on,off))
-  
-    def setServoPulse(self, channel, pulse):
-        pulse = pulse * (4095 / 100)
-        self.setPWM(channel, 0, int(pulse))
-    
-    def setLevel(self, channel, value):
-        if (value == 1):
-              self.setPWM(channel, 0, 4095)
-        else:
-              self.setPWM(channel, 0, 0)
+# Motor board: PCA9685 at 0x40 on I2C 0, GPIO 21 (SCL) / 20 (SDA)
+I2C_ID = 0
+I2C_SCL = 21
+I2C_SDA = 20
+I2C_FREQ = 400000  # fastest clock to try; the bus falls back if the wiring cannot take it
 
 class MotorDriver():
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, i2c=None, auto_increment=True, freq=I2C_FREQ):
+        """
+        i2c  - picobot_i2c.I2CBus or I2C object; by default the shared bus
+               I2C_ID, clocked as fast as `freq` and the wiring allow
+        """
         self.debug = debug
-        self.pwm = PCA9685()
-        self.pwm.setPWMFreq(50)       
+        if i2c is None:
+            i2c = picobot_i2c.get(I2C_ID, scl=I2C_SCL, sda=I2C_SDA, freq=freq)
+            i2c.probe(0x40)
+        self.pwm = PCA9685(i2c, auto_increment=auto_increment)
+        self.pwm.setPWMFreq(50)
         #self.MotorPin = ['MA', 0,1,2, 'MB',3,4,5, 'MC',6,7,8, 'MD',9,10,11]
         #self.MotorDir = ['forward', 0,1, 'backward',1,0]
         self.MotorPin = ['LeftFront', 0,1,2, 'LeftBack',3,4,5, 'RightFront',6,7,8, 'RightBack',9,10,11]
         self.MotorDir = ['forward', 0,1, 'backward',1,0]
         self.x=0
+        # Shadow of the 16 LEDn_ON_L..LEDn_OFF_H register quads. _want is what
+        # the callers asked for, _shadow is what the chip is known to hold.
+        # Only channels in _dirty are sent, adjacent ones in a single block.
+        self._want = bytearray(64)
+        self._shadow = bytearray(64)
+        self._want_mv = memoryview(self._want)
+        self._known = 0     # bit per channel: _shadow matches the chip
+        self._used = 0      # bit per channel: ever set through this driver
+        self._dirty = 0
+        self._frame = None  # last frame passed to setFrame, while still current
+        self._stop = bytes(48)  # channels 0-11 stopped, for EmergencyStop
+        # When False, TurnMotor/StopAllMotors only update _want and the
+        # caller sends everything with one flush()
+        self.autoflush = True
+        self.profiler = None  # picobot_profile.Profiler: times flushes that write
+
+    def setChannel(self, channel, on, off):
+        "Stages a channel's ON/OFF counts in the shadow; nothing goes on the bus"
+        i = 4 * channel
+        w = self._want
+        w[i] = on & 0xFF
+        w[i+1] = on >> 8
+        w[i+2] = off & 0xFF
+        w[i+3] = off >> 8
+        bit = 1 << channel
+        self._used |= bit
+        self._frame = None
+        sh = self._shadow
+        if (self._known & bit and sh[i] == w[i] and sh[i+1] == w[i+1]
+                and sh[i+2] == w[i+2] and sh[i+3] == w[i+3]):
+            self._dirty &= ~bit
+        else:
+            self._dirty |= bit
+
+    def makeFrame(self, settings):
+        """
+        Builds a register frame for channels 0-11 from {motor: (mdir, speed)}.
+        Motors left out of settings are stopped. The result is meant to be
+        built once and passed to setFrame() as often as needed.
+        """
+        frame = bytearray(48)
+        for motor in settings:
+            mdir, speed = settings[motor]
+            if speed > 100:
+                speed = 100
+            mPin = self.MotorPin.index(motor)
+            mDir = self.MotorDir.index(mdir)
+            ustruct.pack_into('<HHHHHH', frame, 4 * self.MotorPin[mPin+1],
+                              0, int(speed * (4095 / 100)),
+                              0, 4095 if self.MotorDir[mDir+1] == 1 else 0,
+                              0, 4095 if self.MotorDir[mDir+2] == 1 else 0)
+        return frame
+
+    def setFrame(self, frame, first=0):
+        """
+        Stages a prebuilt frame (4 bytes per channel, starting at `first`).
+        Passing the frame that is already current costs nothing; of any other
+        frame only the channels that differ from what the chip holds are
+        marked dirty. Frames must not be modified after they have been
+        handed in.
+        """
+        if frame is self._frame and not self._dirty:
+            return
+        i = 4 * first
+        n = len(frame) // 4
+        self._want[i:i + 4*n] = frame
+        sh = self._shadow
+        known = self._known
+        dirty = self._dirty
+        bit = 1 << first
+        for j in range(0, 4 * n, 4):
+            k = i + j
+            if (known & bit and sh[k] == frame[j] and sh[k+1] == frame[j+1]
+                    and sh[k+2] == frame[j+2] and sh[k+3] == frame[j+3]):
+                dirty &= ~bit
+            else:
+                dirty |= bit
+            bit <<= 1
+        self._used |= ((1 << n) - 1) << first
+        self._dirty = dirty
+        self._frame = frame
+        if self.autoflush:
+            self.flush()
+
+    def _stageMotor(self, first, speed, a, b):
+        self.setChannel(first, 0, int(speed * 4095 // 100))  # no float for int speeds
+        self.setChannel(first+1, 0, 4095 if a == 1 else 0)
+        self.setChannel(first+2, 0, 4095 if b == 1 else 0)
+
+    def flush(self):
+        """
+        Sends every dirty channel and returns the number of bus writes.
+        Runs of adjacent dirty channels go out as one auto-increment write.
+        On a bus error the whole shadow is invalidated and the error re-raised,
+        so the next flush rewrites every channel in use.
+        """
+        dirty = self._dirty
+        if not dirty:
+            return 0
+        p = self.profiler
+        if p is not None and p.enabled:
+            t0 = time.ticks_us()
+        writes = 0
+        ch = 0
+        try:
+            while dirty >> ch:
+                if not (dirty >> ch) & 1:
+                    ch += 1
+                    continue
+                start = ch
+                while (dirty >> ch) & 1:
+                    ch += 1
+                if self.pwm.auto_increment:
+                    self.pwm.pwm_block(start, self._want_mv[4*start:4*ch])
+                    writes += 1
+                else:
+                    w = self._want
+                    for c in range(start, ch):
+                        i = 4 * c
+                        self.pwm.setPWM(c, w[i] | w[i+1] << 8, w[i+2] | w[i+3] << 8)
+                        writes += 4
+                self._shadow[4*start:4*ch] = self._want_mv[4*start:4*ch]
+                self._known |= ((1 << (ch - start)) - 1) << start
+                self._dirty &= ~(((1 << (ch - start)) - 1) << start)
+        except OSError:
+            self.invalidate()
+            raise
+        if p is not None and p.enabled:
+            p.i2c.record(time.ticks_diff(time.ticks_us(), t0))
+        return writes
+
+    def invalidate(self):
+        "Forgets what the chip holds; the next flush rewrites every channel in use"
+        self._known = 0
+        self._dirty |= self._used
+        self._frame = None
 
     def MotorRun(self, motor, mdir, speed, runtime):
         if speed > 100:
@@ -103,28 +175,77 @@ class MotorDriver():
             print("set pin A %d , dir %d" %(self.MotorPin[mPin+2], self.MotorDir[mDir+1]))
             print("set pin b %d , dir %d" %(self.MotorPin[mPin+3], self.MotorDir[mDir+2]))
 
-        self.pwm.setServoPulse(self.MotorPin[mPin+1], speed)        
-        self.pwm.setLevel(self.MotorPin[mPin+2], self.MotorDir[mDir+1])
-        self.pwm.setLevel(self.MotorPin[mPin+3], self.MotorDir[mDir+2])
+        self._stageMotor(self.MotorPin[mPin+1], speed,
+                         self.MotorDir[mDir+1], self.MotorDir[mDir+2])
+        self.flush()
         
         time.sleep(runtime)
-        self.pwm.setServoPulse(self.MotorPin[mPin+1], 0)
-        self.pwm.setLevel(self.MotorPin[mPin+2], 0)
-        self.pwm.setLevel(self.MotorPin[mPin+3], 0)
+        self._stageMotor(self.MotorPin[mPin+1], 0, 0, 0)
+        self.flush()
 
     def MotorStop(self, motor):
         mPin = self.MotorPin.index(motor)
-        self.pwm.setServoPulse(self.MotorPin[mPin+1], 0)
+        self.setChannel(self.MotorPin[mPin+1], 0, 0)
+        self.flush()
    ##################################################################     
         
+    def MotorSpeed(self, first):
+        "Signed speed (%, negative = backward) last staged for the motor whose channels start at `first`"
+        w = self._want
+        i = 4 * first
+        speed = ((w[i+2] | w[i+3] << 8) * 100 + 2047) // 4095
+        in1 = w[i+6] | w[i+7] << 8
+        in2 = w[i+10] | w[i+11] << 8
+        if in1 == in2:
+            return 0
+        return speed if in2 else -speed
+
+    def DriveSides(self, left, right):
+        """
+        Signed integer speeds (-100..100, negative = backward) for the left
+        and right motor pairs. Allocates nothing, so the control tick may
+        call it on either core.
+        """
+        self._stageSigned(0, left)
+        self._stageSigned(3, left)
+        self._stageSigned(6, right)
+        self._stageSigned(9, right)
+        if self.autoflush:
+            self.flush()
+
+    def _stageSigned(self, first, speed):
+        if speed >= 0:
+            self._stageMotor(first, speed if speed <= 100 else 100, 0, 1)
+        else:
+            self._stageMotor(first, -speed if speed >= -100 else 100, 1, 0)
+
     def StopAllMotors(self):
         ## from 0 to 11 step 3 -> 0,3,6,9 - first pin of every motor
         for x in range(0, 12, 3):
-            mPin = x
-            self.pwm.setServoPulse(mPin, 0)
-            self.pwm.setLevel(mPin+1, 0)
-            self.pwm.setLevel(mPin+2, 0)        
+            self._stageMotor(x, 0, 0, 0)
+        if self.autoflush:
+            self.flush()
         
+    def EmergencyStop(self):
+        """
+        Every output of the board to full OFF in a single transaction
+        (ALL_LED_OFF_H), whatever is staged or in flight. Only the bus is
+        touched, not the shadow, so any core may call it while the control
+        core drives; that core then calls StageStop(). Until it does, a
+        flush of a new frame turns the outputs back on.
+        """
+        self.pwm.all_off()
+
+    def StageStop(self):
+        """
+        After EmergencyStop: stages the motors stopped and invalidates the
+        shadow, so the next flush writes the stop frame over the full-OFF
+        bits. Only on the core that flushes.
+        """
+        self._want[0:48] = self._stop
+        self._used |= 0xFFF
+        self.invalidate()
+
     def TurnMotor(self, motor, mdir, speed):
         if speed > 100:
             speed = 100
@@ -137,8 +258,7 @@ class MotorDriver():
             print("set pin A %d , dir %d" %(self.MotorPin[mPin+2], self.MotorDir[mDir+1]))
             print("set pin B %d , dir %d" %(self.MotorPin[mPin+3], self.MotorDir[mDir+2]))
 
-        self.pwm.setServoPulse(self.MotorPin[mPin+1], speed)        
-        self.pwm.setLevel(self.MotorPin[mPin+2], self.MotorDir[mDir+1])
-        self.pwm.setLevel(self.MotorPin[mPin+3], self.MotorDir[mDir+2])
-        
-
+        self._stageMotor(self.MotorPin[mPin+1], speed,
+                         self.MotorDir[mDir+1], self.MotorDir[mDir+2])
+        if self.autoflush:
+            self.flush()
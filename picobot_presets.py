@@ -0,0 +1,184 @@
+# picobot_presets.py
+# Named parameter presets, kept in RAM and written to flash only by save().
+# save() writes the whole store to a temporary file and renames it over the
+# old one, so a reset mid-write leaves either the old or the new store; an
+# unchanged store is never rewritten.
+#
+# File (PRESETS_FILE), little-endian:
+#   8-byte header: b"PBPS", u8 FILE_VERSION, u8 parameter count,
+#                  u8 preset count, u8 active preset index (NO_ACTIVE if none)
+#   then per preset, in name order:
+#                  u8 name length, name (utf-8), one float32 per parameter
+#                  in picobot_line.PARAMS order (mode as an index into
+#                  STEER_MODES)
+# A file written with fewer parameters loads with the newer ones left out,
+# so they keep their current value.
+import ustruct
+from picobot_line import PARAMS, STEER_MODES
+
+FILE_VERSION = 1
+HEADER_FORMAT = '<4sBBBB'
+HEADER_SIZE = 8
+NO_ACTIVE = 0xFF
+MAX_NAME = 16
+
+PRESETS_FILE = "presets.bin"
+
+
+def check_name(name):
+    "Preset names are 1..MAX_NAME bytes of printable text"
+    if not name or len(name.encode()) > MAX_NAME or not all(" " <= c <= "~" for c in name):
+        raise ValueError("preset name must be 1-%d printable characters" % MAX_NAME)
+    return name
+
+
+def encode(presets, active=None):
+    "File contents for {name: params}; params missing a key use its default"
+    names = sorted(presets)
+    out = bytearray(ustruct.pack(HEADER_FORMAT, b"PBPS", FILE_VERSION, len(PARAMS), len(names),
+                                 names.index(active) if active in presets else NO_ACTIVE))
+    values_format = '<%df' % len(PARAMS)
+    for name in names:
+        params = presets[name]
+        b = name.encode()
+        out.append(len(b))
+        out.extend(b)
+        values = []
+        for key, attr, kind, default in PARAMS:
+            value = params.get(key, default)
+            values.append(STEER_MODES.index(value) if kind is not int and kind is not float else value)
+        out.extend(ustruct.pack(values_format, *values))
+    return bytes(out)
+
+
+def decode(data):
+    "({name: params}, active name or None) from file contents; ValueError if damaged"
+    if len(data) < HEADER_SIZE:
+        raise ValueError("short presets file")
+    magic, version, n_params, count, active = ustruct.unpack_from(HEADER_FORMAT, data)
+    if magic != b"PBPS" or version != FILE_VERSION:
+        raise ValueError("not a version %d presets file" % FILE_VERSION)
+    n = min(n_params, len(PARAMS))
+    values_format = '<%df' % n_params
+    values_size = 4 * n_params
+    presets = {}
+    names = []
+    off = HEADER_SIZE
+    for _ in range(count):
+        if off >= len(data):
+            raise ValueError("truncated presets file")
+        size = data[off]
+        name = bytes(data[off + 1:off + 1 + size]).decode()
+        off += 1 + size
+        if off + values_size > len(data):
+            raise ValueError("truncated presets file")
+        values = ustruct.unpack_from(values_format, data, off)
+        off += values_size
+        params = {}
+        for i in range(n):
+            key, attr, kind, default = PARAMS[i]
+            if kind is int:
+                params[key] = int(round(values[i]))
+            elif kind is float:
+                params[key] = round(values[i], 6)
+            else:
+                params[key] = STEER_MODES[int(values[i])]
+        presets[name] = params
+        names.append(name)
+    return presets, names[active] if active < len(names) else None
+
+
+class PresetStore:
+    def __init__(self, path=PRESETS_FILE, max_presets=16):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.max_presets = max_presets
+        self.presets = {}    # name -> params dict, as sent to LineFollower.post()
+        self.active = None   # name of the preset applied last
+        self._saved = None   # file contents on flash, to skip unchanged writes
+        self.writes = 0
+        self.skipped = 0
+        self.errors = 0
+
+    # ------------------------
+    # RAM: nothing here touches flash
+    # ------------------------
+    def get(self, name):
+        "Params dict of a preset, KeyError if there is none"
+        return self.presets[name]
+
+    def put(self, name, params):
+        """
+        Stores a preset, replacing one of the same name. Values are checked
+        and converted with the PARAMS types; ValueError if one does not fit.
+        """
+        check_name(name)
+        if name not in self.presets and len(self.presets) >= self.max_presets:
+            raise ValueError("at most %d presets" % self.max_presets)
+        clean = {}
+        for key, attr, kind, default in PARAMS:
+            clean[key] = kind(params[key]) if key in params else default
+        self.presets[name] = clean
+        return clean
+
+    def remove(self, name):
+        del self.presets[name]
+        if self.active == name:
+            self.active = None
+
+    def activate(self, name):
+        "Marks a preset as the one to load at boot and returns its params"
+        params = self.presets[name]
+        self.active = name
+        return params
+
+    # ------------------------
+    # Flash
+    # ------------------------
+    def load(self):
+        """
+        Reads the store from flash; falls back to the temporary file when a
+        reset came between writing it and the rename. Returns True if a
+        store was found.
+        """
+        for path in (self.path, self.tmp_path):
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+                self.presets, self.active = decode(data)
+            except OSError:
+                continue
+            except ValueError:
+                self.errors += 1
+                continue
+            self._saved = data if path == self.path else None
+            return True
+        return False
+
+    def save(self):
+        "Commits the store to flash if it changed; returns True if it wrote"
+        data = encode(self.presets, self.active)
+        if data == self._saved:
+            self.skipped += 1
+            return False
+        import os
+        with open(self.tmp_path, "wb") as f:
+            f.write(data)
+        os.rename(self.tmp_path, self.path)
+        self._saved = data
+        self.writes += 1
+        return True
+
+    def report(self):
+        "The GET /presets response body"
+        return {'active': self.active, 'presets': self.presets}
+
+    def stats(self):
+        return {
+            'presets': len(self.presets),
+            'active': self.active,
+            'file_bytes': len(self._saved) if self._saved else 0,
+            'writes': self.writes,
+            'skipped': self.skipped,
+            'errors': self.errors,
+        }
@@ -0,0 +1,129 @@
+# picobot_profile.py
+# Run-time profiler for the control loop and the web server. Instrumented
+# code checks `profiler.enabled` and hands over ticks_us durations; recording
+# is integer arithmetic on preallocated arrays, so it never allocates and
+# is safe inside the control tick. Only report() (GET /metrics) allocates.
+import gc
+from array import array
+from time import ticks_diff
+
+BUCKETS = 22  # bucket b: durations with b significant bits, [2**(b-1), 2**b) us; the last is open
+RING = 64     # recent samples kept per histogram, a power of two
+
+
+class Histogram:
+    """
+    Log2 histogram of microsecond durations since the last reset, plus a
+    ring of the most recent samples for percentiles.
+    """
+    def __init__(self, ring=RING):
+        self.buckets = array('I', [0] * BUCKETS)
+        self.ring = array('I', [0] * ring)
+        self._mask = ring - 1
+        self.reset()
+
+    def reset(self):
+        for i in range(BUCKETS):
+            self.buckets[i] = 0
+        self.pos = 0
+        self.count = 0
+        self.max = 0
+
+    def record(self, us):
+        if us < 0:
+            us = 0
+        b = 0
+        v = us
+        while v and b < BUCKETS - 1:
+            v >>= 1
+            b += 1
+        self.buckets[b] += 1
+        self.ring[self.pos] = us
+        self.pos = (self.pos + 1) & self._mask
+        self.count += 1
+        if us > self.max:
+            self.max = us
+
+    def report(self):
+        n = self.count if self.count < len(self.ring) else len(self.ring)
+        recent = sorted(self.ring[:n])
+        r = {'count': self.count, 'max_us': self.max}
+        if n:
+            r['recent'] = {
+                'n': n,
+                'p50_us': recent[n // 2],
+                'p90_us': recent[n * 9 // 10],
+                'p99_us': recent[n * 99 // 100],
+                'max_us': recent[-1],
+            }
+        # [upper bound in us (exclusive, None = open), count] for non-empty buckets
+        r['buckets'] = [[1 << b if b < BUCKETS - 1 else None, c]
+                        for b, c in enumerate(self.buckets) if c]
+        return r
+
+
+class Profiler:
+    """
+    tick    - control tick duration
+    jitter  - |tick-to-tick interval - period|
+    i2c     - MotorDriver.flush() time when something went on the bus
+    request - HTTP request service time, head received to response written
+    gc      - duration of ticks during which a garbage collection ran
+    `collections` counts every collection seen between two ticks.
+    """
+    NAMES = ('tick', 'jitter', 'i2c', 'request', 'gc')
+
+    def __init__(self, enabled=False, ring=RING):
+        self.tick = Histogram(ring)
+        self.jitter = Histogram(ring)
+        self.i2c = Histogram(ring)
+        self.request = Histogram(ring)
+        self.gc = Histogram(ring)
+        self.enabled = False
+        self.reset()
+        self.enable(enabled)
+
+    def enable(self, on=True):
+        "Switches recording; the first tick after switching on has no jitter sample"
+        self._last_start = None
+        self._alloc = None
+        self.enabled = bool(on)
+
+    def reset(self):
+        for name in self.NAMES:
+            getattr(self, name).reset()
+        self.collections = 0
+        self._last_start = None
+        self._alloc = None
+
+    # ------------------------
+    # Recording: no allocation
+    # ------------------------
+    def tick_start(self, start, period_us):
+        last = self._last_start
+        if last is not None:
+            d = ticks_diff(start, last) - period_us
+            self.jitter.record(d if d >= 0 else -d)
+        self._last_start = start
+        alloc = gc.mem_alloc()
+        if self._alloc is not None and alloc < self._alloc:
+            self.collections += 1  # collected somewhere since the last tick
+        self._alloc = alloc
+
+    def tick_end(self, duration):
+        self.tick.record(duration)
+        alloc = gc.mem_alloc()
+        if self._alloc is not None and alloc < self._alloc:
+            self.collections += 1
+            self.gc.record(duration)
+        self._alloc = alloc
+
+    # ------------------------
+    # GET /metrics
+    # ------------------------
+    def report(self):
+        r = {'enabled': self.enabled, 'gc_collections': self.collections}
+        for name in self.NAMES:
+            r[name] = getattr(self, name).report()
+        r['mem_free'] = gc.mem_free()
+        return r
@@ -0,0 +1,222 @@
+# picobot_recorder.py
+# Flight recorder: one fixed-size record per control tick while the robot
+# runs, packed into a RAM ring by the tick and written to flash in blocks by
+# a low-priority task, so the loop never waits on the file system.
+#
+# File (RUN_FILE; the run before is kept as PREV_FILE):
+#   16-byte header: b"PBFR", u16 FILE_VERSION, u16 RECORD_SIZE,
+#                   u16 control period in ms, 6 bytes padding
+#   then RECORD_SIZE-byte records, little-endian:
+#   'T' tick   - TICK_FORMAT: kind, sensor bits, action code, status code,
+#                ticks_ms, left and right wheel speed (signed %), search step,
+#                flags (FLAG_*), params version, tick counter (low 16 bits)
+#   'P' param  - PARAM_FORMAT: kind, index into picobot_line.PARAMS,
+#                params version, value (float32; mode as an index into
+#                STEER_MODES), ticks_ms, padding
+#   A full set of 'P' records precedes the first tick of every params version.
+import ustruct
+from time import ticks_us, ticks_diff
+from picobot_line import ACTION_CODES, PARAMS, STEER_MODES
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+FILE_VERSION = 1
+RECORD_SIZE = 16
+HEADER_FORMAT = '<4sHHH6x'
+TICK_FORMAT = '<BBBBIbbBBHH'
+PARAM_FORMAT = '<BBHfI4x'
+FLAG_RUNNING = 0x01
+FLAG_LINE_LOST = 0x02
+TICK = ord('T')
+PARAM = ord('P')
+
+RUN_FILE = "flight.bin"
+PREV_FILE = "flight.prev.bin"
+
+
+class FlightRecorder:
+    def __init__(self, size=256, block=64, period_ms=50, max_bytes=256 * 1024,
+                 path=RUN_FILE, prev_path=PREV_FILE):
+        """
+        size      - records held in RAM; a multiple of block
+        block     - records per flash write
+        max_bytes - a run file stops growing at this size
+        """
+        self.size = size
+        self.block = block
+        self.period_ms = period_ms
+        self.max_bytes = max_bytes
+        self.path = path
+        self.prev_path = prev_path
+        self.buf = bytearray(size * RECORD_SIZE)
+        self._mv = memoryview(self.buf)
+        self.enabled = True
+        self.head = 0          # sequence number of the next record
+        self.written = 0       # records before this are on flash (or lost)
+        self.run_start = None  # sequence number where a new run begins, for the writer
+        self.lost = 0          # records overwritten before they were written
+        self.truncated = 0     # records not written because the file was full
+        self.file_bytes = 0
+        self.write_us_max = 0
+        self._version = -1     # params version last recorded
+        self._was_running = False
+        self._file = None
+
+    # ------------------------
+    # Control tick side: RAM only
+    # ------------------------
+    def record(self, f):
+        "Called by LineFollower.tick() after the motors were updated"
+        running = f.robot_running
+        if not (running or self._was_running) or not self.enabled:
+            self._was_running = running
+            return
+        if running and not self._was_running:
+            self.run_start = self.head
+            self._version = -1
+        self._was_running = running
+        if f.params_version != self._version:
+            self._version = f.params_version
+            for i in range(len(PARAMS)):
+                attr = PARAMS[i][1]
+                value = getattr(f, attr)
+                if attr == "steer_mode":
+                    value = STEER_MODES.index(value)
+                ustruct.pack_into(PARAM_FORMAT, self.buf, self._slot(), PARAM, i,
+                                  f.params_version & 0xFFFF, value, f.tick_ms)
+                self.head += 1
+        driver = f.motor_driver
+        ustruct.pack_into(TICK_FORMAT, self.buf, self._slot(), TICK, f.sensor_bits,
+                          ACTION_CODES[f.action], f.status_code(), f.tick_ms,
+                          driver.MotorSpeed(0), driver.MotorSpeed(6),
+                          f.search_step if f.search_step < 255 else 255,
+                          (FLAG_RUNNING if running else 0) | (FLAG_LINE_LOST if f.line_lost else 0),
+                          f.params_version & 0xFFFF, f.ticks & 0xFFFF)
+        self.head += 1
+
+    def _slot(self):
+        return (self.head % self.size) * RECORD_SIZE
+
+    # ------------------------
+    # Writer side: file system
+    # ------------------------
+    def _open(self, new_run):
+        import os
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if new_run:
+            try:
+                os.remove(self.prev_path)
+            except OSError:
+                pass
+            try:
+                os.rename(self.path, self.prev_path)
+            except OSError:
+                pass
+            self._file = open(self.path, "wb")
+            self._file.write(ustruct.pack(HEADER_FORMAT, b"PBFR", FILE_VERSION, RECORD_SIZE, self.period_ms))
+            self.file_bytes = 16
+        else:
+            self._file = open(self.path, "ab")
+
+    def _write_upto(self, end):
+        "Writes records written..end-1 to the current file, in at most two pieces"
+        if self.head - self.written > self.size:
+            self.lost += self.head - self.size - self.written
+            self.written = self.head - self.size
+        while self.written < end:
+            start = self.written % self.size
+            n = min(end - self.written, self.size - start)
+            if self._file is None:
+                self._open(False)
+            room = (self.max_bytes - self.file_bytes) // RECORD_SIZE
+            if n > room:
+                self.truncated += n - room
+                n = room
+            if n > 0:
+                self._file.write(self._mv[start * RECORD_SIZE:(start + n) * RECORD_SIZE])
+                self.file_bytes += n * RECORD_SIZE
+            self.written = end if n == 0 else self.written + n
+            if n == 0:
+                break
+
+    def flush(self, partial=True):
+        """
+        Writes pending records: whole blocks only, or everything with
+        partial=True. Returns the number of records written.
+        """
+        start_us = ticks_us()
+        before = self.written
+        run_start = self.run_start
+        if run_start is not None:
+            self.run_start = None
+            if self.written < run_start:
+                self._write_upto(run_start)
+            self.written = max(self.written, run_start)
+            self._open(True)
+        end = self.head if partial else self.head - (self.head - self.written) % self.block
+        if end > self.written:
+            self._write_upto(end)
+        if self._file is not None:
+            self._file.flush()
+        dt = ticks_diff(ticks_us(), start_us)
+        if dt > self.write_us_max:
+            self.write_us_max = dt
+        return self.written - before
+
+    async def run(self, period_ms=200):
+        "Writer task: whole blocks while the robot runs, the rest once it stops"
+        while True:
+            if self.run_start is not None or self.head - self.written >= self.block:
+                self.flush(partial=False)
+            elif not self._was_running and self.head > self.written:
+                self.flush()
+            await asyncio.sleep_ms(period_ms)
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'records': self.head,
+            'pending': self.head - self.written,
+            'lost': self.lost,
+            'truncated': self.truncated,
+            'file_bytes': self.file_bytes,
+            'write_us_max': self.write_us_max,
+        }
+
+
+def decode(data):
+    """
+    Host side: (header dict, records) from a flight file; ticks are dicts
+    with the TICK_FORMAT fields plus the parameters active at that tick.
+    """
+    magic, version, size, period_ms = ustruct.unpack_from(HEADER_FORMAT, data)
+    if magic != b"PBFR" or version != FILE_VERSION:
+        raise ValueError("not a version %d flight recorder file" % FILE_VERSION)
+    params = {}
+    ticks = []
+    for off in range(16, len(data) - size + 1, size):
+        kind = data[off]
+        if kind == PARAM:
+            _, index, pv, value, ms = ustruct.unpack_from(PARAM_FORMAT, data, off)
+            name, attr, conv, default = PARAMS[index]
+            if attr == "steer_mode":
+                value = STEER_MODES[int(value)]
+            elif conv is int:
+                value = int(round(value))
+            else:
+                value = round(value, 6)
+            params[name] = value
+        elif kind == TICK:
+            (_, bits, action, status, ms, left, right, step,
+             flags, pv, tick) = ustruct.unpack_from(TICK_FORMAT, data, off)
+            ticks.append({'tick': tick, 'ms': ms, 'bits': bits, 'action': action,
+                          'status': status, 'left': left, 'right': right,
+                          'search_step': step, 'running': bool(flags & FLAG_RUNNING),
+                          'line_lost': bool(flags & FLAG_LINE_LOST), 'params_version': pv,
+                          'params': dict(params)})
+    return {'version': version, 'record_size': size, 'period_ms': period_ms}, ticks
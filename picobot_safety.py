@@ -0,0 +1,189 @@
+# picobot_safety.py
+# Emergency stop and the dead-man heartbeat.
+#
+# EmergencyStop.trigger() turns every PCA9685 output fully off with one
+# single-byte write (MotorDriver.EmergencyStop), times it and counts the stop.
+# It is for the network side (a request handler, a scheduled callback); from
+# a hard IRQ (a stop button) use trigger_irq(), which only schedules it. It
+# never touches the driver's shadow, which belongs to the control core: the
+# control tick sees the new count, stages the stop there
+# (MotorDriver.StageStop), flushes it and acknowledge()s it. Until then a
+# frame the tick was already flushing may turn the outputs on again, for at
+# most one period; `latency` runs to the acknowledgement.
+#
+# DeadMan: only the controlling client feeds it. A start command opens a new
+# session (begin()); the page that sent it gets the session number back and
+# sends GET /heartbeat?session=<n> while the robot runs. Beats with another
+# number (an older page, a spectator) do not count, and nothing the robot
+# sends does either: a write that succeeds proves nothing about a client
+# whose Wi-Fi has dropped. The control tick checks it; once the client has
+# been silent for longer than timeout_ms the robot is stopped, at the first
+# tick past the deadline. report() gives the time from the last beat
+# received to the outputs being off, from the timings seen so far.
+from time import ticks_ms, ticks_us, ticks_diff
+import micropython
+from picobot_profile import Histogram
+
+
+class EmergencyStop:
+    """
+    count    - stops triggered; LineFollower halts when it changes. Written
+               by trigger() only, on the network side
+    acked    - count as of the last acknowledge() by the control tick
+    errors   - stops whose bus write failed (the control tick still stages
+               the stop and flushes it)
+    missed   - trigger_irq() calls dropped because the schedule queue was full
+    bus      - duration of the stop transaction
+    latency  - from the command (request received, IRQ) to the control tick
+               having flushed the stop frame
+    """
+    def __init__(self, motor_driver):
+        self.motor_driver = motor_driver
+        self.count = 0
+        self.acked = 0
+        self.errors = 0
+        self.missed = 0
+        self.bus = Histogram()
+        self.latency = Histogram()
+        self._since = 0
+        self._due = 0
+        # Bound methods allocate when taken; take it once, outside the IRQ
+        self._run_ref = self._run
+
+    def trigger(self, since=None):
+        """
+        Stops every output now. `since` is the ticks_us() at which the stop
+        was asked for, if earlier than this call. Returns True if the stop
+        reached the board.
+        """
+        start = ticks_us()
+        if self.acked == self.count:
+            # The first stop since the last acknowledgement starts the clock
+            self._since = start if since is None else since
+        # Counted before the write: a control tick on the other core that
+        # sees the new count stages the stop rather than another frame
+        self.count += 1
+        ok = True
+        try:
+            self.motor_driver.EmergencyStop()
+        except OSError:
+            self.errors += 1
+            ok = False
+        self.bus.record(ticks_diff(ticks_us(), start))
+        return ok
+
+    def acknowledge(self, count):
+        "Control tick: the stop frame for stops up to `count` is on the board"
+        self.latency.record(ticks_diff(ticks_us(), self._since))
+        self.acked = count
+
+    def trigger_irq(self, _=None):
+        "Pin/Timer IRQ handler: no allocation, no I/O; the stop runs when scheduled"
+        self._due = ticks_us()
+        try:
+            micropython.schedule(self._run_ref, None)
+        except RuntimeError:
+            self.missed += 1
+
+    def _run(self, _):
+        self.trigger(self._due)
+
+    def report(self):
+        return {
+            'count': self.count,
+            'acked': self.acked,
+            'errors': self.errors,
+            'missed': self.missed,
+            'bus': self.bus.report(),
+            'latency': self.latency.report(),
+        }
+
+
+class DeadMan:
+    """
+    Heartbeat watchdog for the controlling client. timeout_ms = 0 turns it
+    off. feed() only stores the time, so it is safe from any context.
+    session - number of the current controlling client, see begin()
+    """
+    def __init__(self, estop, timeout_ms=1000, period_ms=50):
+        """
+        estop     - EmergencyStop whose driver is stopped when the client goes
+                    silent
+        period_ms - control loop period, for the worst-case figure
+        """
+        self.estop = estop
+        self.timeout_ms = timeout_ms
+        self.period_ms = period_ms
+        self.last_ms = ticks_ms()
+        self.beats = 0
+        self.trips = 0
+        self.late_max_ms = 0  # worst detection delay past the deadline seen
+        self.bus_max = 0  # slowest stop transaction of a trip, us
+        self.session = 0
+        self.rejected = 0  # beats from other sessions
+
+    def begin(self):
+        "A start command: a new controlling client; returns its session number"
+        self.session = (self.session + 1) & 0x3FFFFFFF
+        self.feed()
+        return self.session
+
+    def feed(self):
+        self.last_ms = ticks_ms()
+        self.beats += 1
+
+    def beat(self, session):
+        "A heartbeat request; feeds only for the current session"
+        if session != self.session:
+            self.rejected += 1
+            return False
+        self.feed()
+        return True
+
+    def check(self, now):
+        """
+        Called by the control tick while the robot runs, with its ticks_ms().
+        Turns the outputs off and returns True once the client has been
+        silent past timeout_ms; the tick then stages the stop. estop.count
+        is left alone, it belongs to the network side.
+        """
+        timeout = self.timeout_ms
+        if not timeout:
+            return False
+        late = ticks_diff(now, self.last_ms) - timeout
+        if late <= 0:
+            return False
+        start = ticks_us()
+        try:
+            self.estop.motor_driver.EmergencyStop()
+        except OSError:
+            pass  # the stop frame the tick flushes next is the retry
+        bus = ticks_diff(ticks_us(), start)
+        if bus > self.bus_max:
+            self.bus_max = bus
+        self.trips += 1
+        if late > self.late_max_ms:
+            self.late_max_ms = late
+        return True
+
+    def report(self, loop_stats=None):
+        """
+        Heartbeat state. stop_after_beat_ms is how long after the last beat
+        the robot received its outputs go off at the latest: timeout, one
+        period, the loop's worst start latency (ControlLoop.stats, when
+        given) and the slowest stop transaction. It is built from what has
+        been seen so far, not a guarantee, and does not count the time the
+        beat spent on the network.
+        """
+        latency_us = loop_stats.latency_max if loop_stats is not None else 0
+        after_us = self.period_ms * 1000 + latency_us + max(self.bus_max, self.estop.bus.max)
+        return {
+            'timeout_ms': self.timeout_ms,
+            'session': self.session,
+            'silent_ms': ticks_diff(ticks_ms(), self.last_ms),
+            'beats': self.beats,
+            'rejected': self.rejected,
+            'trips': self.trips,
+            'late_max_ms': self.late_max_ms,
+            'stop_after_beat_ms': self.timeout_ms + (after_us + 999) // 1000,
+        }
@@ -0,0 +1,69 @@
+# picobot_sensors.py
+# Line-sensor readers. read() returns the five sensors as one bitmask,
+# bit i = sensor i in the order given (right → left on the PicoBot).
+import sys
+from machine import Pin
+
+SENSOR_PINS = (8, 9, 13, 14, 15)  # Right, Right-middle, Center, Left-middle, Left
+
+SIO_BASE = 0xd0000000
+SIO_GPIO_IN = SIO_BASE + 0x004  # input level of GPIO 0-29, one bit each
+
+
+class PinSensorReader:
+    "Reads each sensor with Pin.value(); works on any port"
+    def __init__(self, pins=SENSOR_PINS):
+        self.pins = [Pin(p, Pin.IN, Pin.PULL_UP) for p in pins]
+
+    def read(self):
+        bits = 0
+        i = 0
+        for p in self.pins:
+            bits |= p.value() << i
+            i += 1
+        return bits
+
+
+class SioSensorReader:
+    """
+    Samples all sensors with one 32-bit load of the RP2040 SIO GPIO_IN
+    register, so the five levels come from the same instant.
+    mem - object indexed like machine.mem32 (a fake one on the host)
+    """
+    def __init__(self, pins=SENSOR_PINS, mem=None):
+        # Pin objects still configure direction and pull-ups
+        self.pins = [Pin(p, Pin.IN, Pin.PULL_UP) for p in pins]
+        if mem is None:
+            import machine
+            mem = machine.mem32
+        self.mem = mem
+        # Group sensors on consecutive GPIOs (and consecutive bits) into
+        # runs, so 8,9 / 13,14,15 take two shift-and-mask steps, not five
+        runs = []
+        for bit, gpio in enumerate(pins):
+            if runs and runs[-1][0] + runs[-1][2] == gpio and runs[-1][1] + runs[-1][2] == bit:
+                runs[-1][2] += 1
+            else:
+                runs.append([gpio, bit, 1])
+        self.runs = tuple((gpio - bit, ((1 << n) - 1) << bit) for gpio, bit, n in runs)
+
+    def read(self):
+        # GPIO_IN only has bits 0-29, so the value stays a small int
+        v = self.mem[SIO_GPIO_IN]
+        bits = 0
+        for shift, mask in self.runs:
+            if shift >= 0:
+                bits |= (v >> shift) & mask
+            else:
+                bits |= (v << -shift) & mask
+        return bits
+
+
+def make_reader(pins=SENSOR_PINS):
+    "SIO reader on the RP2040, per-pin reader elsewhere"
+    if sys.platform == 'rp2':
+        try:
+            return SioSensorReader(pins)
+        except (ImportError, AttributeError):
+            pass
+    return PinSensorReader(pins)
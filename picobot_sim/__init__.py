@@ -0,0 +1,98 @@
+"""
+Host-side (CPython) support for the PicoBot firmware.
+
+Call install() before importing any firmware module; it registers fake
+`machine`, `network`, `micropython` and `ustruct` modules, the MicroPython
+`time.ticks_*` and `gc.mem_*` helpers and `asyncio.sleep_ms`, so
+picobot_motors.py and friends import unchanged on a PC.
+
+    python -m picobot_sim --help    simulated runs, see picobot_sim.sim
+"""
+import asyncio
+import gc
+import sys
+import time
+import types
+import struct
+
+from picobot_sim import fakes
+
+
+class Clock:
+    """
+    Time source behind time.ticks_ms/ticks_us. Real time by default; a
+    simulation sets `virtual_us` and advances it itself, so firmware code
+    that imported ticks_ms sees simulated time and runs faster than real time.
+    """
+    def __init__(self):
+        self.virtual_us = None
+
+    def us(self):
+        if self.virtual_us is not None:
+            return self.virtual_us
+        return int(time.monotonic() * 1000000)
+
+
+clock = Clock()
+
+
+def _install_time():
+    if hasattr(time, 'ticks_ms'):
+        return
+    time.ticks_ms = lambda: (clock.us() // 1000) & 0x3FFFFFFF
+    time.ticks_us = lambda: clock.us() & 0x3FFFFFFF
+    time.ticks_add = lambda t, d: (t + d) & 0x3FFFFFFF
+
+    def ticks_diff(a, b):
+        d = (a - b) & 0x3FFFFFFF
+        return d - 0x40000000 if d & 0x20000000 else d
+
+    time.ticks_diff = ticks_diff
+    time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+    time.sleep_us = lambda us: time.sleep(us / 1000000)
+
+
+def _install_gc():
+    "gc.mem_alloc/mem_free from tracemalloc while it traces, else a fixed heap"
+    if hasattr(gc, 'mem_alloc'):
+        return
+    import tracemalloc
+
+    def mem_alloc():
+        return tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+
+    gc.mem_alloc = mem_alloc
+    gc.mem_free = lambda: HEAP_SIZE - mem_alloc()
+
+
+HEAP_SIZE = 192 * 1024  # about what a Pico W leaves for Python with networking up
+
+scheduler = fakes.Scheduler()
+
+
+def install():
+    "Register the fake hardware modules; safe to call more than once"
+    _install_time()
+    _install_gc()
+    sys.modules.setdefault('ustruct', struct)
+    if not hasattr(asyncio, 'sleep_ms'):
+        asyncio.sleep_ms = lambda ms: asyncio.sleep(ms / 1000)
+    if 'micropython' not in sys.modules:
+        micropython = types.ModuleType('micropython')
+        micropython.schedule = scheduler.schedule
+        micropython.const = lambda x: x
+        sys.modules['micropython'] = micropython
+    if 'network' not in sys.modules:
+        network = types.ModuleType('network')
+        network.WLAN = fakes.WLAN
+        network.AP_IF = fakes.WLAN.AP_IF
+        network.STA_IF = fakes.WLAN.STA_IF
+        sys.modules['network'] = network
+    if 'machine' not in sys.modules:
+        machine = types.ModuleType('machine')
+        machine.Pin = fakes.Pin
+        machine.I2C = fakes.CountingI2C
+        machine.Timer = fakes.Timer
+        machine.mem32 = fakes.Mem32()
+        sys.modules['machine'] = machine
+    return sys.modules['machine']
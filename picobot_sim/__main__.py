@@ -0,0 +1,104 @@
+"""
+Runs the line follower on simulated tracks and prints one JSON line of
+metrics per run (lap times, line losses, tracking error, ...).
+
+    python -m picobot_sim --track oval --mode pid --speed 60
+    python -m picobot_sim --track all --speed 40 --laps 3
+    python -m picobot_sim --pgm floor.pgm --start 0.2,0.1 --heading 0 --speed 30
+    python -m picobot_sim --batch runs.json
+    python -m picobot_sim --track technical --speed 40 --record run.bin
+
+A batch file is a JSON list of objects; "track" (or "pgm", "start",
+"heading"), "laps", "max_time_s" and "sensors" pick the run, every other key
+is a LineFollower parameter as the web UI sends it (speed, mode, kp, ...).
+"""
+import argparse
+import json
+import sys
+import time
+
+from picobot_sim import track
+from picobot_sim.sim import CONTROL_PERIOD_MS, Simulation
+from picobot_recorder import FlightRecorder
+from picobot_line import PARAMS
+
+RUN_KEYS = ('track', 'pgm', 'start', 'heading', 'resolution', 'laps', 'max_time_s', 'sensors', 'record')
+
+
+def load_track(spec, cache={}):
+    key = json.dumps(spec, sort_keys=True)
+    if key not in cache:
+        if spec.get('pgm'):
+            start = spec.get('start', (0.0, 0.0))
+            if isinstance(start, str):
+                start = [float(v) for v in start.split(",")]
+            cache[key] = track.load_pgm(spec['pgm'], start, float(spec.get('heading', 0)),
+                                        float(spec.get('resolution', track.RESOLUTION)))
+        else:
+            cache[key] = track.TRACKS[spec.get('track', 'oval')]()
+    return cache[key]
+
+
+def run_one(spec):
+    t = load_track(spec)
+    params = {k: v for k, v in spec.items() if k not in RUN_KEYS}
+    started = time.perf_counter()
+    sim = Simulation(t, params, spec.get('sensors', 'pin'))
+    recorder = None
+    if spec.get('record'):
+        # Big enough RAM ring that nothing is lost without the writer task
+        recorder = FlightRecorder(size=1 << 16, period_ms=CONTROL_PERIOD_MS, max_bytes=1 << 24,
+                                  path=spec['record'], prev_path=spec['record'] + ".prev")
+        sim.follower.recorder = recorder
+    metrics = sim.run(laps=int(spec.get('laps', 1)), max_time_s=float(spec.get('max_time_s', 120)))
+    if recorder is not None:
+        recorder.flush()
+    metrics['params'] = params
+    metrics['wall_time_s'] = round(time.perf_counter() - started, 3)
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m picobot_sim",
+                                     description="simulated line-following runs")
+    parser.add_argument('--track', default='oval',
+                        help="%s or 'all'" % ", ".join(track.TRACKS))
+    parser.add_argument('--pgm', help="PGM/PBM floor image instead of a built-in track")
+    parser.add_argument('--start', default="0,0", help="x,y in metres of a point on the line (--pgm)")
+    parser.add_argument('--heading', type=float, default=0.0, help="direction of travel at --start, degrees")
+    parser.add_argument('--resolution', type=float, default=track.RESOLUTION, help="metres per pixel (--pgm)")
+    parser.add_argument('--laps', type=int, default=1)
+    parser.add_argument('--max-time', type=float, default=120.0, help="simulated seconds per run")
+    parser.add_argument('--sensors', choices=('pin', 'sio'), default='pin')
+    parser.add_argument('--batch', help="JSON file with a list of runs")
+    for query, attr, kind, default in PARAMS:
+        parser.add_argument('--' + query, dest=query, default=None,
+                            help="%s (default %s)" % (attr, default))
+    parser.add_argument('--record', help="write a flight recorder log of the run here")
+    parser.add_argument('--save-pgm', help="write the track bitmap to this file and exit")
+    args = parser.parse_args()
+
+    if args.batch:
+        with open(args.batch) as f:
+            specs = json.load(f)
+    else:
+        spec = {'laps': args.laps, 'max_time_s': args.max_time, 'sensors': args.sensors,
+                'record': args.record}
+        if args.pgm:
+            spec.update(pgm=args.pgm, start=args.start, heading=args.heading, resolution=args.resolution)
+        for query, _, _, _ in PARAMS:
+            if getattr(args, query) is not None:
+                spec[query] = getattr(args, query)
+        names = list(track.TRACKS) if args.track == 'all' and not args.pgm else [args.track]
+        specs = [dict(spec, track=name) for name in names]
+
+    if args.save_pgm:
+        load_track(specs[0]).save_pgm(args.save_pgm)
+        return
+    for spec in specs:
+        print(json.dumps(run_one(spec)))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
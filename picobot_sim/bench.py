@@ -0,0 +1,126 @@
+"""
+Host side of picobot_bench: runs the same benchmarks against the fakes and
+adds what only a simulated bus can count.
+
+    python -m picobot_sim.bench [--rounds 2000] [--only tick_running,setPWM]
+                                [--out bench.json] [--compare old.json]
+
+Per benchmark, next to the timing:
+    i2c_transactions_per_op, i2c_bytes_per_op - from CountingI2C
+    alloc_peak_bytes   - most memory held at once above the start (tracemalloc),
+                         i.e. the largest transient allocation of one operation
+Timing on a PC says little about the RP2040; the counters do carry over.
+Run picobot_bench.main() on the robot for device timings.
+
+--compare reads an earlier report and flags counters that went up; the
+exit status is 1 if any did, so it can gate a change.
+"""
+import argparse
+import json
+import sys
+import tracemalloc
+
+import picobot_sim
+
+machine = picobot_sim.install()
+
+import picobot_bench
+from picobot_sensors import SENSOR_PINS, PinSensorReader
+from picobot_sim.fakes import CountingI2C
+
+# Counters checked by --compare, with the relative growth that is still noise
+COUNTERS = {
+    'i2c_transactions_per_op': 0.0,
+    'i2c_bytes_per_op': 0.0,
+    'alloc_peak_bytes': 0.25,
+}
+
+
+class HostProbe(picobot_bench.Probe):
+    def __init__(self, bus):
+        self.bus = bus
+
+    def begin(self):
+        self.bus.reset_counters()
+        tracemalloc.reset_peak()
+        self._traced = tracemalloc.get_traced_memory()[0]
+
+    def end(self, n):
+        return {
+            'i2c_transactions_per_op': self.bus.transactions / n,
+            'i2c_bytes_per_op': self.bus.wire_bytes / n,
+            'alloc_peak_bytes': tracemalloc.get_traced_memory()[1] - self._traced,
+        }
+
+
+def on_line_center():
+    "Sensor GPIOs as seen over a straight line: only the center sensor dark"
+    for i, gpio in enumerate(SENSOR_PINS):
+        machine.Pin.levels[gpio] = 1 if i == 2 else 0
+
+
+def compare(old, new, tolerance):
+    "Lines describing counters that grew by more than `tolerance` (relative)"
+    regressions = []
+    for name, result in new['results'].items():
+        before = old['results'].get(name)
+        if not before:
+            continue
+        for key, slack in COUNTERS.items():
+            if key in result and key in before:
+                a, b = before[key], result[key]
+                if b > a * (1 + slack + tolerance) and b - a > 0.01:
+                    regressions.append("%s %s: %s -> %s" % (name, key, a, b))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="hot-path benchmarks on the host")
+    parser.add_argument('--rounds', type=int, default=2000)
+    parser.add_argument('--only', help="comma-separated benchmark names")
+    parser.add_argument('--out', help="write the JSON report here")
+    parser.add_argument('--compare', help="earlier JSON report to check counters against")
+    parser.add_argument('--tolerance', type=float, default=0.0,
+                        help="extra relative growth allowed before --compare flags a counter")
+    args = parser.parse_args()
+
+    bus = CountingI2C()
+    on_line_center()
+    tracemalloc.start()
+    try:
+        benchmarks = picobot_bench.Benchmarks(i2c=bus, sensors=PinSensorReader())
+        names = args.only.split(",") if args.only else None
+        report = picobot_bench.run(benchmarks, names, args.rounds, HostProbe(bus))
+    finally:
+        tracemalloc.stop()
+    report['mode'] = 'host'
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + "\n")
+    print("%-22s %10s %8s %9s %10s" % ("benchmark", "us/op", "i2c tx", "i2c B", "alloc pk"))
+    for name, r in sorted(report['results'].items()):
+        if 'error' in r:
+            print("%-22s error: %s" % (name, r['error']))
+        elif 'latency_us_mean' in r:
+            print("%-22s %10.1f   (p50 %d us, p95 %d us, max %d us per request)" % (
+                name, r['latency_us_mean'], r['latency_us_p50'], r['latency_us_p95'], r['latency_us_max']))
+        else:
+            print("%-22s %10.2f %8.2f %9.1f %10d" % (
+                name, r['us_per_op'], r['i2c_transactions_per_op'], r['i2c_bytes_per_op'],
+                r['alloc_peak_bytes']))
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        regressions = compare(old, report, args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line)
+        if regressions:
+            sys.exit(1)
+        print("no counter regressions against", args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Per-step cost of driving the arm's three joints.
+
+    old        - control_servo() per joint as it was: range check, float
+                 pulse math, one 4-byte write per joint
+    engine     - MotionEngine.step() with a pulse function
+    table      - MotionEngine.step() with a PulseTable
+    trajectory - MotionEngine.step() playing a compiled Trajectory
+
+Checks that the table is within one count of the formula for every whole
+degree, then times each path per step on the virtual clock (20 ms a step)
+and counts I2C transactions and bytes per step.
+
+    python -m picobot_sim.bench_arm [--steps 20000]
+"""
+import argparse
+import time
+
+import picobot_sim
+
+picobot_sim.install()
+
+from picobot_motion import MAX_PULSE, MIN_PULSE, MotionEngine, PulseTable, Trajectory
+from picobot_sim.fakes import CountingI2C
+from pca9685 import PCA9685
+
+PERIOD_US = 20000
+WAVE = {
+    'poses': {'home': [90, 90, 90], 'reach': [20, 150, 60], 'lift': [20, 100, 160]},
+    'keyframes': [['home', 0], ['reach', 800], ['reach', 200], ['lift', 600], ['home', 900]],
+}
+
+
+def formula(joint, angle):
+    return int(MIN_PULSE + (angle / 180.0) * (MAX_PULSE - MIN_PULSE))
+
+
+def old_control_servo(pca, channel, angle):
+    if not 0 <= angle <= 180:
+        raise ValueError("angle")
+    min_pulse = 102
+    max_pulse = 512
+    pulse = int(min_pulse + (angle / 180.0) * (max_pulse - min_pulse))
+    pca.pwm(channel, 0, pulse)
+
+
+def timed(name, steps, pca, step):
+    clock = picobot_sim.clock
+    clock.virtual_us = 0
+    pca.i2c.reset_counters()
+    total = 0
+    try:
+        for k in range(steps):
+            clock.virtual_us += PERIOD_US
+            t = time.perf_counter_ns()
+            step(k)
+            total += time.perf_counter_ns() - t
+    finally:
+        clock.virtual_us = None
+    c = pca.i2c.counters()
+    print("%-11s %8.1f ns/step %6.2f i2c/step %6.1f bytes/step" % (
+        name, total / steps, c['transactions'] / steps, c['payload_bytes'] / steps))
+    return total / steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="arm per-step cost")
+    parser.add_argument('--steps', type=int, default=20000)
+    args = parser.parse_args()
+
+    table = PulseTable()
+    for joint in range(3):
+        for angle in range(181):
+            assert abs(table(joint, angle) - formula(joint, angle)) <= 1, (joint, angle)
+    print("table within one count of the formula for 0-180 degrees")
+
+    pca = PCA9685(CountingI2C())
+    pca.freq(50)
+
+    def old(k):
+        # The same sweep the engine does: 3 joints, a new angle each step
+        u = (k % 100) / 100
+        for ch in range(3):
+            old_control_servo(pca, ch, int(30 + 120 * u))
+
+    def engine_path(pulse):
+        engine = MotionEngine(pca, pulse=pulse)
+
+        def step(k):
+            if not engine.moving:
+                engine.move([30, 150, 30] if engine.pos[0] > 90 else [150, 30, 150], velocity=60)
+            engine.step()
+        return step
+
+    track = Trajectory.from_dict(WAVE).compile(table)
+    player = MotionEngine(pca, pulse=table)
+
+    def trajectory(k):
+        if not player.moving:
+            player.play(track)
+        player.step()
+
+    t_old = timed("old", args.steps, pca, old)
+    t_engine = timed("engine", args.steps, pca, engine_path(formula))
+    t_table = timed("table", args.steps, pca, engine_path(table))
+    t_track = timed("trajectory", args.steps, pca, trajectory)
+    print("speed-up vs old: engine %.1fx, table %.1fx, trajectory %.1fx" % (
+        t_old / t_engine, t_old / t_table, t_old / t_track))
+    print("trajectory: %d frames, %d bytes compiled" % (track.count, track.nbytes()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+decide_action() vs the 32-entry bitmask table.
+
+Checks the table for every one of the 32 sensor states against
+baseline_decide_action, a frozen copy of decide_action as it was in main.py
+before the table (its thresholds turned into an argument so other
+thresholds can be checked too), then times both over all 32 states.
+
+    python -m picobot_sim.bench_decide [--rounds 20000]
+"""
+import argparse
+import timeit
+
+import picobot_sim
+
+picobot_sim.install()
+
+from picobot_line import build_decide_table, decide_action
+
+STATES = [[(bits >> i) & 1 for i in range(5)] for bits in range(32)]
+
+
+def baseline_decide_action(sensor_values, thresholds=(1.2, 0.6, 0.2)):
+    "main.py decide_action before the table; keep as is, it is the reference"
+    hard, mild, slight = thresholds
+    if all(v == 1 for v in sensor_values):
+        return "ON JUNCTION"
+    if all(v == 0 for v in sensor_values):
+        return "LINE LOST"
+
+    positions = [2, 1, 0, -1, -2]
+    weighted_sum = 0
+    active_sensors = 0
+
+    for i in range(5):
+        if sensor_values[i] == 1:
+            weighted_sum += positions[i]
+            active_sensors += 1
+
+    if active_sensors > 0:
+        weighted_sum = weighted_sum / active_sensors
+
+    if weighted_sum > hard:
+        return "HARD RIGHT"
+    elif weighted_sum > mild:
+        return "MILD RIGHT"
+    elif weighted_sum > slight:
+        return "SLIGHT RIGHT"
+    elif weighted_sum < -hard:
+        return "HARD LEFT"
+    elif weighted_sum < -mild:
+        return "MILD LEFT"
+    elif weighted_sum < -slight:
+        return "SLIGHT LEFT"
+    elif weighted_sum == 0 and any(v == 1 for v in sensor_values):
+        return "FORWARD"
+    else:
+        return "SEARCHING"
+
+
+def check(thresholds=None):
+    "None: the table main.py uses, built with the defaults, against the baseline's own"
+    if thresholds is None:
+        table = build_decide_table()
+        reference = baseline_decide_action
+    else:
+        table = build_decide_table(thresholds)
+        reference = lambda values: baseline_decide_action(values, thresholds)
+    for bits, values in enumerate(STATES):
+        expected = reference(values)
+        assert table[bits] == expected, (thresholds, values, table[bits], expected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="decide_action vs lookup table")
+    parser.add_argument('--rounds', type=int, default=20000)
+    args = parser.parse_args()
+
+    for thresholds in (None, (1.5, 0.9, 0.4), (1.0, 0.5, 0.1)):
+        check(thresholds)
+    print("table matches the baseline decide_action for all 32 states")
+
+    table = build_decide_table()
+
+    def by_function():
+        for values in STATES:
+            decide_action(values)
+
+    def by_table():
+        for bits in range(32):
+            table[bits]
+
+    n = args.rounds
+    t_function = timeit.timeit(by_function, number=n) / (n * 32) * 1e9
+    t_table = timeit.timeit(by_table, number=n) / (n * 32) * 1e9
+    print("decide_action  %8.1f ns/call" % t_function)
+    print("table lookup   %8.1f ns/call" % t_table)
+    print("speed-up       %8.1fx" % (t_function / t_table))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""
+Stop paths and the dead man, on the fakes.
+
+    legacy - StopAllMotors as it was: 12 setPWM calls of one register byte
+             each, 48 transactions (a driver without auto-increment)
+    shadow - StopAllMotors + flush from a cold shadow: one 48-byte block
+    estop  - MotorDriver.EmergencyStop: one byte to ALL_LED_OFF_H
+
+For each: I2C transactions and bytes, bus time at 400 and 100 kHz from the
+wire bytes and host time; then checks that every channel reads as off.
+
+    http     - GET /?action=stop through HttpServer on the loopback
+               interface, with the control tick's part (StageStop, flush,
+               acknowledge) done in the handler straight after; request
+               line parsed to the stop acknowledged, from
+               EmergencyStop.latency (host time, indicative only)
+    deadman  - simulated runs on the oval whose client stops sending
+               heartbeats at --trials different moments; the time from the
+               deadline to the wheels being stopped is taken on the virtual
+               clock, and the worst case is printed next to
+               stop_after_beat_ms from DeadMan.report()
+
+    python -m picobot_sim.bench_estop [--trials 50] [--timeout 1000] [--beat 250]
+"""
+import argparse
+import random
+import time
+
+import picobot_sim
+
+picobot_sim.install()
+
+import asyncio
+
+import picobot_motors
+from picobot_http import HttpServer, Router, send_response
+from picobot_safety import DeadMan, EmergencyStop
+from picobot_sim import track
+from picobot_sim.fakes import CountingI2C
+from picobot_sim.sim import CONTROL_PERIOD_MS, PHYSICS_DT_US, Simulation, level
+
+ROUNDS = 2000
+HTTP_PORT = 8082
+
+
+def driving(auto_increment=True):
+    bus = CountingI2C()
+    driver = picobot_motors.MotorDriver(i2c=bus, auto_increment=auto_increment)
+    driver.DriveSides(40, 40)
+    return bus, driver
+
+
+def all_off(bus):
+    regs = bus.devices[0x40]
+    return all(level(regs, ch) == 0 for ch in range(16))
+
+
+def stop_path(name, auto_increment, stop):
+    total = 0
+    for _ in range(ROUNDS):
+        bus, driver = driving(auto_increment)
+        driver.invalidate()  # cold: nothing known about the chip
+        bus.reset_counters()
+        t = time.perf_counter_ns()
+        stop(driver)
+        total += time.perf_counter_ns() - t
+    assert all_off(bus), name
+    c = bus.counters()
+    print("%-7s %3d i2c %4d bytes  bus %5d us @400k %5d us @100k  host %6.1f us  all off: %s" % (
+        name, c['transactions'], c['wire_bytes'], c['wire_bytes'] * 9 * 10 // 4,
+        c['wire_bytes'] * 9 * 10, total / ROUNDS / 1000, all_off(bus)))
+
+
+def stop_all(driver):
+    driver.StopAllMotors()
+    driver.flush()
+
+
+async def http_stop(rounds):
+    bus, driver = driving()
+    estop = EmergencyStop(driver)
+    router = Router()
+
+    @router.route("/")
+    async def serve_index(request, writer):
+        if request.query.get(b"action") == b"stop":
+            estop.trigger(request.received)
+            driver.StageStop()
+            driver.flush()
+            estop.acknowledge(estop.count)
+        await send_response(writer, "text/plain", "OK")
+
+    server = HttpServer(router.dispatch, port=HTTP_PORT)
+    srv = await server.start('127.0.0.1')
+    try:
+        for _ in range(rounds):
+            driver.DriveSides(40, 40)
+            driver.flush()
+            reader, writer = await asyncio.open_connection('127.0.0.1', HTTP_PORT)
+            writer.write(b"GET /?action=stop HTTP/1.1\r\nHost: picobot\r\n\r\n")
+            await writer.drain()
+            while await reader.read(512):
+                pass
+            writer.close()
+            assert all_off(bus)
+    finally:
+        srv.close()
+        await srv.wait_closed()
+    r = estop.latency.report()['recent']
+    print("http    request to stop acknowledged: p50 %d us, p99 %d us, max %d us (%d stops)" % (
+        r['p50_us'], r['p99_us'], estop.latency.max, estop.count))
+
+
+def deadman_trial(cut_ms, timeout_ms, beat_ms):
+    """
+    Runs until the wheels stop after the client goes silent at cut_ms;
+    returns (ms from the deadline to the stop, DeadMan.report())
+    """
+    clock = picobot_sim.clock
+    sim = Simulation(track.oval(), {'speed': 40})
+    f = sim.follower
+    estop = EmergencyStop(sim.driver)
+    f.estop = estop
+    f.deadman = DeadMan(estop, timeout_ms, CONTROL_PERIOD_MS)
+    clock.virtual_us = 0
+    try:
+        f.post("start", sim.params)
+        cut_us = cut_ms * 1000
+        next_tick = 0
+        next_beat = beat_ms * 1000
+        last_beat = 0
+        while True:
+            now = clock.virtual_us
+            if now >= next_beat:
+                if now < cut_us:
+                    f.deadman.feed()
+                    last_beat = now
+                next_beat += beat_ms * 1000
+            if now >= next_tick:
+                sim.field.update()
+                f.tick()
+                next_tick += CONTROL_PERIOD_MS * 1000
+            left, right = sim.wheel_targets()
+            if not f.robot_running:
+                assert now > last_beat + timeout_ms * 1000, "stopped before the timeout"
+                assert left == right == 0 and all_off(sim.bus)
+                return (now - last_beat) / 1000 - timeout_ms, f.deadman.report()
+            sim.robot.step(left, right, PHYSICS_DT_US / 1000000)
+            clock.virtual_us += PHYSICS_DT_US
+    finally:
+        clock.virtual_us = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="stop paths and dead-man latency")
+    parser.add_argument('--trials', type=int, default=50)
+    parser.add_argument('--timeout', type=int, default=1000, help="dead-man timeout, ms")
+    parser.add_argument('--beat', type=int, default=250, help="heartbeat interval, ms")
+    parser.add_argument('--http', type=int, default=200, help="HTTP stop round trips")
+    args = parser.parse_args()
+
+    stop_path("legacy", False, stop_all)
+    stop_path("shadow", True, stop_all)
+    stop_path("estop", True, lambda d: d.EmergencyStop())
+    if args.http:
+        asyncio.run(http_stop(args.http))
+
+    rng = random.Random(1)
+    worst = 0
+    bound = 0
+    for _ in range(args.trials):
+        late, report = deadman_trial(rng.randint(500, 3000), args.timeout, args.beat)
+        worst = max(worst, late)
+        bound = max(bound, report['stop_after_beat_ms'] - args.timeout)
+    print("deadman %d trials, timeout %d ms, beats every %d ms: deadline to stop max %.1f ms"
+          " (report: timeout + %d ms)" % (args.trials, args.timeout, args.beat, worst, bound))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Bucket controller vs PID steering in the simulator.
+
+For every track, sweeps base_speed and runs two laps with each steering
+mode. A speed counts as achievable when both laps finish without losing
+the line. Prints the highest achievable speed and its lap time per mode.
+
+    python -m picobot_sim.bench_pid [--tracks oval,technical,kidney] [--kp 30 --kd 2]
+"""
+import argparse
+import json
+
+from picobot_sim import track
+from picobot_sim.sim import Simulation
+
+SPEEDS = range(20, 101, 10)
+
+
+def achievable(t, params):
+    best = None
+    runs = []
+    for speed in SPEEDS:
+        p = dict(params, speed=speed)
+        r = Simulation(t, p).run(laps=2, max_time_s=240)
+        clean = r['laps'] == 2 and r['line_losses'] == 0
+        runs.append((speed, r['best_lap_s'], r['line_losses'], clean))
+        if clean and (best is None or r['best_lap_s'] < best['lap_s']):
+            best = {'speed': speed, 'lap_s': r['best_lap_s'],
+                    'tracking_rms_mm': r['tracking_rms_mm']}
+    return best, runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="bucket vs PID steering")
+    parser.add_argument('--tracks', default=",".join(track.TRACKS))
+    parser.add_argument('--kp', type=float, default=None)
+    parser.add_argument('--ki', type=float, default=None)
+    parser.add_argument('--kd', type=float, default=None)
+    parser.add_argument('--json', action='store_true', help="print raw results as JSON")
+    args = parser.parse_args()
+
+    pid = {'mode': 'pid'}
+    for name in ('kp', 'ki', 'kd'):
+        if getattr(args, name) is not None:
+            pid[name] = getattr(args, name)
+
+    results = {}
+    for name in args.tracks.split(","):
+        t = track.TRACKS[name]()
+        results[name] = {}
+        for mode, params in (('bucket', {'mode': 'bucket'}), ('pid', pid)):
+            best, runs = achievable(t, params)
+            results[name][mode] = {'best': best, 'runs': runs}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print("%-10s %-7s %9s %9s %12s" % ("track", "mode", "max speed", "lap (s)", "rms err (mm)"))
+    for name, modes in results.items():
+        for mode, r in modes.items():
+            b = r['best']
+            if b is None:
+                print("%-10s %-7s %9s" % (name, mode, "none"))
+            else:
+                print("%-10s %-7s %9d %9.2f %12.2f" % (name, mode, b['speed'], b['lap_s'], b['tracking_rms_mm']))
+
+
+if __name__ == '__main__':
+    main()
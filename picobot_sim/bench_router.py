@@ -0,0 +1,143 @@
+"""
+Request parsing and routing: the old decode + substring-chain dispatch
+vs parse_request_line() + Router table lookup.
+
+Checks that both find the same parameters for start/update requests, then
+times request-line handling for a mix of what the web page sends and
+reports the transient heap peak of each (tracemalloc). These are CPython
+figures, where the old substring scans run in C: they say nothing about
+speed on the robot, which has not been measured. The parse splits with
+bytes.split() and partition() so that the per-byte work stays in C there
+too.
+
+    python -m picobot_sim.bench_router [--rounds 20000]
+"""
+import argparse
+import timeit
+import tracemalloc
+
+import picobot_sim
+
+picobot_sim.install()
+
+from picobot_http import Request, Router, parse_request_line
+from picobot_line import PARAMS
+
+LINES = [
+    b"GET /sensors HTTP/1.1\r\n",
+    b"GET /status.bin HTTP/1.1\r\n",
+    b"GET /?action=start&speed=45&slight=0.85&mild=0.7&hard=0.5&grace=900&search=0.45"
+    b"&mode=pid&kp=28&ki=0&kd=2.5 HTTP/1.1\r\n",
+    b"GET /?action=update&speed=35&slight=0.9&mild=0.75&hard=0.6&grace=800&search=0.4"
+    b"&mode=bucket&kp=30&ki=0&kd=2 HTTP/1.1\r\n",
+    b"GET /?action=stop HTTP/1.1\r\n",
+    b"GET /style.css?v=1a2b3c4d HTTP/1.1\r\n",
+    b"GET / HTTP/1.1\r\n",
+]
+
+# The routes main.py had as substring checks, in the same order
+OLD_CHAIN = ("GET /events", "GET /status.bin", "GET /sensors", "GET /metrics", "GET /log",
+             "GET /flight.bin", "GET /loop", "GET /?action=start", "GET /?action=stop",
+             "GET /?action=update", "GET /style.css", "GET /script.js")
+PARAM_KEYS = tuple((name.encode(), name, kind) for name, attr, kind, default in PARAMS)
+
+
+class OldRequest:
+    "The request head as HttpServer kept it before: decoded str fields"
+    def __init__(self, line, method, target, headers):
+        self.line = line
+        self.method = method
+        self.target = target
+        self.headers = headers
+
+
+def old_params(request_str):
+    params = {}
+    for name, attr, kind, default in PARAMS:
+        key = name + "="
+        if key in request_str:
+            params[name] = kind(request_str.split(key)[1].split("&")[0].split(" ")[0])
+    return params
+
+
+def old_handle(line):
+    # HttpServer._read_head, then main.handle_request
+    parts = line.decode().split()
+    request = OldRequest(line.decode().rstrip(), parts[0], parts[1], {})
+    request_str = request.line
+    for route in OLD_CHAIN:
+        if route in request_str:
+            if route in ("GET /?action=start", "GET /?action=update"):
+                return route, old_params(request_str)
+            return route, None
+    return "GET /", None
+
+
+def new_params(request):
+    params = {}
+    query = request.query
+    for key, name, kind in PARAM_KEYS:
+        if key in query:
+            params[name] = kind(query[key].decode())
+    return params
+
+
+router = Router()
+for path in (b"/events", b"/status.bin", b"/sensors", b"/metrics", b"/log",
+             b"/flight.bin", b"/loop", b"/style.css", b"/script.js", b"/"):
+    router.add(path, path)
+
+
+slot = Request()  # as HttpServer keeps one per connection slot
+
+
+def new_handle(line):
+    request = parse_request_line(line, slot)
+    route = router.routes.get(request.path)
+    action = request.query.get(b"action")
+    if action == b"start" or action == b"update":
+        return route, new_params(request)
+    return route, None
+
+
+def peak_bytes(handle, line):
+    handle(line)
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    handle(line)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="request parsing and routing")
+    parser.add_argument('--rounds', type=int, default=20000)
+    args = parser.parse_args()
+
+    for line in LINES:
+        _, old = old_handle(line)
+        _, new = new_handle(line)
+        assert old == new, (line, old, new)
+    print("old and new parsing agree on all %d requests" % len(LINES))
+
+    def run(handle):
+        for line in LINES:
+            handle(line)
+
+    n = args.rounds
+    t_old = timeit.timeit(lambda: run(old_handle), number=n) / (n * len(LINES)) * 1e9
+    t_new = timeit.timeit(lambda: run(new_handle), number=n) / (n * len(LINES)) * 1e9
+    print("decode + substring chain  %8.1f ns/request" % t_old)
+    print("bytes parse + route table %8.1f ns/request" % t_new)
+    print("old / new time            %8.1fx" % (t_old / t_new))
+    for line in LINES:
+        t_o = timeit.timeit(lambda: old_handle(line), number=n) / n * 1e9
+        t_n = timeit.timeit(lambda: new_handle(line), number=n) / n * 1e9
+        print("  %-40s %8.1f -> %8.1f ns  %5d -> %5d bytes peak" % (
+            line.split(b" ")[1][:40].decode(), t_o, t_n,
+            peak_bytes(old_handle, line), peak_bytes(new_handle, line)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+"""
+Host-side stand-ins for the MicroPython hardware classes.
+
+Only the behaviour the PicoBot code relies on is modelled.  Every fake keeps
+counters so the cost of a code path can be measured on a PC.
+"""
+
+
+class Pin:
+    """
+    Each GPIO number has one level, shared by every Pin object made for it
+    (as on the chip) and visible to Mem32 through Pin.levels.
+    """
+    IN = 0
+    OUT = 1
+    PULL_UP = 1
+    PULL_DOWN = 2
+
+    levels = {}  # GPIO id -> 0/1
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self.mode = mode
+        self.pull = pull
+        if value is not None or id not in Pin.levels:
+            Pin.levels[id] = 1 if value else 0
+
+    @property
+    def _value(self):
+        return Pin.levels[self.id]
+
+    @_value.setter
+    def _value(self, v):
+        Pin.levels[self.id] = v
+
+    def value(self, v=None):
+        if v is None:
+            return self._value
+        self._value = 1 if v else 0
+
+    def on(self):
+        self._value = 1
+
+    def off(self):
+        self._value = 0
+
+
+class Mem32:
+    """
+    machine.mem32 with just the RP2040 SIO GPIO_IN register, built from the
+    fake Pin levels. Reads are counted.
+    """
+    SIO_GPIO_IN = 0xd0000004
+
+    def __init__(self):
+        self.reads = 0
+
+    def __getitem__(self, addr):
+        if addr != self.SIO_GPIO_IN:
+            raise ValueError("Mem32 only models SIO GPIO_IN, not 0x%08x" % addr)
+        self.reads += 1
+        v = 0
+        for gpio, level in Pin.levels.items():
+            if isinstance(gpio, int) and 0 <= gpio < 30 and level:
+                v |= 1 << gpio
+        return v
+
+
+class Timer:
+    """
+    machine.Timer without a hardware clock: nothing fires on its own, the
+    host drives it with fire().
+    """
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id=-1, **kwargs):
+        self.id = id
+        self.period = None
+        self.callback = None
+        if kwargs:
+            self.init(**kwargs)
+
+    def init(self, mode=PERIODIC, period=-1, callback=None, freq=None):
+        self.mode = mode
+        self.period = period if freq is None else 1000 // freq
+        self.callback = callback
+
+    def deinit(self):
+        self.callback = None
+
+    def fire(self):
+        if self.callback is not None:
+            self.callback(self)
+            if self.mode == self.ONE_SHOT:
+                self.callback = None
+
+
+class Scheduler:
+    "micropython.schedule() with the firmware's queue depth; drain with run()"
+    DEPTH = 8
+
+    def __init__(self):
+        self.queue = []
+
+    def schedule(self, func, arg):
+        if len(self.queue) >= self.DEPTH:
+            raise RuntimeError("schedule queue full")
+        self.queue.append((func, arg))
+
+    def run(self):
+        while self.queue:
+            func, arg = self.queue.pop(0)
+            func(arg)
+
+
+class CountingI2C:
+    """
+    Fake I2C bus that records every transaction.
+
+    Devices are plain 256-byte register files.  A register file whose MODE1
+    (register 0) has the auto-increment bit set takes multi-byte writes into
+    consecutive registers, like a PCA9685; otherwise every byte of a write
+    lands in the same register. Bytes written to the ALL_LED registers
+    (0xFA-0xFD) are copied to the same register of all 16 channels.
+    """
+    MODE1_AI = 0x20
+    ALL_LED = 0xFA
+
+    def __init__(self, id=0, scl=None, sda=None, freq=100000, addresses=(0x40,)):
+        self.id = id
+        self.freq = freq
+        self.devices = {}
+        for addr in addresses:
+            self.devices[addr] = bytearray(256)
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.transactions = 0
+        self.payload_bytes = 0
+        self.wire_bytes = 0
+
+    def _device(self, addr):
+        try:
+            return self.devices[addr]
+        except KeyError:
+            raise OSError(19)  # ENODEV, as the RP2040 port reports a NACK
+
+    def writeto_mem(self, addr, memaddr, buf):
+        regs = self._device(addr)
+        n = len(buf)
+        self.transactions += 1
+        self.payload_bytes += n
+        self.wire_bytes += 2 + n
+        if regs[0] & self.MODE1_AI:
+            regs[memaddr:memaddr + n] = bytes(buf)
+            last = memaddr + n
+        elif n:
+            regs[memaddr] = buf[n - 1]
+            last = memaddr + 1
+        if n and last > self.ALL_LED:
+            for reg in range(max(memaddr, self.ALL_LED), min(last, self.ALL_LED + 4)):
+                for ch in range(16):
+                    regs[6 + 4 * ch + reg - self.ALL_LED] = regs[reg]
+
+    def readfrom_mem(self, addr, memaddr, nbytes):
+        regs = self._device(addr)
+        self.transactions += 1
+        self.payload_bytes += nbytes
+        self.wire_bytes += 3 + nbytes
+        if regs[0] & self.MODE1_AI:
+            return bytes(regs[memaddr:memaddr + nbytes])
+        return bytes([regs[memaddr]]) * nbytes
+
+    def counters(self):
+        return {
+            'transactions': self.transactions,
+            'payload_bytes': self.payload_bytes,
+            'wire_bytes': self.wire_bytes,
+        }
+
+    def wire_time_us(self):
+        "Approximate bus time: 9 clocks per byte at the configured frequency"
+        return self.wire_bytes * 9 * 1000000 // self.freq
+
+
+class WLAN:
+    "network.WLAN that comes up at once with the Pico W's default AP address"
+    STA_IF = 0
+    AP_IF = 1
+
+    def __init__(self, interface=STA_IF):
+        self.interface = interface
+        self._active = False
+        self._config = {}
+
+    def config(self, *args, **kwargs):
+        if args:
+            return self._config.get(args[0])
+        self._config.update(kwargs)
+
+    def active(self, value=None):
+        if value is None:
+            return self._active
+        self._active = bool(value)
+
+    def isconnected(self):
+        return self._active
+
+    def ifconfig(self):
+        if self.interface == self.AP_IF:
+            return ('192.168.4.1', '255.255.255.0', '192.168.4.1', '0.0.0.0')
+        return ('0.0.0.0', '0.0.0.0', '0.0.0.0', '0.0.0.0')
@@ -0,0 +1,106 @@
+"""
+Load test for picobot_http.HttpServer on CPython.
+
+A few "phone" clients poll /sensors as fast as they can while slow clients
+trickle their request heads in byte by byte or connect and say nothing.
+Prints latency of the fast clients and the server's own counters.
+
+    python -m picobot_sim.http_load [--fast 4] [--slow 2] [--seconds 3]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import picobot_sim
+
+picobot_sim.install()
+
+from picobot_http import HttpServer, send_response
+
+BODY = json.dumps({'sensors': [0, 0, 1, 0, 0], 'action': "FORWARD", 'status': "Running"})
+
+
+async def handler(request, writer):
+    if request.path == b"/sensors":
+        await send_response(writer, "application/json", BODY)
+    else:
+        await send_response(writer, "text/plain", "OK")
+
+
+async def fast_client(port, deadline, latencies, statuses):
+    while time.monotonic() < deadline:
+        start = time.monotonic()
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b"GET /sensors HTTP/1.1\r\nHost: picobot\r\n\r\n")
+            await writer.drain()
+            data = await reader.read()
+            writer.close()
+        except OSError:
+            statuses['refused'] = statuses.get('refused', 0) + 1
+            continue
+        status = data.split(b" ", 2)[1].decode() if data else "none"
+        statuses[status] = statuses.get(status, 0) + 1
+        latencies.append(time.monotonic() - start)
+
+
+async def slow_client(port, deadline, idle):
+    while time.monotonic() < deadline:
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            if not idle:
+                for b in b"GET /sensors HTTP/1.1\r\n\r\n":
+                    writer.write(bytes([b]))
+                    await writer.drain()
+                    await asyncio.sleep(0.05)
+            await reader.read()
+            writer.close()
+        except OSError:
+            await asyncio.sleep(0.05)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run(fast, slow, seconds, max_clients, timeout_ms):
+    server = HttpServer(handler, port=0, max_clients=max_clients, timeout_ms=timeout_ms)
+    srv = await server.start('127.0.0.1')
+    port = srv.sockets[0].getsockname()[1]
+    deadline = time.monotonic() + seconds
+    latencies = []
+    statuses = {}
+    tasks = [fast_client(port, deadline, latencies, statuses) for _ in range(fast)]
+    tasks += [slow_client(port, deadline, i % 2 == 1) for i in range(slow)]
+    await asyncio.gather(*tasks)
+    srv.close()
+    await srv.wait_closed()
+    return {
+        'requests': len(latencies),
+        'requests_per_s': round(len(latencies) / seconds, 1),
+        'latency_p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'latency_p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'latency_max_ms': round(max(latencies or [0]) * 1000, 2),
+        'statuses': statuses,
+        'server': server.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--fast', type=int, default=4)
+    parser.add_argument('--slow', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--max-clients', type=int, default=8)
+    parser.add_argument('--timeout-ms', type=int, default=1000)
+    args = parser.parse_args()
+    result = asyncio.run(run(args.fast, args.slow, args.seconds, args.max_clients, args.timeout_ms))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
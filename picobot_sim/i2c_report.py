@@ -0,0 +1,61 @@
+"""
+I2C cost of a line-following control tick, byte-by-byte vs auto-increment,
+with per-motor writes vs one shadow-register flush per tick.
+
+    python -m picobot_sim.i2c_report
+"""
+import picobot_sim
+
+picobot_sim.install()
+
+from picobot_sim.fakes import CountingI2C
+import picobot_motors
+
+MOTORS = ('LeftFront', 'LeftBack', 'RightFront', 'RightBack')
+
+
+def tick(driver, speed=30, ratio=0.75):
+    "The motor writes set_motor_action makes for a MILD turn"
+    driver.TurnMotor(MOTORS[0], 'forward', speed)
+    driver.TurnMotor(MOTORS[1], 'forward', speed)
+    driver.TurnMotor(MOTORS[2], 'forward', int(speed * ratio))
+    driver.TurnMotor(MOTORS[3], 'forward', int(speed * ratio))
+    driver.flush()
+
+
+def measure(auto_increment, autoflush):
+    bus = CountingI2C()
+    driver = picobot_motors.MotorDriver(i2c=bus, auto_increment=auto_increment)
+    driver.autoflush = autoflush
+    result = {}
+    for name, speed in (('first', 30), ('repeat', 30), ('change', 40)):
+        bus.reset_counters()
+        tick(driver, speed)
+        result[name] = bus.counters()
+        result[name]['wire_time_us'] = bus.wire_time_us()
+    bus.reset_counters()
+    driver.StopAllMotors()
+    driver.flush()
+    result['stop'] = bus.counters()
+    tick(driver)
+    result['registers'] = bytes(bus.devices[0x40][0x06:0x06 + 48])
+    return result
+
+
+def main():
+    modes = (
+        ("byte-by-byte", measure(False, True)),
+        ("auto-inc", measure(True, True)),
+        ("one flush", measure(True, False)),
+    )
+    for name, result in modes[1:]:
+        assert result['registers'] == modes[0][1]['registers'], name
+    print("%-26s" % "" + "".join("%14s" % name for name, _ in modes))
+    for phase in ('first', 'repeat', 'change', 'stop'):
+        for key in ('transactions', 'wire_bytes'):
+            print("%-26s" % (phase + " tick " + key)
+                  + "".join("%14d" % r[phase][key] for _, r in modes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Parameter presets between the host and the robot (see picobot_presets).
+
+    python -m picobot_sim.presets --json presets.json --host 192.168.4.1 [--activate tuned-1]
+    python -m picobot_sim.presets --json presets.json --out presets.bin [--activate tuned-1]
+    python -m picobot_sim.presets --show presets.bin
+    python -m picobot_sim.presets --host 192.168.4.1
+
+--json reads a list of {"name": ..., "params": {...}} as written by
+`picobot_sim.tune --export`. With --host the presets are saved on the robot
+through GET /presets; with --out a presets file is built to copy to flash
+(e.g. mpremote cp presets.bin :). --host alone lists what the robot has.
+"""
+import argparse
+import json
+import sys
+import urllib.parse
+import urllib.request
+
+import picobot_sim
+
+picobot_sim.install()
+
+from picobot_presets import PresetStore, decode, encode
+
+
+def call(host, **query):
+    url = "http://%s/presets" % host
+    if query:
+        url += "?" + urllib.parse.urlencode(query)
+    try:
+        with urllib.request.urlopen(url, timeout=10) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        sys.exit("%s: %d %s" % (query.get('name', url), e.code, e.read().decode().strip()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="parameter presets for the robot")
+    parser.add_argument('--json', help="presets from picobot_sim.tune --export")
+    parser.add_argument('--host', help="the robot's address")
+    parser.add_argument('--out', help="write a presets file instead of uploading")
+    parser.add_argument('--activate', help="preset to make active")
+    parser.add_argument('--show', help="print the presets in a presets file")
+    args = parser.parse_args()
+
+    if args.show:
+        with open(args.show, "rb") as f:
+            presets, active = decode(f.read())
+        print(json.dumps({'active': active, 'presets': presets}, indent=2))
+        return
+
+    entries = []
+    if args.json:
+        with open(args.json) as f:
+            entries = json.load(f)
+
+    if args.out:
+        store = PresetStore()
+        for entry in entries:
+            store.put(entry['name'], entry['params'])
+        if args.activate:
+            store.activate(args.activate)
+        data = encode(store.presets, store.active)
+        with open(args.out, "wb") as f:
+            f.write(data)
+        print("wrote %d presets, %d bytes, to %s" % (len(store.presets), len(data), args.out))
+    elif args.host:
+        report = None
+        for entry in entries:
+            report = call(args.host, action="save", name=entry['name'], **entry['params'])
+        if args.activate:
+            report = call(args.host, action="activate", name=args.activate)
+        print(json.dumps(report or call(args.host), indent=2))
+    else:
+        parser.error("--host, --out or --show is required")
+
+
+if __name__ == '__main__':
+    main()
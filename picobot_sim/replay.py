@@ -0,0 +1,161 @@
+"""
+Downloads and replays a flight recorder log (see picobot_recorder).
+
+    python -m picobot_sim.replay --host 192.168.4.1 [--prev] [--save run.bin]
+    python -m picobot_sim.replay --file run.bin [--csv run.csv] [--show 20]
+    python -m picobot_sim.replay --file run.bin --sim technical
+
+Without --sim, the logged sensor readings are fed tick by tick, at the
+logged times, through the current LineFollower: decide table,
+set_motor_action/steer and the motor driver. Every tick whose action,
+wheel speeds or state differ from the log is reported. A firmware change that
+should not alter behaviour must replay clean against logs from the floor.
+
+With --sim, the parameters of the run are also driven round a simulated
+track, to compare the floor run with the model.
+"""
+import argparse
+import json
+import sys
+import urllib.request
+
+import picobot_sim
+
+machine = picobot_sim.install()
+
+from picobot_line import ACTIONS, STATUSES, LineFollower
+from picobot_recorder import decode
+from picobot_sim.fakes import CountingI2C
+import picobot_motors
+
+
+class LoggedSensors:
+    "Sensor reader that returns the bits of the tick being replayed"
+    def __init__(self):
+        self.bits = 0
+
+    def read(self):
+        return self.bits
+
+
+def replay(ticks):
+    """
+    Runs the logged sensor readings through LineFollower and returns a list
+    of (tick, field, logged, replayed) differences.
+    """
+    clock = picobot_sim.clock
+    sensors = LoggedSensors()
+    driver = picobot_motors.MotorDriver(i2c=CountingI2C())
+    driver.autoflush = False
+    f = LineFollower(driver, sensors)
+    diffs = []
+    version = None
+    try:
+        for i, t in enumerate(ticks):
+            clock.virtual_us = t['ms'] * 1000
+            if i == 0:
+                f.post("start", t['params'])
+            elif t['params_version'] != version:
+                f.post("update", t['params'])
+            if not t['running'] and f.robot_running and t['status'] != 4:
+                f.post("stop")  # stopped from the web page; a junction stops by itself
+            version = t['params_version']
+            sensors.bits = t['bits']
+            f.tick()
+            replayed = {
+                'action': ACTIONS.index(f.action),
+                'left': driver.MotorSpeed(0),
+                'right': driver.MotorSpeed(6),
+                'status': f.status_code(),
+                'running': f.robot_running,
+                'line_lost': f.line_lost,
+            }
+            for field, value in replayed.items():
+                if t[field] != value:
+                    diffs.append((t['tick'], field, t[field], value))
+    finally:
+        clock.virtual_us = None
+    return diffs
+
+
+def summary(ticks):
+    losses = 0
+    lost = False
+    for t in ticks:
+        is_lost = ACTIONS[t['action']] == "LINE LOST"
+        if is_lost and not lost:
+            losses += 1
+        lost = is_lost
+    duration = (ticks[-1]['ms'] - ticks[0]['ms']) / 1000 if ticks else 0
+    versions = sorted({t['params_version'] for t in ticks})
+    return {
+        'ticks': len(ticks),
+        'duration_s': round(duration, 3),
+        'line_losses': losses,
+        'final_status': STATUSES[ticks[-1]['status']] if ticks else None,
+        'params': [next(t['params'] for t in ticks if t['params_version'] == v) for v in versions],
+    }
+
+
+def write_csv(ticks, path):
+    with open(path, "w") as out:
+        out.write("tick,ms,bits,action,status,left,right,search_step,running,line_lost,params_version\n")
+        for t in ticks:
+            out.write("%d,%d,%d,%s,%s,%d,%d,%d,%d,%d,%d\n" % (
+                t['tick'], t['ms'], t['bits'], ACTIONS[t['action']], STATUSES[t['status']],
+                t['left'], t['right'], t['search_step'], t['running'], t['line_lost'],
+                t['params_version']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="flight recorder download and replay")
+    parser.add_argument('--host', help="download from the robot at this address")
+    parser.add_argument('--prev', action='store_true', help="the run before the last one")
+    parser.add_argument('--file', help="read a saved log instead")
+    parser.add_argument('--save', help="keep the downloaded log here")
+    parser.add_argument('--csv', help="write the ticks as CSV")
+    parser.add_argument('--show', type=int, default=10, help="differences to print")
+    parser.add_argument('--sim', help="also run the logged parameters on this simulated track")
+    args = parser.parse_args()
+
+    if args.host:
+        url = "http://%s/flight.bin%s" % (args.host, "?prev=1" if args.prev else "")
+        with urllib.request.urlopen(url, timeout=10) as response:
+            data = response.read()
+        if args.save:
+            with open(args.save, "wb") as f:
+                f.write(data)
+    elif args.file:
+        with open(args.file, "rb") as f:
+            data = f.read()
+    else:
+        parser.error("--host or --file is required")
+
+    header, ticks = decode(data)
+    if not ticks:
+        print("log has no ticks")
+        return
+    report = summary(ticks)
+    print(json.dumps(report, indent=2))
+    if args.csv:
+        write_csv(ticks, args.csv)
+
+    diffs = replay(ticks)
+    if diffs:
+        print("%d ticks differ from the log; first %d:" % (len({d[0] for d in diffs}), args.show))
+        for tick, field, logged, replayed in diffs[:args.show]:
+            print("  tick %5d %-7s logged %s, replayed %s" % (tick, field, logged, replayed))
+    else:
+        print("replay matches the log on all %d ticks" % len(ticks))
+
+    if args.sim:
+        from picobot_sim import track
+        from picobot_sim.sim import Simulation
+        params = ticks[-1]['params']
+        metrics = Simulation(track.TRACKS[args.sim](), params).run(laps=1)
+        print(json.dumps({'sim': metrics}))
+    sys.exit(1 if diffs else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""
+Differential-drive PicoBot on a simulated track, driven by the real
+LineFollower and MotorDriver.
+
+The firmware writes PCA9685 registers on a fake I2C bus; the simulator reads
+the wheel duty cycles and directions back out of those registers, moves
+the robot, and sets the fake GPIO levels of the five sensors from the track
+bitmap, so the real picobot_sensors reader samples them. Ticks come from
+ControlLoop's 'schedule' mode: the fake Timer fires every control period
+and the fake scheduler runs the queued tick. Time is virtual
+(picobot_sim.clock), so a run takes as long as the arithmetic.
+"""
+import math
+
+import picobot_sim
+
+machine = picobot_sim.install()
+
+from picobot_sim.fakes import CountingI2C
+import picobot_motors
+import picobot_sensors
+from picobot_control import ControlLoop
+from picobot_line import LineFollower
+from picobot_log import logger
+
+# Robot geometry and motor model
+SENSOR_SPACING = 0.015   # m between adjacent sensors
+SENSOR_AHEAD = 0.06      # m from the axle to the sensor bar
+WHEEL_BASE = 0.12        # m between left and right wheels
+SLIP = 1.3               # skid-steer: effective wheel base / geometric
+V_MAX = 0.8              # m/s at 100% duty
+DEADBAND = 0.1           # duty fraction below which the motors stall
+MOTOR_TAU = 0.06         # s, first-order motor response
+
+PHYSICS_DT_US = 2000
+CONTROL_PERIOD_MS = 50
+
+
+class SensorField:
+    """
+    Drives the sensor GPIOs from the track: update() sets each fake Pin level
+    to 1 when its sensor is over the line. Sensor i (right → left) is on
+    picobot_sensors.SENSOR_PINS[i].
+    """
+    def __init__(self, robot, track, pins=picobot_sensors.SENSOR_PINS):
+        self.robot = robot
+        self.track = track
+        self.pins = pins
+
+    def update(self):
+        r = self.robot
+        c, s = math.cos(r.heading), math.sin(r.heading)
+        bx = r.x + SENSOR_AHEAD * c
+        by = r.y + SENSOR_AHEAD * s
+        levels = machine.Pin.levels
+        for i, gpio in enumerate(self.pins):
+            # sensor 0 is on the right: negative left offset
+            off = (i - 2) * SENSOR_SPACING
+            levels[gpio] = self.track.on_line(bx - off * s, by + off * c)
+
+
+class Robot:
+    def __init__(self, x, y, heading):
+        self.x = x
+        self.y = y
+        self.heading = heading
+        self.v_left = 0.0
+        self.v_right = 0.0
+
+    def step(self, target_left, target_right, dt):
+        a = dt / (MOTOR_TAU + dt)
+        self.v_left += a * (target_left - self.v_left)
+        self.v_right += a * (target_right - self.v_right)
+        v = (self.v_left + self.v_right) / 2
+        w = (self.v_right - self.v_left) / (WHEEL_BASE * SLIP)
+        self.heading += w * dt / 2
+        self.x += v * math.cos(self.heading) * dt
+        self.y += v * math.sin(self.heading) * dt
+        self.heading += w * dt / 2
+
+
+def level(regs, channel):
+    "OFF count of a channel, 0 while its full-OFF bit (OFF_H bit 4) is set"
+    base = 6 + 4 * channel
+    if regs[base + 3] & 0x10:
+        return 0
+    return regs[base + 2] | regs[base + 3] << 8
+
+
+def wheel_speed(regs, first):
+    "m/s commanded for the motor whose PWM/IN1/IN2 channels start at `first`"
+    duty = level(regs, first) / 4095
+    in1 = level(regs, first + 1)
+    in2 = level(regs, first + 2)
+    if duty <= DEADBAND or in1 == in2:
+        return 0.0
+    v = V_MAX * (duty - DEADBAND) / (1 - DEADBAND)
+    return v if in2 else -v
+
+
+class Simulation:
+    def __init__(self, track, params=None, sensors='pin'):
+        """
+        params  - LineFollower parameters, as the web UI posts them
+        sensors - 'pin' or 'sio': which picobot_sensors reader samples the GPIOs
+        """
+        self.track = track
+        self.bus = CountingI2C()
+        self.driver = picobot_motors.MotorDriver(i2c=self.bus)
+        self.driver.autoflush = False
+        x, y, heading = track.start_pose()
+        self.robot = Robot(x, y, heading)
+        self.field = SensorField(self.robot, track)
+        if sensors == 'sio':
+            reader = picobot_sensors.SioSensorReader(mem=machine.mem32)
+        else:
+            reader = picobot_sensors.PinSensorReader()
+        self.follower = LineFollower(self.driver, reader)
+        self.loop = ControlLoop(self.follower.tick, CONTROL_PERIOD_MS, mode='schedule')
+        self.params = params or {}
+
+    def wheel_targets(self):
+        regs = self.bus.devices[0x40]
+        left = (wheel_speed(regs, 0) + wheel_speed(regs, 3)) / 2
+        right = (wheel_speed(regs, 6) + wheel_speed(regs, 9)) / 2
+        return left, right
+
+    def run(self, laps=1, max_time_s=60.0, quiet=True):
+        """
+        Runs until `laps` laps are done, the robot stops (junction or line
+        lost past the grace period) or max_time_s of simulated time passes.
+        Returns a metrics dict. Unless quiet, prints the follower's log
+        records from the run afterwards.
+        """
+        clock = picobot_sim.clock
+        clock.virtual_us = 0
+        first = logger.head
+        self.loop.start()
+        try:
+            return self._run(laps, max_time_s)
+        finally:
+            self.loop.stop()
+            picobot_sim.scheduler.queue.clear()
+            if not quiet:
+                for line in logger.lines(first)[1]:
+                    print(line)
+            clock.virtual_us = None
+
+    def _run(self, laps, max_time_s):
+        clock = picobot_sim.clock
+        track = self.track
+        robot = self.robot
+        f = self.follower
+        timer = self.loop._timer
+        f.post("start", self.params)
+        n_points = len(track.points)
+        index, _ = track.nearest(robot.x, robot.y)
+        travelled = 0          # centerline samples, signed
+        lap_times = []
+        losses = 0
+        was_lost = False
+        err_sum = 0.0
+        err_max = 0.0
+        samples = 0
+        dt = PHYSICS_DT_US / 1000000
+        next_tick = 0
+        end_us = int(max_time_s * 1000000)
+        stopped = None
+        while clock.virtual_us < end_us:
+            if clock.virtual_us >= next_tick:
+                self.field.update()
+                timer.fire()
+                picobot_sim.scheduler.run()
+                next_tick += CONTROL_PERIOD_MS * 1000
+                if f.line_lost and not was_lost:
+                    losses += 1
+                was_lost = f.line_lost
+                if not f.robot_running and f.ticks > 1:
+                    stopped = "junction" if f.mission_done else "user"
+                    break
+                if f.line_lost and f.status_code() == 3:
+                    stopped = "line lost"
+                    break
+            left, right = self.wheel_targets()
+            robot.step(left, right, dt)
+            clock.virtual_us += PHYSICS_DT_US
+
+            new_index, dist = track.nearest(robot.x, robot.y, index)
+            delta = new_index - index
+            if delta > n_points // 2:
+                delta -= n_points
+            elif delta < -n_points // 2:
+                delta += n_points
+            travelled += delta
+            index = new_index
+            err_sum += dist * dist
+            err_max = max(err_max, dist)
+            samples += 1
+            if travelled >= n_points * (len(lap_times) + 1):
+                lap_times.append(clock.virtual_us / 1000000)
+                if len(lap_times) >= laps:
+                    break
+            if dist > 0.25:
+                stopped = "off track"
+                break
+
+        lap_deltas = [b - a for a, b in zip([0.0] + lap_times, lap_times)]
+        return {
+            'track': track.name,
+            'laps': len(lap_times),
+            'lap_times_s': [round(t, 3) for t in lap_deltas],
+            'best_lap_s': round(min(lap_deltas), 3) if lap_deltas else None,
+            'line_losses': losses,
+            'tracking_rms_mm': round(math.sqrt(err_sum / max(samples, 1)) * 1000, 2),
+            'tracking_max_mm': round(err_max * 1000, 2),
+            'distance_m': round(travelled * track.length / n_points, 3),
+            'sim_time_s': round(clock.virtual_us / 1000000, 3),
+            'ticks': f.ticks,
+            'i2c_transactions': self.bus.transactions,
+            'stopped': stopped,
+        }
@@ -0,0 +1,57 @@
+"""
+Polls the robot's binary status record and logs it as CSV.
+
+    python -m picobot_sim.status_client [--host 192.168.4.1] [--rate 50] [--count 0]
+
+Connect the PC to the picobot-ln access point first. Each line is one
+record: receive time (s), then picobot_telemetry.STATUS_FIELDS, with the
+action and status codes also spelled out.
+"""
+import argparse
+import sys
+import time
+import urllib.request
+
+import picobot_sim
+
+picobot_sim.install()
+
+from picobot_line import ACTIONS, STATUSES
+from picobot_telemetry import STATUS_FIELDS, decode_status
+
+
+def poll(host, rate_hz, count, out):
+    url = "http://%s/status.bin" % host
+    period = 1.0 / rate_hz
+    out.write("time," + ",".join(STATUS_FIELDS) + ",action_name,status_name\n")
+    n = 0
+    next_due = time.monotonic()
+    while count == 0 or n < count:
+        with urllib.request.urlopen(url, timeout=2) as response:
+            record = decode_status(response.read())
+        fields = [record[name] for name in STATUS_FIELDS]
+        out.write("%.3f,%s,%s,%s\n" % (time.time(), ",".join(str(f) for f in fields),
+                                       ACTIONS[record['action']], STATUSES[record['status']]))
+        n += 1
+        next_due += period
+        delay = next_due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            next_due = time.monotonic()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Log the PicoBot binary status record")
+    parser.add_argument('--host', default="192.168.4.1")
+    parser.add_argument('--rate', type=float, default=50.0, help="polls per second")
+    parser.add_argument('--count', type=int, default=0, help="records to fetch, 0 = forever")
+    args = parser.parse_args()
+    try:
+        poll(args.host, args.rate, args.count, sys.stdout)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+"""
+Line tracks for the simulator.
+
+A track is a closed centerline sampled every `step` metres plus a bitmap
+of the painted line at `resolution` metres per pixel. Sensors look at the
+bitmap; lap progress and tracking error use the centerline.
+
+Tracks come from segment lists (TRACKS) or from a PGM/PBM image of the
+floor: dark pixels are line, and the centerline is traced from a start
+point, so a photo or drawing of the real course can be used.
+"""
+import math
+
+LINE_WIDTH = 0.018   # m, black tape
+STEP = 0.002         # m between centerline samples
+RESOLUTION = 0.002   # m per bitmap pixel
+MARGIN = 0.15        # m of floor around the line
+
+
+class Track:
+    def __init__(self, name, points, line_width=LINE_WIDTH, resolution=RESOLUTION, bitmap=None):
+        """
+        points - closed centerline, one (x, y) in metres every STEP
+        bitmap - (width, height, bytes) with 1 = line, origin at (0, 0);
+                 painted from the centerline when None
+        """
+        self.name = name
+        self.points = points
+        self.line_width = line_width
+        self.resolution = resolution
+        self.length = len(points) * STEP
+        if bitmap is not None:
+            self.x0 = self.y0 = 0.0
+            self.width, self.height, data = bitmap
+            self.bitmap = bytearray(data)
+            return
+        xs = [p[0] for p in points]
+        ys = [p[1] for p in points]
+        self.x0 = min(xs) - MARGIN
+        self.y0 = min(ys) - MARGIN
+        self.width = int((max(xs) + MARGIN - self.x0) / resolution) + 1
+        self.height = int((max(ys) + MARGIN - self.y0) / resolution) + 1
+        self.bitmap = bytearray(self.width * self.height)
+        self._paint()
+
+    def _paint(self):
+        r = self.line_width / 2 / self.resolution
+        ri = int(r) + 1
+        r2 = r * r
+        w = self.width
+        bitmap = self.bitmap
+        for x, y in self.points:
+            cx = (x - self.x0) / self.resolution
+            cy = (y - self.y0) / self.resolution
+            for py in range(int(cy) - ri, int(cy) + ri + 1):
+                dy = py + 0.5 - cy
+                for px in range(int(cx) - ri, int(cx) + ri + 1):
+                    dx = px + 0.5 - cx
+                    if dx * dx + dy * dy <= r2:
+                        bitmap[py * w + px] = 1
+
+    def on_line(self, x, y):
+        px = int((x - self.x0) / self.resolution)
+        py = int((y - self.y0) / self.resolution)
+        if 0 <= px < self.width and 0 <= py < self.height:
+            return self.bitmap[py * self.width + px]
+        return 0
+
+    def nearest(self, x, y, hint=None, window=60):
+        """
+        (index, distance) of the centerline sample closest to (x, y).
+        With a hint only samples within `window` of it are searched, which
+        is enough when called every few millimetres of travel.
+        """
+        pts = self.points
+        n = len(pts)
+        if hint is None:
+            candidates = range(n)
+        else:
+            candidates = (i % n for i in range(hint - window, hint + window + 1))
+        best = 0
+        best_d2 = float('inf')
+        for i in candidates:
+            px, py = pts[i]
+            d2 = (px - x) ** 2 + (py - y) ** 2
+            if d2 < best_d2:
+                best = i
+                best_d2 = d2
+        return best, math.sqrt(best_d2)
+
+    def save_pgm(self, path):
+        "Writes the bitmap as a binary PGM, line black on white, row 0 at the top"
+        with open(path, 'wb') as f:
+            f.write(b"P5\n# resolution %g m/px\n%d %d\n255\n" % (self.resolution, self.width, self.height))
+            w = self.width
+            for row in range(self.height - 1, -1, -1):
+                f.write(bytes(0 if v else 255 for v in self.bitmap[row * w:(row + 1) * w]))
+
+    def start_pose(self):
+        "(x, y, heading) at the first sample, facing along the track"
+        (x0, y0), (x1, y1) = self.points[0], self.points[1]
+        return x0, y0, math.atan2(y1 - y0, x1 - x0)
+
+
+def from_segments(name, segments, step=STEP):
+    """
+    Builds a track from ('S', length) straights and ('A', radius, degrees)
+    arcs (positive = left turn), starting at the origin heading +x.
+    """
+    x = y = heading = 0.0
+    points = []
+    for seg in segments:
+        if seg[0] == 'S':
+            n = max(1, int(round(seg[1] / step)))
+            for _ in range(n):
+                points.append((x, y))
+                x += step * math.cos(heading)
+                y += step * math.sin(heading)
+        else:
+            radius, degrees = seg[1], seg[2]
+            turn = math.radians(degrees)
+            n = max(1, int(round(abs(turn) * radius / step)))
+            dtheta = turn / n
+            for _ in range(n):
+                points.append((x, y))
+                heading += dtheta / 2
+                x += step * math.cos(heading)
+                y += step * math.sin(heading)
+                heading += dtheta / 2
+    gap = math.hypot(x - points[0][0], y - points[0][1])
+    if gap > 5 * step:
+        raise ValueError("track %s does not close (gap %.3f m)" % (name, gap))
+    return Track(name, points)
+
+
+def _read_pnm(path):
+    "(width, height, rows) of a binary PGM (P5) or PBM (P4); rows top first, 1 = dark"
+    with open(path, 'rb') as f:
+        data = f.read()
+    tokens = []
+    pos = 0
+    needed = 3 if data[:2] == b"P4" else 4
+    while len(tokens) < needed:
+        while data[pos:pos + 1].isspace():
+            pos += 1
+        if data[pos:pos + 1] == b"#":
+            pos = data.index(b"\n", pos) + 1
+            continue
+        end = pos
+        while not data[end:end + 1].isspace():
+            end += 1
+        tokens.append(data[pos:end])
+        pos = end
+    pos += 1
+    magic, width, height = tokens[0], int(tokens[1]), int(tokens[2])
+    rows = []
+    if magic == b"P5":
+        maxval = int(tokens[3])
+        for r in range(height):
+            row = data[pos + r * width:pos + (r + 1) * width]
+            rows.append(bytes(1 if v < maxval // 2 else 0 for v in row))
+    elif magic == b"P4":
+        stride = (width + 7) // 8
+        for r in range(height):
+            row = data[pos + r * stride:pos + (r + 1) * stride]
+            rows.append(bytes((row[x // 8] >> (7 - x % 8)) & 1 for x in range(width)))
+    else:
+        raise ValueError("%s: only binary PGM (P5) and PBM (P4) are supported" % path)
+    return width, height, rows
+
+
+def trace_centerline(on_line, x, y, heading, step=STEP, look=0.01, max_length=100.0):
+    """
+    Follows a painted line from (x, y) facing `heading` (radians) and returns
+    centerline samples every `step` metres until it gets back to the start.
+    At each step it looks `look` metres ahead across +-60 degrees and heads
+    for the middle of the line pixels it sees.
+    """
+    points = []
+    fan = [math.radians(a) for a in range(-60, 61, 3)]
+    travelled = 0.0
+    while travelled < max_length:
+        points.append((x, y))
+        hits = [a for a in fan if on_line(x + look * math.cos(heading + a),
+                                          y + look * math.sin(heading + a))]
+        if not hits:
+            raise ValueError("line ends at (%.3f, %.3f)" % (x, y))
+        heading += (hits[0] + hits[-1]) / 2
+        x += step * math.cos(heading)
+        y += step * math.sin(heading)
+        travelled += step
+        if travelled > 20 * look and math.hypot(x - points[0][0], y - points[0][1]) < step:
+            return points
+    raise ValueError("line does not close within %.0f m" % max_length)
+
+
+def load_pgm(path, start, heading_deg, resolution=RESOLUTION, name=None):
+    """
+    Track from a PGM/PBM floor image at `resolution` m per pixel. `start` is
+    a point on the line in metres from the bottom-left corner of the image
+    and `heading_deg` the direction of travel there.
+    """
+    width, height, rows = _read_pnm(path)
+    bitmap = b"".join(reversed(rows))  # row 0 at the bottom, y up
+
+    def on_line(x, y):
+        px = int(x / resolution)
+        py = int(y / resolution)
+        return 0 <= px < width and 0 <= py < height and bitmap[py * width + px]
+
+    points = trace_centerline(on_line, start[0], start[1], math.radians(heading_deg))
+    return Track(name or path, points, resolution=resolution, bitmap=(width, height, bitmap))
+
+
+def oval():
+    "1 m straights, 0.3 m radius turns"
+    return from_segments('oval', [('S', 1.0), ('A', 0.3, 180), ('S', 1.0), ('A', 0.3, 180)])
+
+
+def technical():
+    "Tight hairpins and an S-bend; the same half twice, so it closes"
+    half = [('S', 0.6), ('A', 0.25, 90), ('S', 0.2), ('A', 0.15, -90),
+            ('S', 0.2), ('A', 0.2, 180)]
+    return from_segments('technical', half + half)
+
+
+def kidney():
+    "Fast sweepers with one inward bend"
+    half = [('S', 0.8), ('A', 0.35, 120), ('A', 0.5, -60), ('A', 0.3, 120)]
+    return from_segments('kidney', half + half)
+
+
+TRACKS = {
+    'oval': oval,
+    'technical': technical,
+    'kidney': kidney,
+}
@@ -0,0 +1,316 @@
+"""
+Parameter tuner: evaluates LineFollower parameter sets on simulated tracks
+in a process pool and prints the Pareto front of lap time vs line losses.
+
+    python -m picobot_sim.tune grid --levels 3
+    python -m picobot_sim.tune random --samples 2000 --tracks oval,technical
+    python -m picobot_sim.tune cmaes --generations 30 --set mode=pid --range kp=10:80 --range kd=0:8
+    python -m picobot_sim.tune random --samples 500 --export presets.json
+
+Search strategies:
+    grid    - every combination of --levels evenly spaced values per parameter
+    random  - --samples uniform draws from the space
+    cmaes   - separable CMA-ES on the normalised space, minimising
+              lap time * (1 + --loss-weight * losses per lap)
+
+Every (track, laps, params) result is appended to the --cache file, so a
+re-run or a different strategy over the same points costs nothing. A
+parameter set counts only if it finishes every lap on every track; its
+lap time is the mean over tracks and its loss rate is line losses per lap.
+Front entries are printed with the query string the web UI sends, and
+--export writes them as named presets.
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+
+import picobot_sim
+
+picobot_sim.install()
+
+from picobot_sim import track
+from picobot_line import PARAMS
+
+# (query name, low, high, kind) - the six knobs of the web form
+SPACE = (
+    ("speed", 20, 100, int),
+    ("slight", 0.5, 1.0, float),
+    ("mild", 0.3, 1.0, float),
+    ("hard", 0.0, 0.9, float),
+    ("grace", 200, 2000, int),
+    ("search", 0.1, 0.8, float),
+)
+
+FAILED_COST = 1e6
+
+
+# ------------------------
+# Parameter space
+# ------------------------
+def parse_space(ranges, only=None):
+    """
+    SPACE, cut down to the names in `only` if given, with --range
+    name=low:high entries replacing or adding dimensions
+    """
+    space = [d for d in SPACE if only is None or d[0] in only]
+    for r in ranges:
+        name, _, bounds = r.partition("=")
+        low, _, high = bounds.partition(":")
+        kind = int if "." not in low + high else float
+        dim = (name, kind(low), kind(high), kind)
+        space = [d for d in space if d[0] != name]
+        space.append(dim)
+    return space
+
+
+def quantise(value, low, high, kind):
+    "Rounds to the resolution the robot can tell apart, so nearby points share cache entries"
+    value = min(max(value, low), high)
+    if kind is int:
+        step = 50 if high - low >= 1000 else 1
+        return int(round(value / step) * step)
+    return round(value, 2)
+
+
+def from_unit(u, space):
+    "Parameter dict for a point in the unit cube"
+    return {name: quantise(low + ui * (high - low), low, high, kind)
+            for ui, (name, low, high, kind) in zip(u, space)}
+
+
+# ------------------------
+# Evaluation
+# ------------------------
+_tracks = {}
+
+
+def cache_key(track_name, laps, params):
+    return json.dumps([track_name, laps, sorted(params.items())])
+
+
+def run_job(job):
+    "Worker: one simulation; the track is built once per process"
+    track_name, laps, max_time_s, params = job
+    from picobot_sim.sim import Simulation
+    if track_name not in _tracks:
+        _tracks[track_name] = track.TRACKS[track_name]()
+    m = Simulation(_tracks[track_name], params).run(laps=laps, max_time_s=max_time_s)
+    result = {k: m[k] for k in ('laps', 'best_lap_s', 'lap_times_s', 'line_losses',
+                                'tracking_rms_mm', 'stopped')}
+    return cache_key(track_name, laps, params), result
+
+
+class Tuner:
+    def __init__(self, tracks, laps=2, max_time_s=120.0, fixed=None,
+                 cache_path=None, workers=None, loss_weight=1.0):
+        self.tracks = tracks
+        self.laps = laps
+        self.max_time_s = max_time_s
+        self.fixed = fixed or {}
+        self.loss_weight = loss_weight
+        self.cache_path = cache_path
+        self.cache = {}
+        self.cache_hits = 0
+        self.runs = 0
+        self.workers = workers or os.cpu_count()
+        self.results = {}  # params json -> summary
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path) as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.cache[entry['key']] = entry['result']
+
+    def evaluate(self, candidates, pool):
+        "Summaries for a list of parameter dicts, running only what is not cached"
+        full = [dict(self.fixed, **c) for c in candidates]
+        jobs = {}
+        for params in full:
+            for name in self.tracks:
+                key = cache_key(name, self.laps, params)
+                if key in self.cache:
+                    self.cache_hits += 1
+                elif key not in jobs:
+                    jobs[key] = (name, self.laps, self.max_time_s, params)
+        if jobs:
+            out = open(self.cache_path, 'a') if self.cache_path else None
+            try:
+                for key, result in pool.imap_unordered(run_job, jobs.values(), chunksize=4):
+                    self.cache[key] = result
+                    self.runs += 1
+                    if out:
+                        out.write(json.dumps({'key': key, 'result': result}) + "\n")
+            finally:
+                if out:
+                    out.close()
+        summaries = [self.summarise(params) for params in full]
+        for s in summaries:
+            self.results[json.dumps(s['params'], sort_keys=True)] = s
+        return summaries
+
+    def summarise(self, params):
+        per_track = [self.cache[cache_key(name, self.laps, params)] for name in self.tracks]
+        ok = all(r['laps'] == self.laps for r in per_track)
+        losses = sum(r['line_losses'] for r in per_track)
+        laps = sum(r['laps'] for r in per_track)
+        s = {
+            'params': params,
+            'ok': ok,
+            'lap_s': None,
+            'loss_rate': round(losses / max(laps, 1), 3),
+            'tracking_rms_mm': round(sum(r['tracking_rms_mm'] for r in per_track) / len(per_track), 2),
+            'cost': FAILED_COST - laps,  # more laps done is still better
+        }
+        if ok:
+            lap = sum(sum(r['lap_times_s']) / len(r['lap_times_s']) for r in per_track) / len(per_track)
+            s['lap_s'] = round(lap, 3)
+            s['cost'] = lap * (1 + self.loss_weight * s['loss_rate'])
+        return s
+
+    def pareto_front(self):
+        "Finished parameter sets that no other set beats on both lap time and loss rate"
+        done = sorted((s for s in self.results.values() if s['ok']),
+                      key=lambda s: (s['lap_s'], s['loss_rate']))
+        front = []
+        for s in done:
+            if not front or s['loss_rate'] < front[-1]['loss_rate']:
+                front.append(s)
+        return front
+
+
+# ------------------------
+# Search strategies
+# ------------------------
+def grid(space, levels):
+    axes = []
+    for name, low, high, kind in space:
+        values = sorted({quantise(low + i * (high - low) / max(levels - 1, 1), low, high, kind)
+                         for i in range(levels)})
+        axes.append((name, values))
+    points = [{}]
+    for name, values in axes:
+        points = [dict(p, **{name: v}) for p in points for v in values]
+    return points
+
+
+def random_points(space, samples, rng):
+    return [from_unit([rng.random() for _ in space], space) for _ in range(samples)]
+
+
+def cmaes(tuner, pool, space, generations, population, rng, report):
+    """
+    Separable CMA-ES (diagonal covariance) in the unit cube, starting from
+    the firmware defaults with step size 0.3.
+    """
+    defaults = {q: d for q, _, _, d in PARAMS}
+    n = len(space)
+    mean = [min(max((defaults.get(name, (low + high) / 2) - low) / (high - low), 0.0), 1.0)
+            for name, low, high, _ in space]
+    sigma = 0.3
+    var = [1.0] * n
+    lam = population or 4 + int(3 * math.log(n))
+    mu = lam // 2
+    weights = [math.log(mu + 0.5) - math.log(i + 1) for i in range(mu)]
+    total = sum(weights)
+    weights = [w / total for w in weights]
+    mueff = 1 / sum(w * w for w in weights)
+    cs = (mueff + 2) / (n + mueff + 5)
+    damps = 1 + 2 * max(0.0, math.sqrt((mueff - 1) / (n + 1)) - 1) + cs
+    cmu = min(1.0, (n + 2) / 3 * mueff / (n * n + 2 * n + 4 * mueff))
+    chi_n = math.sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n * n))
+    ps = [0.0] * n
+    for gen in range(generations):
+        zs = [[rng.gauss(0, 1) for _ in range(n)] for _ in range(lam)]
+        xs = [[min(max(mean[i] + sigma * math.sqrt(var[i]) * z[i], 0.0), 1.0) for i in range(n)]
+              for z in zs]
+        summaries = tuner.evaluate([from_unit(x, space) for x in xs], pool)
+        order = sorted(range(lam), key=lambda k: summaries[k]['cost'])[:mu]
+        old = mean
+        mean = [sum(weights[j] * xs[k][i] for j, k in enumerate(order)) for i in range(n)]
+        step = [(mean[i] - old[i]) / sigma for i in range(n)]
+        c = math.sqrt(cs * (2 - cs) * mueff)
+        ps = [(1 - cs) * ps[i] + c * step[i] / math.sqrt(var[i]) for i in range(n)]
+        var = [(1 - cmu) * var[i]
+               + cmu * sum(weights[j] * ((xs[k][i] - old[i]) / sigma) ** 2 for j, k in enumerate(order))
+               for i in range(n)]
+        norm = math.sqrt(sum(p * p for p in ps))
+        sigma = min(sigma * math.exp(cs / damps * (norm / chi_n - 1)), 0.5)
+        best = summaries[order[0]]
+        report("gen %d: best cost %.2f, sigma %.3f, %s" % (gen + 1, best['cost'], sigma, best['params']))
+
+
+# ------------------------
+# Output
+# ------------------------
+def query_string(params):
+    "What the web form sends for these parameters"
+    return "&".join("%s=%s" % (k, params[k]) for k in sorted(params))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="parallel LineFollower parameter tuner")
+    parser.add_argument('strategy', choices=('grid', 'random', 'cmaes'))
+    parser.add_argument('--tracks', default=",".join(track.TRACKS))
+    parser.add_argument('--laps', type=int, default=2)
+    parser.add_argument('--max-time', type=float, default=120.0, help="simulated seconds per run")
+    parser.add_argument('--levels', type=int, default=3, help="grid values per parameter")
+    parser.add_argument('--samples', type=int, default=500, help="random draws")
+    parser.add_argument('--generations', type=int, default=25, help="cmaes generations")
+    parser.add_argument('--population', type=int, default=0, help="cmaes population (0 = 4 + 3 ln n)")
+    parser.add_argument('--loss-weight', type=float, default=1.0,
+                        help="cmaes cost: lap time * (1 + weight * losses per lap)")
+    parser.add_argument('--set', action='append', default=[], metavar="NAME=VALUE",
+                        help="fixed parameter, e.g. mode=pid")
+    parser.add_argument('--range', action='append', default=[], metavar="NAME=LOW:HIGH",
+                        help="search this parameter over [LOW, HIGH]")
+    parser.add_argument('--only', help="comma-separated subset of the six knobs to search ('' for none)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=0, help="processes (0 = one per CPU)")
+    parser.add_argument('--cache', default="tune_cache.jsonl", help="result cache, '' to disable")
+    parser.add_argument('--export', help="write the Pareto front as presets to this JSON file")
+    parser.add_argument('--json', action='store_true', help="print the front as JSON")
+    args = parser.parse_args()
+
+    space = parse_space(args.range, args.only.split(",") if args.only is not None else None)
+    fixed = dict(s.split("=", 1) for s in args.set)
+    tuner = Tuner(args.tracks.split(","), args.laps, args.max_time, fixed,
+                  args.cache or None, args.workers or None, args.loss_weight)
+    rng = random.Random(args.seed)
+
+    def report(line):
+        print(line, flush=True)
+
+    with multiprocessing.Pool(tuner.workers) as pool:
+        if args.strategy == 'grid':
+            points = grid(space, args.levels)
+            report("grid: %d parameter sets x %d tracks" % (len(points), len(tuner.tracks)))
+            tuner.evaluate(points, pool)
+        elif args.strategy == 'random':
+            tuner.evaluate(random_points(space, args.samples, rng), pool)
+        else:
+            cmaes(tuner, pool, space, args.generations, args.population, rng, report)
+
+    front = tuner.pareto_front()
+    finished = sum(1 for s in tuner.results.values() if s['ok'])
+    report("%d parameter sets, %d finished; %d simulations run, %d cache hits"
+           % (len(tuner.results), finished, tuner.runs, tuner.cache_hits))
+    if args.json:
+        print(json.dumps(front, indent=2))
+    else:
+        print("%8s %10s %8s  %s" % ("lap (s)", "loss/lap", "rms mm", "parameters"))
+        for s in front:
+            print("%8.2f %10.3f %8.2f  %s" % (s['lap_s'], s['loss_rate'], s['tracking_rms_mm'],
+                                              query_string(s['params'])))
+    if args.export:
+        presets = [{'name': "tuned-%d" % (i + 1), 'params': s['params'],
+                    'lap_s': s['lap_s'], 'loss_rate': s['loss_rate'], 'tracks': tuner.tracks}
+                   for i, s in enumerate(front)]
+        with open(args.export, 'w') as f:
+            json.dump(presets, f, indent=2)
+        report("wrote %d presets to %s" % (len(presets), args.export))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+# picobot_telemetry.py
+# The control loop's per-tick snapshot, pushed to browsers as Server-Sent
+# Events or polled as a fixed 16-byte binary record.
+#
+# Stream format (text/event-stream):
+#   data: <tick>,<sensor bits>,<action code>,<status code>
+#       sensor bit i = sensors[i] (bit 0 is the right sensor); action and
+#       status codes index picobot_line.ACTIONS / picobot_line.STATUSES
+#   event: params
+#   data: {"speed": 30, ...}
+#       sent on subscribe and again only when a parameter changes
+#
+# Binary status record (GET /status.bin, little-endian, STATUS_FORMAT):
+#   offset size field
+#   0      1    version, STATUS_VERSION
+#   1      1    sensor bits, as above
+#   2      1    action code
+#   3      1    status code
+#   4      1    search step; search intensity is 1.5 ** step (capped at 255)
+#   5      1    flags: bit 0 (STATUS_RUNNING) set while the robot runs
+#   6      2    params version, changes whenever a parameter changes
+#   8      4    tick counter (wraps at 2**30)
+#   12     4    tick timestamp, ticks_ms() (wraps at 2**30)
+#
+# With a StatusExchange the control tick publishes this record through a
+# picobot_exchange.DoubleBuffer and the web side reads it from there, never
+# from the follower, so it always sees one whole tick even when the control
+# loop runs on the other core. The parameters in effect go with it as a
+# reference to LineFollower.applied, which the control core replaces rather
+# than modifies.
+import json
+import ustruct
+from picobot_line import ACTION_CODES, ACTIONS, STATUSES, PARAMS
+from picobot_exchange import DoubleBuffer
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+SSE_HEAD = (b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Access-Control-Allow-Origin: *\r\n"
+            b"Connection: keep-alive\r\n\r\n"
+            b"retry: 1000\n\n")
+
+
+STATUS_FORMAT = '<BBBBBBHII'
+# Largest small int mask: a wider one would make every pack allocate a big int
+TICKS_MASK = 0x3FFFFFFF
+STATUS_SIZE = 16
+STATUS_VERSION = 1
+STATUS_FIELDS = ('version', 'sensor_bits', 'action', 'status',
+                 'search_step', 'flags', 'params_version', 'tick', 'tick_ms')
+STATUS_RUNNING = 0x01
+
+
+def decode_status(data):
+    "Binary status record -> dict of STATUS_FIELDS (host-side decoder)"
+    if len(data) < STATUS_SIZE or data[0] != STATUS_VERSION:
+        raise ValueError("not a version %d status record" % STATUS_VERSION)
+    return dict(zip(STATUS_FIELDS, ustruct.unpack_from(STATUS_FORMAT, data)))
+
+
+def pack_status(buf, offset, f):
+    "The status record of LineFollower f into buf at offset"
+    step = f.search_step
+    ustruct.pack_into(STATUS_FORMAT, buf, offset,
+                      STATUS_VERSION, f.sensor_bits, ACTION_CODES[f.action],
+                      f.status_code(), step if step < 255 else 255,
+                      STATUS_RUNNING if f.robot_running else 0,
+                      f.params_version & 0xFFFF, f.ticks & TICKS_MASK, f.tick_ms)
+
+
+class StatusExchange:
+    """
+    The status record of the last tick, double-buffered: record() runs at
+    the end of each control tick (LineFollower.exchange), the other methods
+    on the web side.
+    """
+    def __init__(self):
+        self.buffer = DoubleBuffer(STATUS_SIZE)
+        self._scratch = bytearray(STATUS_SIZE)
+        self.values = {attr: default for name, attr, kind, default in PARAMS}
+
+    def record(self, f):
+        # Before the record, so whoever sees its params version sees these
+        self.values = f.applied
+        pack_status(self.buffer.back(), 0, f)
+        self.buffer.publish()
+
+    def read_into(self, out, offset=0):
+        return self.buffer.read_into(out, offset)
+
+    def fields(self):
+        "STATUS_FIELDS of the last tick, as a tuple"
+        self.buffer.read_into(self._scratch)
+        return ustruct.unpack_from(STATUS_FORMAT, self._scratch)
+
+    def params(self):
+        "Parameters in effect at the last tick, by query name"
+        values = self.values
+        return {name: values[attr] for name, attr, kind, default in PARAMS}
+
+    def running(self):
+        return bool(self.fields()[5] & STATUS_RUNNING)
+
+    def snapshot(self):
+        "The /sensors response body, as LineFollower.snapshot() but from the last tick"
+        version, bits, action, status = self.fields()[:4]
+        return {
+            'sensors': [(bits >> i) & 1 for i in range(5)],
+            'action': ACTIONS[action],
+            'status': STATUSES[status],
+            'params': self.params()
+        }
+
+    def stats(self):
+        return {'published': self.buffer.seq, 'retries': self.buffer.retries}
+
+
+class StatusRecord:
+    """
+    Complete HTTP response for the binary status record in one preallocated
+    buffer: the headers are written once, pack() only refills the payload.
+    """
+    HEAD = (b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: application/octet-stream\r\n"
+            b"Content-Length: 16\r\n"
+            b"Cache-Control: no-store\r\n"
+            b"Access-Control-Allow-Origin: *\r\n"
+            b"Connection: close\r\n\r\n")
+
+    def __init__(self, follower, exchange=None):
+        """
+        exchange - StatusExchange to read the record from instead of
+                   packing it from the follower
+        """
+        self.follower = follower
+        self.exchange = exchange
+        self.response = bytearray(len(self.HEAD) + STATUS_SIZE)
+        self.response[:len(self.HEAD)] = self.HEAD
+        self.offset = len(self.HEAD)
+        self.payload = memoryview(self.response)[self.offset:]
+
+    def pack(self):
+        if self.exchange is not None:
+            self.exchange.read_into(self.response, self.offset)
+        else:
+            pack_status(self.response, self.offset, self.follower)
+        return self.response
+
+    async def send(self, writer):
+        writer.write(self.pack())
+        await writer.drain()
+
+
+class TelemetryHub:
+    def __init__(self, follower, rate_ms=100, max_clients=3, write_timeout_ms=500,
+                 exchange=None):
+        """
+        follower - the LineFollower whose snapshot is streamed
+        exchange - StatusExchange to take the tick's fields from, instead of
+                   reading them off the follower
+        rate_ms - how often the hub looks for a new tick; frames are only
+                  sent when the control loop has ticked since the last one
+        """
+        self.follower = follower
+        self.exchange = exchange
+        self.rate_ms = rate_ms
+        self.max_clients = max_clients
+        self.write_timeout_ms = write_timeout_ms
+        self.clients = []  # [writer, params_version sent]
+        self.frames = 0
+        self.dropped = 0
+
+    async def subscribe(self, writer):
+        "Takes over an HTTP connection; returns False if the hub is full"
+        if len(self.clients) >= self.max_clients:
+            return False
+        writer.write(SSE_HEAD)
+        await writer.drain()
+        self.clients.append([writer, -1])
+        return True
+
+    async def _send(self, client, data):
+        writer = client[0]
+        try:
+            writer.write(data)
+            await asyncio.wait_for(writer.drain(), self.write_timeout_ms / 1000)
+            return True
+        except Exception:
+            # Slow or gone; the browser's EventSource reconnects by itself
+            self.dropped += 1
+            self.clients.remove(client)
+            try:
+                writer.close()
+            except Exception:
+                pass
+            return False
+
+    async def run(self):
+        f = self.follower
+        last_tick = -1
+        while True:
+            await asyncio.sleep_ms(self.rate_ms)
+            if not self.clients:
+                continue
+            if self.exchange is not None:
+                (version, bits, action, status, step, flags, params_version,
+                 tick, tick_ms) = self.exchange.fields()
+            else:
+                tick, bits, action, status = (f.ticks, f.sensor_bits,
+                                              ACTION_CODES[f.action], f.status_code())
+                params_version = f.params_version & 0xFFFF
+            if tick == last_tick:
+                continue
+            last_tick = tick
+            frame = ("data: %d,%d,%d,%d\n\n" % (tick, bits, action, status)).encode()
+            params = None
+            for client in self.clients[:]:
+                if client[1] != params_version:
+                    if params is None:
+                        values = f.params() if self.exchange is None else self.exchange.params()
+                        params = ("event: params\ndata: " + json.dumps(values) + "\n\n").encode()
+                    if not await self._send(client, params):
+                        continue
+                    client[1] = params_version
+                await self._send(client, frame)
+            self.frames += 1
+
+    def stats(self):
+        return {'clients': len(self.clients), 'frames': self.frames,
+                'dropped': self.dropped, 'rate_ms': self.rate_ms}
@@ -0,0 +1,387 @@
+# picobot_web.py
+# The web page, style sheet and script, as bytes constants. Frozen into the
+# firmware (or compiled to .mpy) they are read from flash, not copied to RAM;
+# picobot_assets imports this module only when an asset is first built, and a
+# file of the same name under www/ on the filesystem takes precedence.
+
+INDEX_HTML = b"""<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="UTF-8">
+<meta name="viewport" content="width=device-width, initial-scale=1.0">
+<title>PicoBot Line Follower</title>
+<link rel="stylesheet" href="/style.css">
+</head>
+<body>
+<h1>PicoBot Line Follower</h1>
+
+<div class="status-panel">
+    <div class="section-title">Robot Status</div>
+    <div class="sensor-container">
+        <div class="sensor-box" id="left">L</div>
+        <div class="sensor-box" id="lmid">LM</div>
+        <div class="sensor-box" id="center">C</div>
+        <div class="sensor-box" id="rmid">RM</div>
+        <div class="sensor-box" id="right">R</div>
+    </div>
+    <div class="status-container">
+        <div id="action">Action: -</div>
+        <div id="status">Status: -</div>
+    </div>
+</div>
+
+<div class="control-panel">
+    <div class="section-title">Robot Control</div>
+    <div>
+        <button class="start-btn" id="startBtn">START</button>
+        <button class="stop-btn" id="stopBtn">STOP</button>
+    </div>
+    <div class="section-title">Adjustments</div>
+    <div class="param-group">
+        <div class="param"><div class="label">Speed</div><input type="number" id="speed" value="30" min="0" max="100"></div>
+        <div class="param"><div class="label">Slight</div><input type="number" id="slight" value="0.9" step="0.05" min="0" max="1"></div>
+        <div class="param"><div class="label">Mild</div><input type="number" id="mild" value="0.75" step="0.05" min="0" max="1"></div>
+        <div class="param"><div class="label">Hard</div><input type="number" id="hard" value="0.6" step="0.05" min="0" max="1"></div>
+        <div class="param"><div class="label">Grace (ms)</div><input type="number" id="grace" value="800" min="0" max="5000"></div>
+        <div class="param"><div class="label">Search</div><input type="number" id="search" value="0.4" step="0.05" min="0" max="1"></div>
+    </div>
+    <div class="param-group">
+        <div class="param"><div class="label">Steering</div><select id="mode"><option value="bucket">Bucket</option><option value="pid">PID</option></select></div>
+        <div class="param"><div class="label">Kp</div><input type="number" id="kp" value="30" step="1" min="0"></div>
+        <div class="param"><div class="label">Ki</div><input type="number" id="ki" value="0" step="0.5" min="0"></div>
+        <div class="param"><div class="label">Kd</div><input type="number" id="kd" value="2" step="0.1" min="0"></div>
+    </div>
+    <button class="update-btn" id="updateBtn">Update Parameters</button>
+    <div class="section-title">Presets</div>
+    <div class="param-group">
+        <select id="preset"></select>
+        <button class="preset-btn" id="activateBtn">Use</button>
+    </div>
+    <div class="param-group">
+        <input type="text" id="presetName" maxlength="16" placeholder="name">
+        <button class="preset-btn" id="savePresetBtn">Save</button>
+        <button class="preset-btn" id="deletePresetBtn">Delete</button>
+    </div>
+</div>
+
+<script src="/script.js"></script>
+</body>
+</html>"""
+
+STYLE_CSS = b"""body { 
+    font-family: Arial, sans-serif; 
+    text-align: center; 
+    margin: 0;
+    padding: 10px;
+    background-color: #f0f0f0;
+}
+.status-panel {
+    background-color: white;
+    padding: 15px;
+    border-radius: 10px;
+    box-shadow: 0 2px 5px rgba(0,0,0,0.1);
+    margin-bottom: 15px;
+}
+.control-panel {
+    background-color: white;
+    padding: 15px;
+    border-radius: 10px;
+    box-shadow: 0 2px 5px rgba(0,0,0,0.1);
+    margin-bottom: 15px;
+}
+.param-group {
+    display: flex;
+    flex-wrap: wrap;
+    justify-content: center;
+    gap: 10px;
+    margin: 10px 0;
+}
+.param {
+    display: flex;
+    flex-direction: column;
+    align-items: center;
+    min-width: 80px;
+}
+button { 
+    font-size: 1.5em; 
+    padding: 15px 30px; 
+    margin: 10px;
+    min-width: 120px;
+    border: none;
+    border-radius: 8px;
+    cursor: pointer;
+}
+.start-btn {
+    background-color: #4CAF50;
+    color: white;
+}
+.stop-btn {
+    background-color: #f44336;
+    color: white;
+}
+.update-btn {
+    background-color: #2196F3;
+    color: white;
+    font-size: 1.2em;
+    padding: 10px 20px;
+}
+.preset-btn {
+    background-color: #607D8B;
+    color: white;
+    font-size: 1em;
+    padding: 8px 16px;
+    margin: 0;
+    min-width: 80px;
+}
+input[type=text] {
+    font-size: 1.2em;
+    width: 140px;
+    padding: 5px;
+    border: 1px solid #ccc;
+    border-radius: 4px;
+}
+input[type=number], select { 
+    font-size: 1.2em; 
+    width: 80px; 
+    text-align: center;
+    padding: 5px;
+    border: 1px solid #ccc;
+    border-radius: 4px;
+}
+.sensor-container {
+    display: flex;
+    justify-content: center;
+    flex-wrap: wrap;
+    margin: 15px 0;
+}
+.sensor-box { 
+    width: 50px; 
+    height: 50px; 
+    line-height: 50px; 
+    margin: 5px; 
+    border: 2px solid #000; 
+    font-weight: bold; 
+    font-size: 1.2em;
+    border-radius: 8px;
+}
+.status-container {
+    margin: 15px 0;
+    font-size: 1.2em;
+}
+#action, #status {
+    margin: 8px 0;
+    font-weight: bold;
+    padding: 8px;
+    border-radius: 5px;
+    background-color: #f8f8f8;
+}
+.label {
+    font-weight: bold;
+    margin-bottom: 5px;
+    font-size: 0.9em;
+}
+.section-title {
+    font-size: 1.3em;
+    font-weight: bold;
+    margin: 10px 0;
+    color: #333;
+}"""
+
+SCRIPT_JS = b"""// Initialize with current parameters
+function loadParams() {
+    fetch("/sensors")
+    .then(response => response.json())
+    .then(data => {
+        if (data.params) showParams(data.params);
+    })
+    .catch(err => console.log("Error loading params:", err));
+}
+
+// Parameter inputs, by their query names (picobot_line.PARAMS)
+const PARAM_IDS = ["speed", "slight", "mild", "hard", "grace", "search", "mode", "kp", "ki", "kd"];
+
+function paramQuery() {
+    return PARAM_IDS.map(id => "&" + id + "=" + document.getElementById(id).value).join("");
+}
+
+// Dead-man heartbeat (picobot_safety): while the robot runs on this page's
+// command it has to hear from the page within its timeout, or it stops. The
+// beats carry the session number the start returned; once another page has
+// started the robot they are refused (409) and this page stops beating
+let heartbeat = null;
+let session = 0;
+
+function beat() {
+    fetch("/heartbeat?session=" + session)
+    .then(response => {
+        if (response.status == 409) throw "superseded";
+        return response.text();
+    })
+    .then(text => {
+        const timeout = parseInt(text);
+        if (heartbeat !== null) heartbeat = timeout > 0 ? setTimeout(beat, Math.max(timeout / 4, 50)) : null;
+    })
+    .catch(err => {
+        if (heartbeat === null) return;
+        heartbeat = err === "superseded" ? null : setTimeout(beat, 50);
+    });
+}
+
+function startRobot() {
+    fetch("/?action=start" + paramQuery())
+    .then(response => response.ok ? response.text() : null)
+    .then(text => {
+        if (text === null) return;
+        session = parseInt(text);
+        if (heartbeat === null) heartbeat = setTimeout(beat, 50);
+    })
+    .catch(err => console.log("Start error:", err));
+}
+
+function stopRobot() {
+    clearTimeout(heartbeat);
+    heartbeat = null;
+    fetch("/?action=stop");
+}
+
+function updateParams() {
+    fetch("/?action=update" + paramQuery());
+}
+
+// Codes used by the /events stream (picobot_line.ACTIONS / STATUSES)
+const ACTIONS = ["FORWARD", "SLIGHT RIGHT", "MILD RIGHT", "HARD RIGHT",
+                 "SLIGHT LEFT", "MILD LEFT", "HARD LEFT",
+                 "ON JUNCTION", "LINE LOST", "SEARCHING"];
+const STATUSES = ["Stopped", "Running", "Line lost - searching",
+                  "Line lost - stopped", "Mission accomplished"];
+
+function showParams(params) {
+    PARAM_IDS.forEach(id => {
+        if (id in params) document.getElementById(id).value = params[id];
+    });
+}
+
+function showState(vals, action, status) {
+    document.getElementById("left").style.backgroundColor = vals[4]==1?"green":"white";
+    document.getElementById("lmid").style.backgroundColor = vals[3]==1?"green":"white";
+    document.getElementById("center").style.backgroundColor = vals[2]==1?"green":"white";
+    document.getElementById("rmid").style.backgroundColor = vals[1]==1?"green":"white";
+    document.getElementById("right").style.backgroundColor = vals[0]==1?"green":"white";
+
+    document.getElementById("action").innerText = "Action: "+action;
+    document.getElementById("status").innerText = "Status: "+status;
+    
+    // Color code the status based on state
+    const statusElem = document.getElementById("status");
+    if (status.includes("Running")) {
+        statusElem.style.color = "green";
+    } else if (status.includes("Stopped") || status.includes("Mission accomplished")) {
+        statusElem.style.color = "blue";
+    } else if (status.includes("lost")) {
+        statusElem.style.color = "orange";
+    } else {
+        statusElem.style.color = "black";
+    }
+}
+
+// Decodes the 16-byte /status.bin record (layout in picobot_telemetry.py)
+function decodeStatus(buf) {
+    const v = new DataView(buf);
+    if (v.byteLength < 16 || v.getUint8(0) != 1) return null;
+    return {
+        sensorBits: v.getUint8(1),
+        action: v.getUint8(2),
+        status: v.getUint8(3),
+        searchStep: v.getUint8(4),
+        paramsVersion: v.getUint16(6, true),
+        tick: v.getUint32(8, true),
+        tickMs: v.getUint32(12, true)
+    };
+}
+
+function updateSensors() {
+    fetch("/status.bin")
+    .then(response => response.arrayBuffer())
+    .then(buf => {
+        const s = decodeStatus(buf);
+        if (!s) return;
+        const vals = [0, 1, 2, 3, 4].map(i => (s.sensorBits >> i) & 1);
+        showState(vals, ACTIONS[s.action], STATUSES[s.status]);
+    })
+    .catch(err => console.log("Sensor update error:", err));
+}
+
+// Frames pushed by the control loop: "tick,sensor bits,action,status"
+function startEvents() {
+    const events = new EventSource("/events");
+    events.onmessage = function(e) {
+        const f = e.data.split(",");
+        const bits = parseInt(f[1]);
+        const vals = [0, 1, 2, 3, 4].map(i => (bits >> i) & 1);
+        showState(vals, ACTIONS[parseInt(f[2])], STATUSES[parseInt(f[3])]);
+    };
+    events.addEventListener("params", e => showParams(JSON.parse(e.data)));
+}
+
+// Presets on the robot's flash (picobot_presets)
+function showPresets(data) {
+    const select = document.getElementById("preset");
+    select.innerHTML = "";
+    Object.keys(data.presets).sort().forEach(name => {
+        const option = document.createElement("option");
+        option.value = option.text = name;
+        option.selected = name == data.active;
+        select.appendChild(option);
+    });
+}
+
+function presetAction(action, name, extra) {
+    return fetch("/presets?action=" + action + "&name=" + encodeURIComponent(name) + (extra || ""))
+    .then(response => {
+        if (!response.ok) return response.text().then(t => { throw t; });
+        return response.json();
+    })
+    .then(showPresets)
+    .catch(err => alert("Preset " + action + " failed: " + err));
+}
+
+function loadPresets() {
+    fetch("/presets")
+    .then(response => response.json())
+    .then(showPresets)
+    .catch(err => console.log("Error loading presets:", err));
+}
+
+function activatePreset() {
+    const name = document.getElementById("preset").value;
+    if (name) presetAction("activate", name);
+}
+
+function savePreset() {
+    const name = document.getElementById("presetName").value || document.getElementById("preset").value;
+    if (name) presetAction("save", name, paramQuery());
+}
+
+function deletePreset() {
+    const name = document.getElementById("preset").value;
+    if (name && confirm("Delete preset " + name + "?")) presetAction("delete", name);
+}
+
+// Set up event listeners
+document.getElementById("startBtn").addEventListener("click", startRobot);
+document.getElementById("stopBtn").addEventListener("click", stopRobot);
+document.getElementById("updateBtn").addEventListener("click", updateParams);
+document.getElementById("activateBtn").addEventListener("click", activatePreset);
+document.getElementById("savePresetBtn").addEventListener("click", savePreset);
+document.getElementById("deletePresetBtn").addEventListener("click", deletePreset);
+
+// Stream telemetry where supported, otherwise poll sensors every 200ms
+window.addEventListener("load", function() {
+    loadPresets();
+    if (window.EventSource) {
+        startEvents();
+    } else {
+        loadParams();
+        setInterval(updateSensors, 200);
+    }
+});"""